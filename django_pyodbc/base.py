@@ -48,6 +48,7 @@ import os
 import re
 import sys
 import warnings
+from functools import lru_cache
 
 from django import VERSION as DjangoVersion
 from django.conf import settings
@@ -55,8 +56,11 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db import utils
 from django.db.backends.signals import connection_created
 
+from django_pyodbc import (capabilities, cursorcache, inputsizes, instrumentation, plans,
+                           pool, tagging)
 from django_pyodbc.client import DatabaseClient
-from django_pyodbc.compat import binary_type, text_type, timezone
+from django_pyodbc.compat import (SQL_CACHE_MAX_LENGTH, SQL_CACHE_SIZE, binary_type,
+                                  text_type, timezone)
 from django_pyodbc.creation import DatabaseCreation
 from django_pyodbc.introspection import DatabaseIntrospection
 from django_pyodbc.operations import DatabaseOperations
@@ -99,18 +103,24 @@ else:
 DatabaseError = Database.Error
 IntegrityError = Database.IntegrityError
 
+ISOLATION_LEVELS = ('READ UNCOMMITTED', 'READ COMMITTED', 'REPEATABLE READ',
+                    'SNAPSHOT', 'SERIALIZABLE')
+
 class DatabaseFeatures(BaseDatabaseFeatures):
     can_use_chunked_reads = False
     can_return_id_from_insert = True
+    # Multi-row inserts return their ids through MERGE ... OUTPUT (2008+)
+    can_return_ids_from_bulk_insert = True
+    can_return_rows_from_bulk_insert = True
     supports_microsecond_precision = False
     supports_regex_backreferencing = False
     supports_subqueries_in_group_by = False
     supports_transactions = True
     #uses_savepoints = True
     allow_sliced_subqueries = False
-    supports_paramstyle_pyformat = False
+    supports_paramstyle_pyformat = True
 
-    has_bulk_insert = False
+    has_bulk_insert = True
     # DateTimeField doesn't support timezones, only DateTimeOffsetField
     supports_timezones = False
     supports_sequence_reset = False
@@ -132,6 +142,18 @@ class DatabaseWrapper(BaseDatabaseWrapper):
     datefirst = 7
     Database = Database
     limit_table_list = False
+    pool_options = None
+    capability_cache = {}
+    session_init = {}
+    chunked_reads = None
+    fast_executemany = None
+    string_param_sizes = True
+    compiled_sql_cache = None
+    cursor_cache = None
+    instrumentation = None
+    query_budget = None
+    slow_plans = None
+    sql_tags = None
 
     # Collations:       http://msdn2.microsoft.com/en-us/library/ms184391.aspx
     #                   http://msdn2.microsoft.com/en-us/library/ms179886.aspx
@@ -192,6 +214,80 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             self.driver_needs_utf8 = options.get('driver_needs_utf8', None)
             self.limit_table_list = options.get('limit_table_list', False)
 
+            # pool connections per connection string if asked to
+            self.pool_options = options.get('pool', None)
+            if self.pool_options is True:
+                self.pool_options = {}
+
+            # remember what we detect about the server and driver
+            self.capability_cache = options.get('capability_cache', {})
+            if self.capability_cache is True:
+                self.capability_cache = {}
+            elif self.capability_cache is False:
+                self.capability_cache = None
+
+            self.session_init = options.get('session_init', {})
+            if self.session_init is True:
+                self.session_init = {}
+
+            # stream QuerySet.iterator() results with any driver
+            self.chunked_reads = options.get('chunked_reads', None)
+            if self.chunked_reads is True:
+                self.chunked_reads = {}
+
+            # bind executemany() parameter arrays in one go
+            self.fast_executemany = options.get('fast_executemany', None)
+            if self.fast_executemany is True:
+                self.fast_executemany = {}
+            elif self.fast_executemany is False:
+                self.fast_executemany = None
+
+            # bind strings as varchar/nvarchar with bucketed lengths
+            self.string_param_sizes = options.get('string_param_sizes',
+                not (options.get('is_db2') or options.get('openedge')))
+
+            # reuse the SQL compiled for queries of the same structure
+            self.compiled_sql_cache = options.get('compiled_sql_cache', None)
+            if self.compiled_sql_cache is True:
+                self.compiled_sql_cache = {}
+            elif self.compiled_sql_cache is False:
+                self.compiled_sql_cache = None
+
+            # run repeated statements on the cursor that prepared them
+            self.cursor_cache = options.get('cursor_cache', None)
+            if self.cursor_cache is True:
+                self.cursor_cache = {}
+            elif self.cursor_cache is False:
+                self.cursor_cache = None
+
+            # time statements and keep stats per fingerprint
+            self.instrumentation = options.get('instrumentation', None)
+            if self.instrumentation is True:
+                self.instrumentation = {}
+            elif self.instrumentation is False:
+                self.instrumentation = None
+
+            # count statements against the active QueryBudget
+            self.query_budget = options.get('query_budget', None)
+            if self.query_budget is True:
+                self.query_budget = {}
+            elif self.query_budget is False:
+                self.query_budget = None
+
+            # capture the execution plans of slow statements
+            self.slow_plans = options.get('slow_plans', None)
+            if self.slow_plans is True:
+                self.slow_plans = {}
+            elif self.slow_plans is False:
+                self.slow_plans = None
+
+            # prefix statements with a comment naming the view and model
+            self.sql_tags = options.get('sql_tags', None)
+            if self.sql_tags is True:
+                self.sql_tags = {}
+            elif self.sql_tags is False:
+                self.sql_tags = None
+
             # make lookup operators to be collation-sensitive if needed
             self.collation = options.get('collation', None)
             if self.collation:
@@ -212,6 +308,18 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         self.introspection = DatabaseIntrospection(self)
         self.validation = BaseDatabaseValidation(self)
         self.connection = None
+        self._pool = None
+        self._cursor_cache = None
+        # (connection, queries_logged, cursor) of django_pyodbc.fastpath
+        self._fast_path_cursor = None
+        self._session_init_sql = self._get_session_init_sql()
+        if self.chunked_reads is not None:
+            self.features.can_use_chunked_reads = True
+        if self.ops.is_db2 or self.ops.is_openedge or self.fast_executemany is not None:
+            # With fast_executemany, bulk_create() sends its rows as one
+            # batch rather than reading back their primary keys
+            self.features.can_return_ids_from_bulk_insert = False
+            self.features.can_return_rows_from_bulk_insert = False
 
 
     def get_connection_params(self):
@@ -333,75 +441,307 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         connectionstring = ';'.join(cstr_parts)
         return connectionstring
 
+    def _connect(self, connstr):
+        autocommit = self.settings_dict['OPTIONS'].get('autocommit', False)
+        if self.unicode_results:
+            return Database.connect(connstr,
+                    autocommit=autocommit,
+                    unicode_results='True')
+        return Database.connect(connstr, autocommit=autocommit)
+
+    def _get_pool(self, connstr):
+        # Pooled connections keep the session options they were set up
+        # with, so only connections set up alike can share a pool
+        key = (connstr, self.settings_dict['OPTIONS'].get('autocommit', False),
+               self.unicode_results, tuple(self._session_init_sql))
+        return pool.get_pool(key, lambda: self._connect(connstr),
+                             ping=self._ping, reset=self._reset_connection,
+                             **self.pool_options)
+
+    def _ping_sql(self):
+        if self.ops.is_db2:
+            return "SELECT 1 FROM SYSIBM.SYSDUMMY1"
+        elif self.ops.is_openedge:
+            return "SELECT 1 FROM SYSPROGRESS.SYSCALCTABLE"
+        return "SELECT 1"
+
+    def _ping(self, connection):
+        try:
+            connection.cursor().execute(self._ping_sql()).fetchall()
+        except Database.Error:
+            return False
+        return True
+
+    def _reset_connection(self, connection):
+        """
+        Put a connection that is going back to the pool in the state a fresh
+        connection would be in: no open transaction and the configured
+        autocommit mode. Other session state, such as temporary tables and
+        SET options, is kept: sp_reset_connection can only be sent by the
+        driver's own pooling.
+        """
+        if not connection.autocommit:
+            connection.rollback()
+        connection.autocommit = self.settings_dict['OPTIONS'].get('autocommit', False)
+        if self.slow_plans is not None and self.slow_plans.get('sample_rate'):
+            # Sampled statements turn STATISTICS XML off themselves; this
+            # is in case one of them failed to
+            cursor = connection.cursor()
+            cursor.execute('SET STATISTICS XML OFF')
+            cursor.close()
+
+    def is_usable(self):
+        return self._ping(self.connection)
+
+    def _close(self):
+        if self._fast_path_cursor is not None:
+            # The pool may hand the connection to another wrapper, and the
+            # cursor may hold a cached cursor closed below
+            cursor, self._fast_path_cursor = self._fast_path_cursor[2], None
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        if self._cursor_cache is not None:
+            self._cursor_cache.close()
+            self._cursor_cache = None
+        if self.connection is not None and self._pool is not None:
+            with self.wrap_database_errors:
+                self._pool.checkin(self.connection)
+            return
+        return super(DatabaseWrapper, self)._close()
+
     def _cursor(self):
-        new_conn = False
-        settings_dict = self.settings_dict
+        return self._prepare_cursor(self.create_cursor())
 
+    def create_cursor(self, name=None):
+        new_conn = False
 
         if self.connection is None:
-            new_conn = True
-            connstr = self._get_connection_string()#';'.join(cstr_parts)
-            options = settings_dict['OPTIONS']
-            autocommit = options.get('autocommit', False)
-            if self.unicode_results:
-                self.connection = Database.connect(connstr,
-                        autocommit=autocommit,
-                        unicode_results='True')
+            connstr = self._connection_string = self._get_connection_string()
+            if self.pool_options is not None:
+                self._pool = self._get_pool(connstr)
+                self.connection, new_conn = self._pool.checkout()
             else:
-                self.connection = Database.connect(connstr,
-                        autocommit=autocommit)
+                self._pool = None
+                self.connection = self._connect(connstr)
+                new_conn = True
             connection_created.send(sender=self.__class__, connection=self)
 
         cursor = self.connection.cursor()
         if new_conn:
-            # Set date format for the connection. Also, make sure Sunday is
-            # considered the first day of the week (to be consistent with the
-            # Django convention for the 'week_day' Django lookup) if the user
-            # hasn't told us otherwise
-
-            if not self.ops.is_db2 and not self.ops.is_openedge:
-                # IBM's DB2 doesn't support this syntax and a suitable
-                # equivalent could not be found.
-                cursor.execute("SET DATEFORMAT ymd; SET DATEFIRST %s" % self.datefirst)
-            if self.ops.sql_server_ver < 2005:
-                self.creation.data_types['TextField'] = 'ntext'
-                self.data_types['TextField'] = 'ntext'
-                self.features.can_return_id_from_insert = False
-
-            ms_sqlncli = re.compile('^((LIB)?SQLN?CLI|LIBMSODBCSQL)')
-            self.drv_name = self.connection.getinfo(Database.SQL_DRIVER_NAME).upper()
-
-            # http://msdn.microsoft.com/en-us/library/ms131686.aspx
-            if self.ops.sql_server_ver >= 2005 and ms_sqlncli.match(self.drv_name) and self.MARS_Connection:
-                # How to to activate it: Add 'MARS_Connection': True
-                # to the DATABASE_OPTIONS dictionary setting
-                self.features.can_use_chunked_reads = True
-
-            if self.drv_name.startswith('LIBTDSODBC'):
-                # FreeTDS can't execute some sql queries like CREATE DATABASE etc.
-                # in multi-statement, so we need to commit the above SQL sentence(s)
-                # to avoid this
-                if not self.connection.autocommit:
-                    self.connection.commit()
-
-                freetds_version = self.connection.getinfo(Database.SQL_DRIVER_VER)
-                if self.driver_supports_utf8 is None:
-                    try:
-                        from distutils.version import LooseVersion
-                    except ImportError:
-                        warnings.warn(Warning('Using naive FreeTDS version detection. Install distutils to get better version detection.'))
-                        self.driver_supports_utf8 = not freetds_version.startswith('0.82')
-                    else:
-                        # This is the minimum version that properly supports
-                        # Unicode. Though it started in version 0.82, the
-                        # implementation in that version was buggy.
-                        self.driver_supports_utf8 = LooseVersion(freetds_version) >= LooseVersion('0.91')
-
-            elif self.driver_supports_utf8 is None:
-                self.driver_supports_utf8 = (self.drv_name == 'SQLSRV32.DLL'
-                                             or ms_sqlncli.match(self.drv_name))
-
-        return CursorWrapper(cursor, self.driver_supports_utf8, self.encoding, self)
+            self._init_connection_state(cursor)
+        elif self.drv_name is None:
+            # A pooled connection opened by another DatabaseWrapper; the
+            # session is set up already but we still need to know the driver.
+            self._detect_driver()
+
+        return CursorWrapper(cursor, self.driver_supports_utf8, self.encoding, self,
+                             self._get_cursor_cache())
+
+    def _get_cursor_cache(self):
+        if self.cursor_cache is None:
+            return None
+        cache = self._cursor_cache
+        if cache is None or cache.connection is not self.connection:
+            if cache is not None:
+                cache.close()
+            cache = self._cursor_cache = cursorcache.CursorCache(
+                self.connection, self.cursor_cache.get('size', cursorcache.DEFAULT_SIZE))
+        return cache
+
+    def _get_session_init_sql(self):
+        """
+        Return the list of statements run on every new connection, built from
+        the datefirst and session_init options.
+        """
+        if self.ops.is_db2 or self.ops.is_openedge:
+            # IBM's DB2 doesn't support this syntax and a suitable
+            # equivalent could not be found.
+            return []
+
+        # Set date format for the connection. Also, make sure Sunday is
+        # considered the first day of the week (to be consistent with the
+        # Django convention for the 'week_day' Django lookup) if the user
+        # hasn't told us otherwise
+        statements = ['SET DATEFORMAT ymd', 'SET DATEFIRST %s' % self.datefirst]
+
+        session_init = self.session_init
+        if session_init.get('nocount'):
+            statements.append('SET NOCOUNT ON')
+        if session_init.get('arithabort') is not None:
+            statements.append('SET ARITHABORT %s' % ('ON' if session_init['arithabort'] else 'OFF'))
+        isolation_level = session_init.get('isolation_level')
+        if isolation_level:
+            isolation_level = isolation_level.upper()
+            if isolation_level not in ISOLATION_LEVELS:
+                raise ImproperlyConfigured(
+                    "Invalid isolation_level %r in OPTIONS['session_init']; "
+                    "expected one of %s." % (isolation_level, ', '.join(ISOLATION_LEVELS)))
+            statements.append('SET TRANSACTION ISOLATION LEVEL %s' % isolation_level)
+        if session_init.get('lock_timeout') is not None:
+            statements.append('SET LOCK_TIMEOUT %d' % int(session_init['lock_timeout']))
+        statements.extend(session_init.get('statements', ()))
+        return statements
+
+    def chunked_cursor(self):
+        """
+        Return a cursor for QuerySet.iterator() that streams rows from the
+        server instead of fetching them all up front.
+
+        Without MARS a connection can't run other statements while a result
+        set is pending, so the rows are read over a dedicated connection. That
+        connection can't see uncommitted changes and could wait on locks held
+        by ours, so inside a transaction, or with autocommit off, the rows are
+        buffered instead, with a warning.
+        """
+        if self.chunked_reads is None:
+            return self.cursor()
+
+        arraysize = self.chunked_reads.get('arraysize', 'auto')
+        memory = self.chunked_reads.get('memory', 4 * 1024 * 1024)
+        if self.MARS_Connection:
+            cursor = self.create_cursor()
+            return self._prepare_cursor(StreamingCursorWrapper(
+                cursor.cursor, self.driver_supports_utf8, self.encoding, self, arraysize, memory))
+
+        if self.in_atomic_block or \
+                (self.connection is not None and not self.connection.autocommit):
+            warnings.warn("chunked_reads can't stream the rows of QuerySet.iterator() inside "
+                          "a transaction or with autocommit off; they are read up front. "
+                          "Turn on MARS_Connection to stream them.", RuntimeWarning)
+            cursor = self.create_cursor()
+            return self._prepare_cursor(BufferedCursorWrapper(
+                cursor.cursor, self.driver_supports_utf8, self.encoding, self))
+
+        if self.drv_name is None:
+            # make sure the driver has been detected
+            self.cursor().close()
+        connection, release = self._open_dedicated_connection()
+        return self._prepare_cursor(StreamingCursorWrapper(
+            connection.cursor(), self.driver_supports_utf8, self.encoding, self,
+            arraysize, memory, release))
+
+    def _open_dedicated_connection(self):
+        """
+        Return a connection separate from self.connection, and a callable that
+        gives it back when it is no longer needed.
+        """
+        if self._pool is not None:
+            pool = self._pool
+            connection, new_conn = pool.checkout()
+            release = lambda: pool.checkin(connection)
+        else:
+            connection = self._connect(self._get_connection_string())
+            new_conn = True
+            release = connection.close
+        if new_conn and self._session_init_sql:
+            try:
+                connection.cursor().execute('; '.join(self._session_init_sql))
+            except Exception:
+                release()
+                raise
+        return connection, release
+
+    def _init_connection_state(self, cursor):
+        # Everything a new connection needs is sent in a single batch. Unless
+        # the capabilities are known already, the batch ends with the server
+        # probe so that the version check doesn't cost another round trip.
+        statements = list(self._session_init_sql)
+        probe = bool(statements) and self.ops._ss_ver is None and \
+            self._get_cached_capabilities() is None
+        if probe:
+            statements.append(self.ops.server_info_sql)
+
+        if statements:
+            cursor.execute('; '.join(statements))
+        if probe:
+            # Step over anything the SET statements may have reported.
+            while cursor.description is None and cursor.nextset():
+                pass
+            self.ops.set_server_info(*cursor.fetchone())
+
+        self._detect_driver()
+
+        if self.drv_name.startswith('LIBTDSODBC'):
+            # FreeTDS can't execute some sql queries like CREATE DATABASE etc.
+            # in multi-statement, so we need to commit the above SQL sentence(s)
+            # to avoid this
+            if not self.connection.autocommit:
+                self.connection.commit()
+
+    def _get_cached_capabilities(self):
+        if self.capability_cache is None:
+            return None
+        return capabilities.get(capabilities.cache_key(self._connection_string),
+                                self.capability_cache.get('path'))
+
+    def _detect_driver(self):
+        caps = self._get_cached_capabilities()
+        if caps is not None:
+            self._apply_capabilities(caps)
+            return
+
+        ms_sqlncli = re.compile('^((LIB)?SQLN?CLI|LIBMSODBCSQL)')
+        # Set before anything below opens a cursor, which would otherwise end
+        # up back here.
+        self.drv_name = self.connection.getinfo(Database.SQL_DRIVER_NAME).upper()
+
+        # http://msdn.microsoft.com/en-us/library/ms131686.aspx
+        # How to to activate it: Add 'MARS_Connection': True
+        # to the DATABASE_OPTIONS dictionary setting
+        can_use_chunked_reads = bool(self.ops.sql_server_ver >= 2005 and
+                                     ms_sqlncli.match(self.drv_name) and
+                                     self.MARS_Connection)
+
+        if self.drv_name.startswith('LIBTDSODBC'):
+            freetds_version = self.connection.getinfo(Database.SQL_DRIVER_VER)
+            try:
+                from distutils.version import LooseVersion
+            except ImportError:
+                warnings.warn(Warning('Using naive FreeTDS version detection. Install distutils to get better version detection.'))
+                supports_utf8 = not freetds_version.startswith('0.82')
+            else:
+                # This is the minimum version that properly supports
+                # Unicode. Though it started in version 0.82, the
+                # implementation in that version was buggy.
+                supports_utf8 = LooseVersion(freetds_version) >= LooseVersion('0.91')
+        else:
+            supports_utf8 = bool(self.drv_name == 'SQLSRV32.DLL'
+                                 or ms_sqlncli.match(self.drv_name))
+
+        caps = {
+            'drv_name': self.drv_name,
+            'sql_server_ver': self.ops.sql_server_ver,
+            'engine_edition': self.ops._ss_edition,
+            'driver_supports_utf8': supports_utf8,
+            'can_use_chunked_reads': can_use_chunked_reads,
+        }
+        self._apply_capabilities(caps)
+        if self.capability_cache is not None:
+            capabilities.store(capabilities.cache_key(self._connection_string),
+                               caps, self.capability_cache.get('path'),
+                               self.capability_cache.get('ttl', capabilities.DEFAULT_TTL))
+
+    def _apply_capabilities(self, caps):
+        self.drv_name = caps['drv_name']
+        self.ops._ss_ver = caps['sql_server_ver']
+        if caps['engine_edition'] is not None:
+            self.ops._ss_edition = caps['engine_edition']
+        if self.driver_supports_utf8 is None:
+            self.driver_supports_utf8 = caps['driver_supports_utf8']
+        if caps['can_use_chunked_reads']:
+            self.features.can_use_chunked_reads = True
+
+        if caps['sql_server_ver'] < 2005:
+            self.creation.data_types['TextField'] = 'ntext'
+            self.data_types['TextField'] = 'ntext'
+            self.features.can_return_id_from_insert = False
+        if caps['sql_server_ver'] < 2008:
+            # No multi-row VALUES lists before SQL Server 2008
+            self.features.has_bulk_insert = False
+            self.features.can_return_ids_from_bulk_insert = False
+            self.features.can_return_rows_from_bulk_insert = False
 
     def _execute_foreach(self, sql, table_names=None):
         cursor = self.cursor()
@@ -425,66 +765,244 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         self.check_constraints()
 
 
+def _translate_placeholders(sql, n_params):
+    # pyodbc uses '?' instead of '%s' as parameter placeholder.
+    if n_params is not None:
+        try:
+            sql = sql % tuple('?' * n_params)
+        except Exception as e:
+            #Todo checkout whats happening here
+            pass
+    else:
+        if '%s' in sql:
+            sql = sql.replace('%s', '?')
+    return sql
+
+_cached_translate_placeholders = lru_cache(maxsize=SQL_CACHE_SIZE)(_translate_placeholders)
+
+
+class _PyformatNames(dict):
+    """
+    Records the names looked up when a pyformat statement is %-formatted
+    with it, in order, and stands in a '?' for each.
+    """
+    def __init__(self):
+        self.names = []
+
+    def __missing__(self, key):
+        self.names.append(key)
+        return '?'
+
+
+def _translate_pyformat(sql):
+    """
+    Translate a statement using %(name)s placeholders. Returns the statement
+    with '?' placeholders and the tuple of parameter names in the order
+    pyodbc expects their values.
+    """
+    names = _PyformatNames()
+    return sql % names, tuple(names.names)
+
+_cached_translate_pyformat = lru_cache(maxsize=SQL_CACHE_SIZE)(_translate_pyformat)
+
+
+def _bool_param(p):
+    return 1 if p else 0
+
+
+def _param_converter(param_type, driver_supports_utf8, encoding):
+    """
+    Return the function that adapts parameters of `param_type` for pyodbc,
+    or None if they are passed as is.
+    """
+    if issubclass(param_type, text_type):
+        return None
+    if issubclass(param_type, binary_type):
+        if driver_supports_utf8:
+            return None
+        return lambda p: p.decode(encoding)
+    if issubclass(param_type, bool):
+        return _bool_param
+    return None
+
+# Converter tables, keyed on (driver_supports_utf8, encoding) and filled in
+# as new parameter types are seen.
+_param_converters = {}
+
+
 class CursorWrapper(object):
     """
     A wrapper around the pyodbc's cursor that takes in account a) some pyodbc
     DB-API 2.0 implementation and b) some common ODBC driver particularities.
     """
-    def __init__(self, cursor, driver_supports_utf8, encoding="", db_wrpr=None):
+    itersize = 100
+
+    def __init__(self, cursor, driver_supports_utf8, encoding="", db_wrpr=None,
+                 cursor_cache=None):
         self.cursor = cursor
         self.driver_supports_utf8 = driver_supports_utf8
         self.last_sql = ''
         self.last_params = ()
         self.encoding = encoding
         self.db_wrpr = db_wrpr
+        self.param_converters = _param_converters.setdefault(
+            (bool(driver_supports_utf8), encoding), {})
+        self._plan_description = None
+        self._plan = None
+        self._input_sizes = None
+        self._sizes_bound = False
+        self._string_param_sizes = db_wrpr is not None and db_wrpr.string_param_sizes and \
+            hasattr(cursor, 'setinputsizes')
+        self._sql_tags = db_wrpr is not None and db_wrpr.sql_tags is not None
+        # With a CursorCache, statements run on the cursor cached for their
+        # SQL (checked out as _cached_sql) and self.cursor points to it.
+        self._cursor_cache = cursor_cache
+        self._own_cursor = cursor
+        self._cached_sql = None
+        self._recorder = None
+        if db_wrpr is not None:
+            instruments = instrumentation.get_instrumentation(db_wrpr)
+            budgets = db_wrpr.query_budget is not None
+            plan_capture = plans.get_plan_capture(db_wrpr)
+            if instruments is not None or budgets or plan_capture is not None:
+                self._recorder = instrumentation.Recorder(db_wrpr.alias, instruments, budgets,
+                                                          plan_capture)
 
     def close(self):
+        if self._recorder is not None:
+            self._recorder.finish()
+        if self._cursor_cache is not None:
+            self._leave_cursor()
+            self.cursor = self._own_cursor
         try:
             self.cursor.close()
         except:
             pass
 
-    def format_sql(self, sql, n_params=None):
-        # pyodbc uses '?' instead of '%s' as parameter placeholder.
-        if n_params is not None:
-            try:
-                sql = sql % tuple('?' * n_params)
-            except Exception as e:
-                #Todo checkout whats happening here
-                pass
+    def _use_cursor_for(self, sql):
+        """
+        Point self.cursor to the cached cursor for `sql`, or to this wrapper's
+        own cursor if another wrapper is using it.
+        """
+        if sql == self._cached_sql:
+            self._cursor_cache.hits += 1
+            return
+        self._leave_cursor()
+        cursor = self._cursor_cache.checkout(sql, self)
+        if cursor is None:
+            self.cursor = self._own_cursor
         else:
-            if '%s' in sql:
-                sql = sql.replace('%s', '?')
-        return sql
+            self.cursor = cursor
+            self._cached_sql = sql
+
+    def _leave_cursor(self):
+        """
+        Reset the current cursor for whoever uses it next: unbind parameter
+        sizes, discard pending results (keeping the prepared statement) and
+        give it back to the cache.
+        """
+        cursor = self.cursor
+        ok = True
+        try:
+            if self._sizes_bound:
+                self._bind_input_sizes(None)
+            if cursor.description is not None:
+                while cursor.nextset():
+                    pass
+        except Database.Error:
+            ok = False
+        if self._cached_sql is not None:
+            self._cursor_cache.release(self._cached_sql, discard=not ok)
+            self._cached_sql = None
+
+    def format_sql(self, sql, n_params=None):
+        if len(sql) > SQL_CACHE_MAX_LENGTH:
+            return _translate_placeholders(sql, n_params)
+        return _cached_translate_placeholders(sql, n_params)
+
+    def format_pyformat(self, sql, params):
+        """
+        Turn a statement with %(name)s placeholders and a dict of parameters
+        into a '?' statement and a matching list of parameters.
+        """
+        sql, names = self._translate_pyformat(sql)
+        return sql, [params[name] for name in names]
+
+    def _translate_pyformat(self, sql):
+        if len(sql) > SQL_CACHE_MAX_LENGTH:
+            return _translate_pyformat(sql)
+        return _cached_translate_pyformat(sql)
 
     def format_params(self, params):
+        converters = self.param_converters
         fp = []
         for p in params:
-            if isinstance(p, text_type):
-                fp.append(p)
-            elif isinstance(p, binary_type):
-                if not self.driver_supports_utf8:
-                    fp.append(p.decode(self.encoding))
-                else:
-                    fp.append(p)
-            elif isinstance(p, type(True)):
-                if p:
-                    fp.append(1)
-                else:
-                    fp.append(0)
-            else:
-                fp.append(p)
+            try:
+                convert = converters[type(p)]
+            except KeyError:
+                convert = self._add_param_converter(type(p))
+            fp.append(p if convert is None else convert(p))
         return tuple(fp)
 
+    def format_params_list(self, params_list):
+        """
+        Adapt the parameters of an executemany() call column by column: each
+        column is converted in one pass with the converter for its type, and
+        columns that need no conversion are not touched.
+        """
+        if not params_list:
+            return params_list
+        converters = self.param_converters
+        columns = list(zip(*params_list))
+        converted = False
+        for i, column in enumerate(columns):
+            types = set(map(type, column))
+            for t in types:
+                if t not in converters:
+                    self._add_param_converter(t)
+            plan = set(converters[t] for t in types)
+            plan.discard(None)
+            if not plan:
+                continue
+            converted = True
+            if len(types) == 1:
+                columns[i] = list(map(plan.pop(), column))
+            else:
+                # Mixed types (e.g. None in a BooleanField column)
+                columns[i] = self.format_params(column)
+        if not converted:
+            return params_list
+        return list(zip(*columns))
+
+    def _add_param_converter(self, param_type):
+        convert = _param_converter(param_type, self.driver_supports_utf8, self.encoding)
+        self.param_converters[param_type] = convert
+        return convert
+
     def execute(self, sql, params=()):
+        recorder = self._recorder
+        if recorder is not None and not recorder.start():
+            # left out of the instrumentation's sample
+            recorder = None
+        if self._sql_tags:
+            sql = tagging.tag_sql(sql)
         self.last_sql = sql
         #django-debug toolbar error
         if params == None:
             params = ()
-        sql = self.format_sql(sql, len(params))
+        if isinstance(params, dict):
+            sql, params = self.format_pyformat(sql, params)
+        else:
+            sql = self.format_sql(sql, len(params))
         params = self.format_params(params)
         self.last_params = params
         try:
+            if self._cursor_cache is not None:
+                self._use_cursor_for(sql)
+            if self._string_param_sizes:
+                self._bind_input_sizes(inputsizes.string_input_sizes(params))
+            if recorder is not None:
+                return recorder.execute(self.cursor, sql, params)
             return self.cursor.execute(sql, params)
         except IntegrityError:
             e = sys.exc_info()[1]
@@ -493,17 +1011,58 @@ class CursorWrapper(object):
             e = sys.exc_info()[1]
             raise utils.DatabaseError(*e.args)
 
+    def _bind_input_sizes(self, sizes):
+        if sizes is not None:
+            self.cursor.setinputsizes(sizes)
+            self._sizes_bound = True
+        elif self._sizes_bound:
+            self.cursor.setinputsizes(None)
+            self._sizes_bound = False
+
+    def set_input_sizes(self, input_sizes):
+        """
+        Give the parameter sizes (see django_pyodbc.inputsizes) to bind the
+        next executemany() with when fast_executemany is enabled.
+        """
+        self._input_sizes = input_sizes
+
     def executemany(self, sql, params_list):
-        sql = self.format_sql(sql)
+        recorder = self._recorder
+        if recorder is not None and not recorder.start():
+            # left out of the instrumentation's sample
+            recorder = None
+        input_sizes, self._input_sizes = self._input_sizes, None
+        if self._sql_tags:
+            sql = tagging.tag_sql(sql)
+        params_list = list(params_list)
+        if params_list and isinstance(params_list[0], dict):
+            sql, names = self._translate_pyformat(sql)
+            params_list = [[p[name] for name in names] for p in params_list]
+        else:
+            sql = self.format_sql(sql)
         # pyodbc's cursor.executemany() doesn't support an empty param_list
         if not params_list:
             if '?' in sql:
                 return
         else:
-            raw_pll = params_list
-            params_list = [self.format_params(p) for p in raw_pll]
+            params_list = self.format_params_list(params_list)
 
         try:
+            if self._cursor_cache is not None and self.cursor is not self._own_cursor:
+                # executemany() prepares once per call anyway
+                self._leave_cursor()
+                self.cursor = self._own_cursor
+            options = self.db_wrpr.fast_executemany if self.db_wrpr is not None else None
+            if self._sizes_bound:
+                self._bind_input_sizes(None)
+            if options is not None and params_list and \
+                    hasattr(self.cursor, 'fast_executemany'):
+                if recorder is not None:
+                    return recorder.execute_many(self._fast_executemany, sql, params_list, True,
+                                                 input_sizes, options)
+                return self._fast_executemany(sql, params_list, input_sizes, options)
+            if recorder is not None:
+                return recorder.execute_many(self.cursor.executemany, sql, params_list, False)
             return self.cursor.executemany(sql, params_list)
         except IntegrityError:
             e = sys.exc_info()[1]
@@ -512,37 +1071,169 @@ class CursorWrapper(object):
             e = sys.exc_info()[1]
             raise utils.DatabaseError(*e.args)
 
-    def format_results(self, rows):
+    def _fast_executemany(self, sql, params_list, input_sizes, options):
+        """
+        Run executemany() with pyodbc's fast_executemany, which sends the
+        parameters as arrays instead of one round trip per row. The rows are
+        sent in chunks that fit in the configured memory budget.
+        """
+        if input_sizes is None or len(input_sizes) != len(params_list[0]):
+            input_sizes = [None] * len(params_list[0])
+        memory = options.get('memory', 16 * 1024 * 1024)
+        chunk_size = max(1, memory // max(inputsizes.row_width(input_sizes), 1))
+        cursor = self.cursor
+        bind_sizes = hasattr(cursor, 'setinputsizes') and any(input_sizes)
+        try:
+            for start in range(0, len(params_list), chunk_size):
+                chunk = params_list[start:start + chunk_size]
+                sizes = self._chunk_input_sizes(chunk, input_sizes)
+                if sizes is None:
+                    # Values too long to bind as arrays; these go row by row
+                    cursor.fast_executemany = False
+                    if bind_sizes:
+                        cursor.setinputsizes(None)
+                else:
+                    cursor.fast_executemany = True
+                    if bind_sizes:
+                        cursor.setinputsizes(sizes)
+                cursor.executemany(sql, chunk)
+        finally:
+            cursor.fast_executemany = False
+            if bind_sizes:
+                cursor.setinputsizes(None)
+
+    def _chunk_input_sizes(self, chunk, input_sizes):
+        """
+        Return the input sizes to bind `chunk` with, sizing (max) and
+        unknown string columns to the longest value in the chunk, or None if
+        some value is too long to be bound at all.
+        """
+        sizes = list(input_sizes)
+        for i, size in enumerate(input_sizes):
+            if size is not None and size[1]:
+                continue
+            if size is not None and size[0] not in (inputsizes.SQL_WVARCHAR,
+                                                    inputsizes.SQL_VARCHAR,
+                                                    inputsizes.SQL_VARBINARY):
+                continue
+            lengths = [len(row[i]) for row in chunk
+                       if isinstance(row[i], (text_type, binary_type, bytearray))]
+            if not lengths:
+                continue
+            longest = max(lengths)
+            if size is None:
+                limit = inputsizes.MAX_NVARCHAR_SIZE
+            else:
+                limit = inputsizes.max_size_for(size[0])
+            if longest > limit:
+                return None
+            if size is not None:
+                sizes[i] = (size[0], max(longest, 1), size[2])
+        return sizes
+
+    def _get_result_plan(self):
+        """
+        Return the list of (column index, converter) pairs the rows of the
+        current result set need, worked out once from cursor.description.
+        """
+        description = self.cursor.description
+        if description is not None and description is self._plan_description:
+            return self._plan
+        needs_utc = _DJANGO_VERSION >= 14 and settings.USE_TZ
+        needs_decode = not self.driver_supports_utf8
+        plan = []
+        if needs_utc or needs_decode:
+            utc_value = lambda v: v.replace(tzinfo=timezone.utc)
+            decode_value = lambda v: v.decode(self.encoding)
+            def probe_value(v):
+                # FreeTDS (and other ODBC drivers?) don't support Unicode
+                # yet, so we need to decode UTF-8 data coming from the DB
+                if needs_decode and isinstance(v, binary_type):
+                    return v.decode(self.encoding)
+                elif needs_utc and isinstance(v, datetime.datetime):
+                    return v.replace(tzinfo=timezone.utc)
+                return v
+            if description is None:
+                # No type codes to go by
+                return [(None, probe_value)]
+            for i, column in enumerate(description):
+                type_code = column[1]
+                if not isinstance(type_code, type):
+                    plan.append((i, probe_value))
+                elif needs_decode and issubclass(type_code, binary_type):
+                    plan.append((i, decode_value))
+                elif needs_utc and issubclass(type_code, datetime.datetime):
+                    plan.append((i, utc_value))
+        self._plan_description = description
+        self._plan = plan
+        return plan
+
+    def format_rows(self, rows):
         """
         Decode data coming from the database if needed and convert rows to tuples
         (pyodbc Rows are not sliceable).
         """
-        needs_utc = _DJANGO_VERSION >= 14 and settings.USE_TZ
-        if not (needs_utc or not self.driver_supports_utf8):
-            return tuple(rows)
-        # FreeTDS (and other ODBC drivers?) don't support Unicode yet, so we
-        # need to decode UTF-8 data coming from the DB
+        plan = self._get_result_plan()
+        if not plan:
+            return [tuple(row) for row in rows]
+        if plan[0][0] is None:
+            convert = plan[0][1]
+            return [tuple([v if v is None else convert(v) for v in row]) for row in rows]
         fr = []
         for row in rows:
-            if not self.driver_supports_utf8 and isinstance(row, binary_type):
-                row = row.decode(self.encoding)
+            row = list(row)
+            for i, convert in plan:
+                v = row[i]
+                if v is not None:
+                    row[i] = convert(v)
+            fr.append(tuple(row))
+        return fr
 
-            elif needs_utc and isinstance(row, datetime.datetime):
-                row = row.replace(tzinfo=timezone.utc)
-            fr.append(row)
-        return tuple(fr)
+    def format_results(self, rows):
+        """
+        Decode data coming from the database if needed and convert rows to tuples
+        (pyodbc Rows are not sliceable).
+        """
+        return self.format_rows([rows])[0]
 
     def fetchone(self):
+        recorder = self._recorder
+        if recorder is not None and recorder.event is None:
+            recorder = None
+        if recorder is not None:
+            began = instrumentation.clock()
         row = self.cursor.fetchone()
         if row is not None:
-            return self.format_results(row)
+            row = self.format_results(row)
+        if recorder is not None:
+            recorder.fetched(began, row is not None, row is None)
+        if row is not None:
+            return row
         return []
 
     def fetchmany(self, chunk):
-        return [self.format_results(row) for row in self.cursor.fetchmany(chunk)]
+        recorder = self._recorder
+        if recorder is None or recorder.event is None:
+            return self.format_rows(self.cursor.fetchmany(chunk))
+        began = instrumentation.clock()
+        rows = self.format_rows(self.cursor.fetchmany(chunk))
+        recorder.fetched(began, len(rows), not rows)
+        return rows
 
     def fetchall(self):
-        return [self.format_results(row) for row in self.cursor.fetchall()]
+        recorder = self._recorder
+        if recorder is None or recorder.event is None:
+            return self.format_rows(self.cursor.fetchall())
+        began = instrumentation.clock()
+        rows = self.format_rows(self.cursor.fetchall())
+        recorder.fetched(began, len(rows), True)
+        return rows
+
+    def nextset(self):
+        more = self.cursor.nextset()
+        if more and self._recorder is not None:
+            more = self._recorder.next_result_set(self.cursor)
+        return more
 
     def __getattr__(self, attr):
         if attr in self.__dict__:
@@ -550,12 +1241,21 @@ class CursorWrapper(object):
         return getattr(self.cursor, attr)
 
     def __iter__(self):
-        return iter(self.cursor)
+        # Read in chunks so iterating over a cursor never holds the whole
+        # result set in memory.
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            for row in rows:
+                yield row
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
+        # Close so that a cached cursor goes back to the cache
+        self.close()
         return False
 
     # # MS SQL Server doesn't support explicit savepoint commits; savepoints are
@@ -569,3 +1269,97 @@ class CursorWrapper(object):
                 'sql': '-- RELEASE SAVEPOINT %s -- (because assertNumQueries)' % self.ops.quote_name(sid),
                 'time': '0.000',
             })
+
+
+class StreamingCursorWrapper(CursorWrapper):
+    """
+    Cursor returned by DatabaseWrapper.chunked_cursor(). Rows are fetched in
+    chunks of `arraysize` rows, either a fixed number or, with 'auto', as
+    many as fit in `memory` bytes judging by the column sizes in the cursor
+    description.
+
+    `release` is called once when the cursor is closed; it gives back the
+    dedicated connection the cursor runs on, if it has one.
+    """
+    def __init__(self, cursor, driver_supports_utf8, encoding="", db_wrpr=None,
+                 arraysize=None, memory=4 * 1024 * 1024, release=None):
+        super(StreamingCursorWrapper, self).__init__(cursor, driver_supports_utf8, encoding, db_wrpr)
+        self.arraysize = arraysize
+        self.memory = memory
+        self.release = release
+        self._auto_arraysize = None
+
+    def execute(self, sql, params=()):
+        self._auto_arraysize = None
+        return super(StreamingCursorWrapper, self).execute(sql, params)
+
+    def _get_arraysize(self, size):
+        if self.arraysize == 'auto':
+            if self._auto_arraysize is None:
+                row_width = 0
+                for column in self.cursor.description or ():
+                    column_size = column[3]
+                    # (max) columns report 0; assume they are big
+                    if not column_size or column_size > 8000:
+                        column_size = 8000
+                    if column[1] is text_type:
+                        column_size *= 2
+                    row_width += column_size + 16
+                self._auto_arraysize = max(100, min(10000, self.memory // max(row_width, 1)))
+            return self._auto_arraysize
+        return self.arraysize or size or self.itersize
+
+    def fetchmany(self, chunk=None):
+        return super(StreamingCursorWrapper, self).fetchmany(self._get_arraysize(chunk))
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def close(self):
+        super(StreamingCursorWrapper, self).close()
+        if self.release is not None:
+            release, self.release = self.release, None
+            release()
+
+
+class BufferedCursorWrapper(CursorWrapper):
+    """
+    Cursor that reads the whole result set as soon as a statement is
+    executed, leaving the connection free for other statements while the
+    rows are being consumed. chunked_cursor() falls back to it when it can
+    neither use MARS nor a dedicated connection.
+    """
+    def __init__(self, cursor, driver_supports_utf8, encoding="", db_wrpr=None):
+        super(BufferedCursorWrapper, self).__init__(cursor, driver_supports_utf8, encoding, db_wrpr)
+        self._rows = []
+        self._pos = 0
+
+    def execute(self, sql, params=()):
+        result = super(BufferedCursorWrapper, self).execute(sql, params)
+        if self.cursor.description is not None:
+            self._rows = CursorWrapper.fetchall(self)
+        else:
+            self._rows = []
+        self._pos = 0
+        return result
+
+    def fetchone(self):
+        if self._pos < len(self._rows):
+            self._pos += 1
+            return self._rows[self._pos - 1]
+        return []
+
+    def fetchmany(self, chunk):
+        rows = self._rows[self._pos:self._pos + chunk]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
@@ -0,0 +1,235 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Round trip budgets and N+1 detection.
+
+A QueryBudget counts the statements run while it is active (in a context
+variable, so per thread and per asyncio task) on databases with the
+query_budget option on, and groups them by fingerprint and call site: the
+innermost frames outside Django and django_pyodbc. On exit it reports
+going over `max_round_trips`, and any single row SELECT run `max_repeats`
+times or more from the same call site, the signature of an N+1 query, by
+raising BudgetExceeded or logging a warning.
+
+    with QueryBudget(max_round_trips=20, max_repeats=5):
+        render_dashboard()
+
+    @QueryBudget(max_round_trips=5)
+    def view(request):
+        ...
+
+Budgets nest; a statement counts towards every enclosing budget.
+QueryBudgetMiddleware puts each request under the budget set in the
+query_budget option of the default database.
+"""
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+import django
+from django.db import DEFAULT_DB_ALIAS, connections
+
+import django_pyodbc
+from django_pyodbc.fingerprint import normalize
+
+logger = logging.getLogger('django_pyodbc.budget')
+
+_current = ContextVar('django_pyodbc_query_budget', default=None)
+
+# Frames in these directories are skipped when looking for the call site
+_library_dirs = tuple(os.path.dirname(module.__file__) + os.sep
+                      for module in (django, django_pyodbc))
+
+_budget_options = ('max_round_trips', 'max_repeats', 'action', 'depth')
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+def current():
+    """Return the innermost active QueryBudget, or None."""
+    return _current.get()
+
+
+def call_site(depth=1):
+    """
+    Return the innermost `depth` frames outside Django and django_pyodbc, as
+    a tuple of (file name, line number, function name).
+    """
+    frame = sys._getframe(1)
+    frames = []
+    while frame is not None and len(frames) < depth:
+        code = frame.f_code
+        if not code.co_filename.startswith(_library_dirs):
+            frames.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return tuple(frames)
+
+
+class QueryBudget(object):
+    """
+    Budget of round trips and repeated single row SELECTs. `action` is
+    'raise' (BudgetExceeded) or 'log'; `depth` is the number of frames the
+    call site of a statement is made of.
+    """
+    def __init__(self, max_round_trips=None, max_repeats=None, action='raise', depth=1,
+                 name=None):
+        if action not in ('raise', 'log'):
+            raise ValueError("QueryBudget action must be 'raise' or 'log', not %r." % (action,))
+        self.max_round_trips = max_round_trips
+        self.max_repeats = max_repeats
+        self.action = action
+        self.depth = depth
+        self.name = name
+        self.round_trips = 0
+        # (fingerprint, call site) -> [statements, single row SELECTs]
+        self.groups = {}
+        self.parent = None
+        self._token = None
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.reset(self._token)
+        self._token = None
+        if exc_type is None:
+            self.check()
+        return False
+
+    def __call__(self, func):
+        """Run each call of `func` under a fresh budget with these limits."""
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with QueryBudget(self.max_round_trips, self.max_repeats, self.action, self.depth,
+                             self.name or func.__qualname__):
+                return func(*args, **kwargs)
+        return inner
+
+    def started(self, event):
+        """
+        Count the statement of `event` as it starts and note where it was
+        run from.
+        """
+        event.call_site = call_site(self.depth)
+        budget = self
+        while budget is not None:
+            budget.round_trips += 1
+            budget = budget.parent
+
+    def record(self, event):
+        """Group `event`, a finished QueryEvent, by fingerprint and call site."""
+        if event.fingerprint is None:
+            event.fingerprint = normalize(event.sql)
+        key = (event.fingerprint, event.call_site)
+        single_row = event.result_sets and event.rows <= 1 and not event.many
+        extra_round_trips = event.round_trips - 1
+        budget = self
+        while budget is not None:
+            budget.round_trips += extra_round_trips
+            group = budget.groups.get(key)
+            if group is None:
+                group = budget.groups[key] = [0, 0]
+            group[0] += 1
+            if single_row:
+                group[1] += 1
+            budget = budget.parent
+
+    def repeats(self):
+        """
+        Return the (fingerprint, call site, count) of the single row SELECTs
+        run at least max_repeats times from the same call site, most first.
+        """
+        if self.max_repeats is None:
+            return []
+        found = [(fingerprint, site, group[1]) for (fingerprint, site), group in self.groups.items()
+                 if group[1] >= self.max_repeats]
+        return sorted(found, key=lambda item: -item[2])
+
+    def problems(self):
+        problems = []
+        if self.max_round_trips is not None and self.round_trips > self.max_round_trips:
+            problems.append('%d round trips, budget is %d' % (self.round_trips,
+                                                                 self.max_round_trips))
+        for fingerprint, site, count in self.repeats():
+            where = ' <- '.join('%s:%d in %s' % frame for frame in site) or 'unknown'
+            problems.append('single row query run %d times from %s: %s' % (count, where,
+                                                                          fingerprint))
+        return problems
+
+    def check(self):
+        problems = self.problems()
+        if not problems:
+            return
+        message = 'Query budget%s exceeded: %s' % (
+            ' of %s' % self.name if self.name else '', '; '.join(problems))
+        if self.action == 'raise':
+            raise BudgetExceeded(message)
+        logger.warning(message)
+
+
+@contextmanager
+def assert_query_budget(max_round_trips=None, max_repeats=None, using=None, depth=1):
+    """
+    Fail with BudgetExceeded, an AssertionError, if the block goes over the
+    budget. The detector is turned on for `using` (all databases by
+    default) for the duration.
+
+        with assert_query_budget(max_round_trips=8, max_repeats=3):
+            self.client.get('/books/')
+    """
+    aliases = [using] if using is not None else list(connections)
+    saved = []
+    for alias in aliases:
+        connection = connections[alias]
+        if hasattr(connection, 'query_budget'):
+            saved.append((connection, connection.query_budget))
+            if connection.query_budget is None:
+                connection.query_budget = {}
+    try:
+        with QueryBudget(max_round_trips, max_repeats, 'raise', depth) as budget:
+            yield budget
+    finally:
+        for connection, option in saved:
+            connection.query_budget = option
+
+
+class QueryBudgetMixin(object):
+    """TestCase mixin with assertQueryBudget(), see assert_query_budget()."""
+    def assertQueryBudget(self, max_round_trips=None, max_repeats=None, using=None, depth=1):
+        return assert_query_budget(max_round_trips, max_repeats, using, depth)
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Run each request under a QueryBudget with the limits in the query_budget
+    option of the default database. Going over is logged unless the option
+    sets action to 'raise'.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = connections[DEFAULT_DB_ALIAS].query_budget or {}
+        self.options = dict((name, options[name]) for name in _budget_options if name in options)
+        self.options.setdefault('action', 'log')
+
+    def __call__(self, request):
+        with QueryBudget(name=request.path, **self.options):
+            return self.get_response(request)
@@ -0,0 +1,180 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Set-based bulk operations for SQL Server: upserts with MERGE and updates
+joined to a VALUES list, instead of the row by row or CASE based
+statements Django's QuerySet methods send.
+"""
+from django.db import connections, router, transaction
+from django.db.models import AutoField, Case, Expression, Value, When
+from django.db.models.functions import Cast
+from django.db.models.sql.subqueries import InsertQuery
+
+
+class MergeQuery(InsertQuery):
+    compiler = 'SQLMergeCompiler'
+
+    def __init__(self, model, unique_fields, update_fields):
+        super(MergeQuery, self).__init__(model)
+        self.unique_fields = unique_fields
+        self.update_fields = update_fields
+
+
+class BulkUpdateQuery(InsertQuery):
+    compiler = 'SQLBulkUpdateCompiler'
+
+
+def _get_fields(meta, names, kind):
+    fields = []
+    for name in names:
+        field = meta.get_field(name)
+        if not field.concrete or field.many_to_many:
+            raise ValueError("%s must be concrete, non-m2m fields; %r isn't." % (kind, name))
+        fields.append(field)
+    return fields
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields=None, using=None, batch_size=None):
+    """
+    Insert `objs`, or update the existing rows that have the same values in
+    `unique_fields`, without the race between the SELECT and the INSERT or
+    UPDATE of QuerySet.update_or_create().
+
+    Each batch of objects is written by a single MERGE ... WITH (HOLDLOCK),
+    which holds the key range locked between finding and writing the rows.
+    `update_fields` are the fields set on rows that already exist; they
+    default to every field but the primary key and `unique_fields`. Pass an
+    empty list to only insert missing rows. Fields with auto_now_add are
+    only set on inserted rows. When several objects have the same unique
+    values, the last one wins.
+
+    Primary keys are not set on the inserted objects. Returns a tuple of
+    the number of inserted rows and the number of updated rows.
+    """
+    meta = model._meta
+    if meta.parents:
+        raise ValueError("Can't bulk upsert a multi-table inherited model")
+    if not unique_fields:
+        raise ValueError("bulk_upsert() needs at least one unique field")
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+
+    unique_fields = _get_fields(meta, unique_fields, 'unique_fields')
+    fields = [f for f in meta.concrete_fields
+              if not isinstance(f, AutoField) or f in unique_fields]
+    if update_fields is None:
+        update_fields = [f for f in fields if f not in unique_fields and not f.primary_key]
+    else:
+        update_fields = _get_fields(meta, update_fields, 'update_fields')
+    # The values of fields are taken after pre_save(add=True), which would
+    # reset these to the current time on existing rows.
+    update_fields = [f for f in update_fields if not getattr(f, 'auto_now_add', False)]
+
+    # MERGE refuses to update a target row twice, so keep the last object
+    # for each set of unique values.
+    unique = {}
+    for obj in objs:
+        unique[tuple(getattr(obj, f.attname) for f in unique_fields)] = obj
+    objs = list(unique.values())
+    if not objs:
+        return 0, 0
+
+    inserted = updated = 0
+    if batch_size is None:
+        batch_size = len(objs)
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(objs), batch_size):
+            query = MergeQuery(model, unique_fields, update_fields)
+            query.insert_values(fields, objs[start:start + batch_size])
+            batch_inserted, batch_updated = query.get_compiler(connection=connection).execute_sql()
+            inserted += batch_inserted
+            updated += batch_updated
+    return inserted, updated
+
+
+def bulk_update(objs, fields, batch_size=None, using=None):
+    """
+    Set `fields` of every object in `objs` to the values they have on the
+    objects. Like QuerySet.bulk_update(), but each batch is a single
+    UPDATE ... FROM joined to a VALUES list of the primary keys and new
+    values, instead of a CASE expression per field; batches are sized to
+    SQL Server's parameter limit.
+
+    Objects with F() expressions or fields of a parent model are updated
+    with a CASE expression per field, as QuerySet.bulk_update() does.
+    Returns the number of updated rows.
+    """
+    objs = tuple(objs)
+    if not fields:
+        raise ValueError("Field names must be given to bulk_update().")
+    if not objs:
+        return 0
+    model = type(objs[0])
+    meta = model._meta
+    if any(obj.pk is None for obj in objs):
+        raise ValueError("All bulk_update() objects must have a primary key set.")
+    fields = _get_fields(meta, fields, 'fields')
+    if any(f.primary_key for f in fields):
+        raise ValueError("bulk_update() cannot be used with primary key fields.")
+    using = using or router.db_for_write(model)
+
+    if any(f.model is not meta.concrete_model for f in fields) or \
+            any(isinstance(getattr(obj, f.attname), Expression) for obj in objs for f in fields):
+        return _bulk_update_with_case(model, objs, fields, batch_size, using)
+
+    connection = connections[using]
+    if batch_size is None:
+        batch_size = len(objs)
+    rows = 0
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(objs), batch_size):
+            query = BulkUpdateQuery(model)
+            # Values are taken from the objects as they are
+            query.insert_values([meta.pk] + fields, objs[start:start + batch_size], raw=True)
+            rows += query.get_compiler(connection=connection).execute_sql()
+    return rows
+
+
+def _bulk_update_with_case(model, objs, fields, batch_size, using):
+    """
+    What QuerySet.bulk_update() does, but returning the number of updated
+    rows, which it doesn't before Django 4.0.
+    """
+    connection = connections[using]
+    # Each object binds its pk and a value in the CASE of every field, and
+    # its pk once more in the pk__in list
+    params_per_obj = 2 * len(fields) + 1
+    max_batch_size = max(1, (connection.ops.max_query_params - 1) // params_per_obj)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+    requires_casting = getattr(connection.features, 'requires_casted_case_in_updates', False)
+    queryset = model._default_manager.using(using)
+    rows = 0
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            values = {}
+            for field in fields:
+                whens = []
+                for obj in batch:
+                    value = getattr(obj, field.attname)
+                    if not isinstance(value, Expression):
+                        value = Value(value, output_field=field)
+                    whens.append(When(pk=obj.pk, then=value))
+                case = Case(*whens, output_field=field)
+                if requires_casting:
+                    case = Cast(case, output_field=field)
+                values[field.attname] = case
+            rows += queryset.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+    return rows
@@ -0,0 +1,112 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of the server and driver capabilities detected for a connection string.
+
+Detecting them costs a SERVERPROPERTY round trip plus a couple of driver
+calls on every new connection. The results are kept in process memory and,
+if a path is configured, in a small JSON file that forked workers share.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from django_pyodbc.compat import binary_type, md5_constructor
+
+DEFAULT_TTL = 3600
+
+_cache = {}
+_lock = threading.Lock()
+
+
+# PWD=...; or Password=...; with the value possibly in braces, where }}
+# stands for }
+_password = re.compile(r'(?:^|;)\s*(?:PWD|PASSWORD)\s*=\s*(?:\{(?:[^}]|\}\})*\}|[^;]*)',
+                       re.IGNORECASE)
+
+
+def cache_key(connection_string):
+    # The password is left out of what is hashed, so that the keys in a
+    # file others may read can't be used to guess it.
+    if isinstance(connection_string, binary_type):
+        connection_string = connection_string.decode('utf-8')
+    connection_string = _password.sub('', connection_string)
+    return md5_constructor(connection_string.encode('utf-8')).hexdigest()
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_file(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.django_pyodbc_caps')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        # Atomic, so other workers never read a half written file
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def get(key, path=None):
+    """
+    Return the cached capabilities dict for `key`, or None if there is no
+    entry or it has expired.
+    """
+    now = time.time()
+    entry = _cache.get(key)
+    if entry is not None and entry['expires'] > now:
+        return entry['capabilities']
+    if path:
+        entry = _read_file(path).get(key)
+        if entry is not None and entry.get('expires', 0) > now:
+            _cache[key] = entry
+            return entry['capabilities']
+    return None
+
+
+def store(key, capabilities, path=None, ttl=DEFAULT_TTL):
+    entry = {'expires': time.time() + ttl, 'capabilities': capabilities}
+    _cache[key] = entry
+    if path:
+        with _lock:
+            data = _read_file(path)
+            now = time.time()
+            data = dict((k, v) for k, v in data.items()
+                        if isinstance(v, dict) and v.get('expires', 0) > now)
+            data[key] = entry
+            _write_file(path, data)
+
+
+def clear(path=None):
+    _cache.clear()
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
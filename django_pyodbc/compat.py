@@ -115,3 +115,10 @@ except ImportError:
                 yield tup
         except IndexError:
             pass
+
+# Results computed from SQL text (placeholder translation, fingerprints,
+# rewritten select lists) are cached for the most recently used statements;
+# anything longer than SQL_CACHE_MAX_LENGTH is processed every time so a few
+# huge statements can't pin a lot of memory.
+SQL_CACHE_SIZE = 1024
+SQL_CACHE_MAX_LENGTH = 16384
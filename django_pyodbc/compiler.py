@@ -43,12 +43,23 @@
 import re
 import types
 from datetime import date, datetime
+from functools import lru_cache
 
 import django
 from django import VERSION as DjangoVersion
+from django.core.exceptions import EmptyResultSet
+from django.db.models.expressions import Col
+from django.db.models.lookups import BuiltinLookup, Exact, Lookup
 from django.db.models.sql import compiler, where
+from django.db.utils import DatabaseError
 
-from django_pyodbc.compat import zip_longest
+from django_pyodbc import querycache, tagging
+from django_pyodbc.compat import SQL_CACHE_MAX_LENGTH, SQL_CACHE_SIZE, zip_longest
+from django_pyodbc.inputsizes import field_input_sizes, is_varchar_field, mark_varchar_params
+
+# Lookups whose SQL is their column's followed by the operator and the SQL
+# of their right hand side, unless that is a boolean
+_rhs_only_as_sql = frozenset([BuiltinLookup.as_sql, Exact.as_sql])
 
 REV_ODIR = {
     'ASC': 'DESC',
@@ -96,23 +107,109 @@ _re_data_type_terminator = re.compile(
 _re_order_limit_offset = re.compile(
     r'(?:ORDER BY\s+(.+?))?\s*(?:LIMIT\s+(\d+))?\s*(?:OFFSET\s+(\d+))?$')
 
-# Pattern used in column aliasing to find sub-select placeholders
-_re_col_placeholder = re.compile(r'\{_placeholder_(\d+)\}')
-
 _re_find_order_direction = re.compile(r'\s+(asc|desc)\s*$', re.IGNORECASE)
 
 def _remove_order_limit_offset(sql):
     return _re_order_limit_offset.sub('',sql).split(None, 1)[1]
 
-def _break(s, find):
-    """Break a string s into the part before the substring to find,
-    and the part including and after the substring."""
-    i = s.find(find)
-    return s[:i], s[i:]
-
 def _get_order_limit_offset(sql):
     return _re_order_limit_offset.search(sql).groups()
 
+# (left quote, right quote) -> (token pattern, column name pattern)
+_select_patterns = {}
+
+
+def _get_select_patterns(left, right):
+    try:
+        return _select_patterns[left, right]
+    except KeyError:
+        pass
+    l, r = re.escape(left), re.escape(right)
+    # String literals and quoted names, matched whole so that what they
+    # hold is skipped, and the parentheses, commas and ' FROM [' between
+    # them. Each alternative can only match one way and the text in between
+    # isn't matched at all, so a scan takes linear time.
+    tokens = re.compile(
+        r"'(?:[^']|'')*(?:'|$)|{l}(?:[^{r}]|{r}{r})*(?:{r}|$)"
+        r"|(?P<from> FROM (?={l}))|(?P<open>\()|(?P<close>\))|(?P<comma>,)".format(l=l, r=r))
+    # The quoted column name at the end of a select list item, e.g. the
+    # [bar_column] of [foo_table].[bar_column], and the AS before it if it
+    # is an alias
+    column = re.compile(r"(\s+AS\s+)?{l}([^{l}]+){r}$".format(l=l, r=r), re.IGNORECASE)
+    _select_patterns[left, right] = tokens, column
+    return tokens, column
+
+
+def _split_select(sql, left, right):
+    """
+    Split `sql`, a SELECT without its leading keyword, into the items of
+    its select list and the rest of the statement from the first top level
+    ' FROM ' on. Commas and FROMs inside parentheses, string literals and
+    quoted names don't count.
+    """
+    tokens = _get_select_patterns(left, right)[0]
+    columns = []
+    depth = start = 0
+    end = len(sql)
+    for m in tokens.finditer(sql):
+        kind = m.lastgroup
+        if kind is None:
+            # A string literal or quoted name
+            continue
+        if kind == 'open':
+            depth += 1
+        elif kind == 'close':
+            depth -= 1
+        elif depth == 0:
+            if kind == 'comma':
+                columns.append(sql[start:m.end() - 1].strip())
+                start = m.end()
+            else:
+                end = m.start(kind)
+                break
+    columns.append(sql[start:end].strip())
+    return columns, sql[end:]
+
+
+def _rewrite_alias_columns(sql, left, right):
+    column_name = _get_select_patterns(left, right)[1]
+    columns, from_clause = _split_select(sql, left, right)
+    outer = []
+    inner = []
+    names_seen = {}
+    for col in columns:
+        match = column_name.search(col)
+        if not match:
+            raise Exception('Unable to find a column name when parsing SQL: {0}'.format(col))
+        col_name = match.group(2)
+        col_key = col_name.lower()
+        seen = names_seen.get(col_key, 0)
+        if seen:
+            alias = '{0}{1}___{2}{3}'.format(left, col_name, seen, right)
+            outer.append(alias)
+            if match.group(1):
+                # Replace the alias the column already has
+                col = col[:match.start()]
+            inner.append('{0} as {1}'.format(col, alias))
+        else:
+            outer.append('{0}{1}{2}'.format(left, col_name, right))
+            inner.append(col)
+        names_seen[col_key] = seen + 1
+    return ', '.join(outer), ', '.join(inner) + from_clause
+
+_cached_alias_columns = lru_cache(maxsize=SQL_CACHE_SIZE)(_rewrite_alias_columns)
+
+
+def _alias_columns(sql, left, right):
+    """
+    Return the outer select list and the inner SELECT (without its leading
+    keyword) for wrapping `sql` in a derived table, aliasing columns whose
+    names repeat an earlier column's.
+    """
+    if len(sql) > SQL_CACHE_MAX_LENGTH:
+        return _rewrite_alias_columns(sql, left, right)
+    return _cached_alias_columns(sql, left, right)
+
 def where_date(self, compiler, connection):
     query, data = self.as_sql(compiler, connection)
     if len(data) != 1:
@@ -123,22 +220,6 @@ def where_date(self, compiler, connection):
         return [query, [self.lhs]]
 
 class SQLCompiler(compiler.SQLCompiler):
-    def __init__(self,*args,**kwargs):
-        super(SQLCompiler,self).__init__(*args,**kwargs)
-        # Pattern to find the quoted column name at the end of a field
-        # specification
-        #
-        # E.g., if you're talking to MS SQL this regex would become
-        #     \[([^\[]+)\]$
-        #
-        # This would match the underlined part of the following string:
-        #   [foo_table][bar_column]
-        #              ^^^^^^^^^^^^
-        self._re_pat_col = re.compile(
-            r"\{left_sql_quote}([^\{left_sql_quote}]+)\{right_sql_quote}$".format(
-                left_sql_quote=self.connection.ops.left_sql_quote,
-                right_sql_quote=self.connection.ops.right_sql_quote))
-
     def compile(self, node, select_format=False):
         if self.connection.ops.is_openedge and type(node) is where.WhereNode:
             for val in node.children:
@@ -149,7 +230,27 @@ class SQLCompiler(compiler.SQLCompiler):
         args = [node]
         if select_format:
             args.append(select_format)
-        return super(SQLCompiler, self).compile(*args)
+        sql, params = super(SQLCompiler, self).compile(*args)
+        if params and isinstance(node, Lookup):
+            params = self._mark_varchar_params(node, params)
+        return sql, params
+
+    @tagging.tag_model
+    def execute_sql(self, *args, **kwargs):
+        # Let as_sql() cache the statement with its tags
+        self._tag_sql = self.connection.sql_tags is not None
+        return super(SQLCompiler, self).execute_sql(*args, **kwargs)
+
+    def _mark_varchar_params(self, lookup, params):
+        if not self.connection.string_param_sizes:
+            return params
+        try:
+            field = lookup.lhs.output_field
+        except Exception:
+            field = None
+        if field is not None and is_varchar_field(field, self.connection):
+            params = mark_varchar_params(params)
+        return params
 
     def resolve_columns(self, row, fields=()):
         # If the results are sliced, the resultset will have an initial
@@ -205,6 +306,94 @@ class SQLCompiler(compiler.SQLCompiler):
                 select[alias].sql_function = 'VARP'
 
     def as_sql(self, with_limits=True, with_col_aliases=False, qn=None, **kwargs):
+        cache = querycache.get_cache(self.connection)
+        # OpenEdge patches the WHERE leaves while compiling the WHERE clause,
+        # which a cache hit skips
+        if cache is None or self.connection.ops.is_openedge or \
+                (with_limits and self.query.low_mark == self.query.high_mark):
+            return self._as_sql(with_limits, with_col_aliases, **kwargs)
+
+        # The statement run by execute_sql() is cached tagged, so that each
+        # hit returns the same string and the cursor cache keyed on it
+        # doesn't have to hash a newly tagged copy
+        tags = tagging.current() if getattr(self, '_tag_sql', False) else None
+        leaves = []
+        try:
+            key = (querycache.query_key(self.query, leaves), with_limits, with_col_aliases,
+                   querycache.value_key(kwargs), self._slice_key(with_limits), tags)
+        except querycache.Uncacheable:
+            cache.uncacheable += 1
+            return self._as_sql(with_limits, with_col_aliases, **kwargs)
+
+        entry = cache.get(key)
+        if entry is querycache.UNCACHEABLE:
+            cache.uncacheable += 1
+            return self._as_sql(with_limits, with_col_aliases, **kwargs)
+        if entry is not None:
+            leaf_sql, leaf_params = self._compile_leaves(leaves)
+            if leaf_sql == entry.leaf_sql:
+                cache.hits += 1
+                self.setup_query()
+                self.where, self.having = self.query.where, None
+                self.has_extra_select = entry.has_extra_select
+                self._using_row_number = entry.using_row_number
+                return entry.sql, tuple(leaf_params) + self._slice_params(with_limits)
+
+        cache.misses += 1
+        sql, params = self._as_sql(with_limits, with_col_aliases, **kwargs)
+        # Only cache queries whose parameters are those of the WHERE leaves,
+        # in order, and those of the slicing
+        leaf_sql, leaf_params = self._compile_leaves(leaves)
+        if leaf_sql is not None and \
+                list(params) == leaf_params + list(self._slice_params(with_limits)):
+            if tags is not None:
+                sql = tagging.tag_sql(sql)
+            cache.set(key, querycache.CompiledSQL(sql, leaf_sql, self._using_row_number,
+                                                  self.has_extra_select))
+        else:
+            cache.set(key, querycache.UNCACHEABLE)
+        return sql, params
+
+    def _compile_leaves(self, leaves):
+        """
+        Return the SQL of each of the WHERE `leaves` and their parameters,
+        or (None, None) if one of them can't match anything. Lookups of a
+        value on a column only have their right hand side compiled; the
+        rest of their SQL follows from the structure of the query.
+        """
+        vendor_impl = 'as_' + self.connection.vendor
+        leaf_sql, leaf_params = [], []
+        try:
+            for leaf in leaves:
+                if type(leaf).as_sql in _rhs_only_as_sql and isinstance(leaf.lhs, Col) and \
+                        not hasattr(leaf.rhs, 'resolve_expression') and \
+                        not isinstance(leaf.rhs, bool) and not hasattr(leaf, vendor_impl):
+                    sql, params = leaf.process_rhs(self, self.connection)
+                    params = self._mark_varchar_params(leaf, params)
+                else:
+                    sql, params = self.compile(leaf)
+                leaf_sql.append(sql)
+                leaf_params.extend(params)
+        except EmptyResultSet:
+            return None, None
+        return tuple(leaf_sql), leaf_params
+
+    def _slice_params(self, with_limits):
+        """The OFFSET ... FETCH parameters as_sql() adds, if it pages that way."""
+        low, high = self.query.low_mark, self.query.high_mark
+        if not with_limits or not low or self.connection.ops.sql_server_ver < 2012:
+            return ()
+        return (low,) if high is None else (low, high - low)
+
+    def _slice_key(self, with_limits):
+        # Marks that are bound as parameters don't change the SQL
+        if not with_limits:
+            return None
+        if self._slice_params(with_limits):
+            return (True, self.query.high_mark is None)
+        return (self.query.low_mark, self.query.high_mark)
+
+    def _as_sql(self, with_limits=True, with_col_aliases=False, **kwargs):
         self.pre_sql_setup()
 
         # Django #12192 - Don't execute any DB query when QS slicing results in limit 0
@@ -242,6 +431,10 @@ class SQLCompiler(compiler.SQLCompiler):
                 sql = re.sub(r'(?i)^{0}'.format(_select), '{0} TOP {1}'.format(_select, self.query.high_mark), raw_sql, 1)
             return sql, fields
 
+        # SQL Server 2012 pages natively with OFFSET ... FETCH
+        if self.connection.ops.sql_server_ver >= 2012:
+            return self._offset_fetch(raw_sql, fields)
+
         # Else we have limits; rewrite the query using ROW_NUMBER()
         self._using_row_number = True
 
@@ -335,6 +528,26 @@ class SQLCompiler(compiler.SQLCompiler):
 
         return sql, fields
 
+    def _offset_fetch(self, raw_sql, params):
+        """
+        Slice `raw_sql` with ORDER BY ... OFFSET ... FETCH, which needs an
+        ORDER BY. Unordered queries are ordered by primary key like the
+        ROW_NUMBER() rewrite does, or by the first selected column when the
+        primary key can't be used (DISTINCT and GROUP BY queries).
+        """
+        if not self.get_order_by():
+            if self.query.distinct or self.query.group_by is not None:
+                order = '1'
+            else:
+                qn = self.connection.ops.quote_name
+                order = '{0}.{1}'.format(qn(self.query.get_initial_alias()),
+                                         qn(self.query.get_meta().pk.column))
+            raw_sql = '{0} ORDER BY {1}'.format(raw_sql, order)
+        sql = '{0} OFFSET %s ROWS'.format(raw_sql)
+        if self.query.high_mark is not None:
+            sql += ' FETCH NEXT %s ROWS ONLY'
+        return sql, tuple(params) + self._slice_params(True)
+
     def _select_top(self,select,inner_sql,number_to_fetch):
         if self.connection.ops.is_db2:
             return "{select} {inner_sql} FETCH FIRST {number_to_fetch} ROWS ONLY".format(
@@ -394,83 +607,8 @@ class SQLCompiler(compiler.SQLCompiler):
 
     def _alias_columns(self, sql):
         """Return tuple of SELECT and FROM clauses, aliasing duplicate column names."""
-        qn = self.connection.ops.quote_name
-
-        outer = list()
-        inner = list()
-        names_seen = list()
-
-        # replace all parens with placeholders
-        paren_depth, paren_buf = 0, ['']
-        parens, i = {}, 0
-        for ch in sql:
-            if ch == '(':
-                i += 1
-                paren_depth += 1
-                paren_buf.append('')
-            elif ch == ')':
-                paren_depth -= 1
-                key = '_placeholder_{0}'.format(i)
-                buf = paren_buf.pop()
-
-                # store the expanded paren string
-                buf = re.sub(r'%([^\(])', r'$$$\1', buf)
-                parens[key] = buf% parens
-                parens[key] = re.sub(r'\$\$\$([^\(])', r'%\1', parens[key])
-                #cannot use {} because IBM's DB2 uses {} as quotes
-                paren_buf[paren_depth] += '(%(' + key + ')s)'
-            else:
-                paren_buf[paren_depth] += ch
-
-        def _replace_sub(col):
-            """Replace all placeholders with expanded values"""
-            while _re_col_placeholder.search(col):
-                col = col.format(**parens)
-            return col
-
-        temp_sql = ''.join(paren_buf)
-
-        # replace any bare %s with placeholders.  Needed when the WHERE
-        # clause only contains one condition, and isn't wrapped in parens.
-        # the placeholder_data is used to prevent the variable "i" from
-        # being interpreted as a local variable in the replacement function
-        placeholder_data = { "i": i }
-        def _alias_placeholders(val):
-            i = placeholder_data["i"]
-            i += 1
-            placeholder_data["i"] = i
-            key = "_placeholder_{0}".format(i)
-            parens[key] = "%s"
-            return "%(" + key + ")s"
-
-        temp_sql = re.sub("%s", _alias_placeholders, temp_sql)
-
-        select_list, from_clause = _break(temp_sql, ' FROM ' + self.connection.ops.left_sql_quote)
-
-        for col in [x.strip() for x in select_list.split(',')]:
-            match = self._re_pat_col.search(col)
-            if match:
-                col_name = match.group(1)
-                col_key = col_name.lower()
-
-                if col_key in names_seen:
-                    alias = qn('{0}___{1}'.format(col_name, names_seen.count(col_key)))
-                    outer.append(alias)
-                    inner.append('{0} as {1}'.format(_replace_sub(col), alias))
-                else:
-                    outer.append(qn(col_name))
-                    inner.append(_replace_sub(col))
-
-                names_seen.append(col_key)
-            else:
-                raise Exception('Unable to find a column name when parsing SQL: {0}'.format(col))
-
-        return ', '.join(outer), ', '.join(inner) + (from_clause % parens)
-        #                                            ^^^^^^^^^^^^^^^^^^^^^
-        # We can't use `format` here, because `format` uses `{}` as special
-        # characters, but those happen to also be the quoting tokens for IBM's
-        # DB2
-
+        return _alias_columns(sql, self.connection.ops.left_sql_quote,
+                              self.connection.ops.right_sql_quote)
 
     def get_ordering(self):
         # The ORDER BY clause is invalid in views, inline functions,
@@ -484,6 +622,14 @@ class SQLCompiler(compiler.SQLCompiler):
 
 
 
+# (alias, table, fields, returning fields, nocount) -> SQL around the VALUES
+# list of a single row INSERT returning the new id
+_insert_returning_templates = {}
+
+# SQL Server error 334: OUTPUT without INTO on a table with enabled triggers
+_output_without_into_error = '(334)'
+
+
 class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
     # search for after table/column list
     _re_values_sub = re.compile(r'(?P<prefix>\)|\])(?P<default>\s*|\s*default\s*)values(?P<suffix>\s*|\s+\()?', re.IGNORECASE)
@@ -495,7 +641,20 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
         if not hasattr(self, 'return_id'):
             self.return_id = False
 
-        result = super(SQLInsertCompiler, self).as_sql(*args, **kwargs)
+        objs = self.query.objs
+        batch_size = self._max_insert_rows()
+        if len(objs) <= batch_size:
+            result = super(SQLInsertCompiler, self).as_sql(*args, **kwargs)
+        else:
+            # SQL Server takes at most 1000 rows in a VALUES list and 2100
+            # parameters per statement, so split up what doesn't fit.
+            result = []
+            try:
+                for start in range(0, len(objs), batch_size):
+                    self.query.objs = objs[start:start + batch_size]
+                    result.extend(super(SQLInsertCompiler, self).as_sql(*args, **kwargs))
+            finally:
+                self.query.objs = objs
         if isinstance(result, list):
             # Django 1.4 wraps return in list
             return [self._fix_insert(x[0], x[1]) for x in result]
@@ -503,6 +662,244 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
         sql, params = result
         return self._fix_insert(sql, params)
 
+    def field_as_sql(self, field, val):
+        sql, params = super(SQLInsertCompiler, self).field_as_sql(field, val)
+        if params and field is not None and self.connection.string_param_sizes and \
+                is_varchar_field(field, self.connection):
+            params = mark_varchar_params(params)
+        return sql, params
+
+    def _max_insert_rows(self):
+        """
+        Return how many objects a single multi-row INSERT can take.
+        """
+        if getattr(self, 'returning_fields', None) or self.return_id or \
+                not self.connection.features.has_bulk_insert:
+            # One statement per object anyway
+            return len(self.query.objs) or 1
+        if not self.query.fields:
+            # Each object is its own INSERT ... DEFAULT VALUES
+            return 1
+        return self.connection.ops.max_insert_rows(self.query.fields)
+
+    def _insert_rows(self):
+        """
+        Return the INSERT INTO ... (columns) prefix with the placeholders and
+        parameters of each object, as Django's as_sql() would build them.
+        """
+        qn = self.connection.ops.quote_name
+        opts = self.query.get_meta()
+        fields = self.query.fields
+        value_rows = [
+            [self.prepare_value(field, self.pre_save_val(field, obj)) for field in fields]
+            for obj in self.query.objs
+        ]
+        placeholder_rows, param_rows = self.assemble_as_sql(fields, value_rows)
+        prefix = 'INSERT INTO %s (%s)' % (qn(opts.db_table), ', '.join(qn(f.column) for f in fields))
+        return prefix, placeholder_rows, param_rows
+
+    @tagging.tag_model
+    def execute_sql(self, *args, **kwargs):
+        # returning_fields on Django 3.1, return_id on 2.0
+        returning = args[0] if args else kwargs.get('returning_fields', kwargs.get('return_id'))
+        if returning and self._returning_known(returning):
+            # Nothing to read back: insert as if nothing were asked for
+            returning = None
+            args, kwargs = (), {}
+        if returning and len(self.query.objs) > 1 and self.query.fields and \
+                self.connection.features.can_return_ids_from_bulk_insert:
+            return self._execute_returning_rows(returning)
+        if returning and len(self.query.objs) == 1 and \
+                self.connection.features.can_return_id_from_insert and \
+                not (self.connection.ops.is_db2 or self.connection.ops.is_openedge):
+            return self._execute_returning_row(returning)
+        if returning or self.connection.fast_executemany is None or \
+                len(self.query.objs) < 2 or not self.query.fields or \
+                getattr(self.query, 'ignore_conflicts', False):
+            return super(SQLInsertCompiler, self).execute_sql(*args, **kwargs)
+
+        self.return_id = False
+        self.returning_fields = None
+        prefix, placeholder_rows, param_rows = self._insert_rows()
+        if len(set(tuple(p) for p in placeholder_rows)) != 1:
+            # Per-object placeholders differ; can't be sent as one batch
+            return super(SQLInsertCompiler, self).execute_sql(*args, **kwargs)
+
+        sql = '%s VALUES (%s)' % (prefix, ', '.join(placeholder_rows[0]))
+        meta = self.query.get_meta()
+        identity_insert = meta.auto_field is not None and \
+            meta.auto_field in self.query.fields
+        quoted_table = self.connection.ops.quote_name(meta.db_table)
+        with self.connection.cursor() as cursor:
+            if identity_insert:
+                cursor.execute('SET IDENTITY_INSERT %s ON' % quoted_table)
+            try:
+                cursor.set_input_sizes(field_input_sizes(self.query.fields, self.connection))
+                cursor.executemany(sql, param_rows)
+            finally:
+                if identity_insert:
+                    cursor.execute('SET IDENTITY_INSERT %s OFF' % quoted_table)
+        if self.connection._DJANGO_VERSION >= 31:
+            return []
+
+    def _returning_known(self, returning):
+        """
+        Whether the objects already have the values of `returning`: Django
+        3.1 asks for the primary key of objects that have one, in save() and
+        bulk_create(), and only assigns the fields that aren't the pk.
+        """
+        meta = self.query.get_meta()
+        if returning is True or meta.pk not in self.query.fields:
+            return False
+        return all(field is meta.pk for field in returning)
+
+    def _execute_returning_row(self, returning):
+        """
+        Insert a single object and return the values of `returning` for it.
+
+        Tables without triggers get a plain INSERT ... OUTPUT INSERTED.pk;
+        OUTPUT without INTO isn't allowed on tables with triggers, so those
+        go through a table variable instead. The statement around the
+        VALUES list only depends on the model and fields, so it is built
+        once and cached. If a trigger was created since, the insert fails and
+        is retried once through the table variable.
+        """
+        meta = self.query.get_meta()
+        if returning is True:
+            # Django 2.0's return_id
+            returning_fields = (meta.pk,)
+        else:
+            returning_fields = tuple(returning)
+        fields = tuple(self.query.fields)
+        key = (self.connection.alias, meta.db_table, fields, returning_fields,
+               self.connection.session_init.get('nocount'))
+
+        with self.connection.cursor() as cursor:
+            template = _insert_returning_templates.get(key)
+            if template is None:
+                has_triggers = self.connection.introspection.has_triggers(
+                    cursor, meta.db_table)
+                template = self._insert_returning_template(fields, returning_fields, has_triggers)
+                _insert_returning_templates[key] = template
+
+            if fields:
+                prefix, placeholder_rows, param_rows = self._insert_rows()
+                values = 'VALUES (%s)' % ', '.join(placeholder_rows[0])
+                params = param_rows[0]
+            else:
+                values = 'DEFAULT VALUES'
+                params = []
+            try:
+                cursor.execute(template[0] + values + template[1], params)
+            except DatabaseError as e:
+                if _output_without_into_error not in str(e) or \
+                        not self.connection.introspection.has_triggers(
+                            cursor, meta.db_table, refresh=True):
+                    raise
+                template = self._insert_returning_template(fields, returning_fields, True)
+                _insert_returning_templates[key] = template
+                cursor.execute(template[0] + values + template[1], params)
+            while cursor.description is None and cursor.nextset():
+                pass
+            row = cursor.fetchone()
+        if returning is True:
+            return row[0]
+        return [tuple(row)]
+
+    def _insert_returning_template(self, fields, returning_fields, has_triggers):
+        """
+        Return the SQL to put before and after the VALUES list of a single
+        row INSERT that returns `returning_fields`.
+        """
+        qn = self.connection.ops.quote_name
+        meta = self.query.get_meta()
+        quoted_table = qn(meta.db_table)
+        columns = ' (%s)' % ', '.join(qn(f.column) for f in fields) if fields else ''
+        inserted = ', '.join('INSERTED.%s' % qn(f.column) for f in returning_fields)
+        if not has_triggers:
+            before = 'INSERT INTO %s%s OUTPUT %s ' % (quoted_table, columns, inserted)
+            after = ''
+        else:
+            before = 'SET NOCOUNT ON; DECLARE @sqlserver_ado_return_id table (%s); ' \
+                'INSERT INTO %s%s OUTPUT %s INTO @sqlserver_ado_return_id ' % (
+                    ', '.join('%s %s' % (qn(f.column), _re_data_type_terminator.split(
+                        f.db_type(self.connection))[0]) for f in returning_fields),
+                    quoted_table, columns, inserted)
+            after = '; SELECT * FROM @sqlserver_ado_return_id'
+            if not self.connection.session_init.get('nocount'):
+                after += '; SET NOCOUNT OFF'
+        if meta.auto_field is not None and meta.auto_field in fields:
+            before = 'SET IDENTITY_INSERT %s ON; %s' % (quoted_table, before)
+            after = '%s; SET IDENTITY_INSERT %s OFF' % (after, quoted_table)
+        return before, after
+
+    def _execute_returning_rows(self, returning):
+        """
+        Insert several objects and return the values of `returning` for each
+        of them, in the order of the objects.
+
+        The rows are inserted with a MERGE rather than INSERT, because MERGE
+        can OUTPUT a column of its source: the position of each row, which
+        puts the generated values back in order. OUTPUT ... INTO a table
+        variable also works on tables with triggers.
+        """
+        meta = self.query.get_meta()
+        if returning is True:
+            # Django 2.0's return_id
+            returning_fields = [meta.pk]
+        else:
+            returning_fields = list(returning)
+        qn = self.connection.ops.quote_name
+        fields = self.query.fields
+        quoted_table = qn(meta.db_table)
+        source_columns = ['[c%d]' % i for i in range(len(fields))]
+        columns = ', '.join(qn(f.column) for f in fields)
+        return_columns = ', '.join(
+            '%s %s' % (qn(f.column), _re_data_type_terminator.split(f.db_type(self.connection))[0])
+            for f in returning_fields)
+
+        identity_insert = meta.auto_field is not None and meta.auto_field in fields
+        nocount = self.connection.session_init.get('nocount')
+        objs = self.query.objs
+        batch_size = self.connection.ops.max_insert_rows(fields)
+        rows = []
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                self.query.objs = objs[start:start + batch_size]
+                try:
+                    prefix, placeholder_rows, param_rows = self._insert_rows()
+                finally:
+                    self.query.objs = objs
+                values = ', '.join(
+                    '(%s, %d)' % (', '.join(placeholders), i)
+                    for i, placeholders in enumerate(placeholder_rows))
+                statements = [
+                    'SET NOCOUNT ON',
+                    'DECLARE @sqlserver_ado_return_rows table ([_ord] int, %s)' % return_columns,
+                    'MERGE INTO {table} USING (VALUES {values}) AS [src] ({source}, [_ord]) ON 1 = 0 '
+                    'WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({source_values}) '
+                    'OUTPUT [src].[_ord], {inserted} INTO @sqlserver_ado_return_rows'.format(
+                        table=quoted_table,
+                        values=values,
+                        source=', '.join(source_columns),
+                        columns=columns,
+                        source_values=', '.join('[src].%s' % c for c in source_columns),
+                        inserted=', '.join('INSERTED.%s' % qn(f.column) for f in returning_fields),
+                    ),
+                    'SELECT %s FROM @sqlserver_ado_return_rows ORDER BY [_ord]' %
+                    ', '.join(qn(f.column) for f in returning_fields),
+                ]
+                if identity_insert:
+                    statements.insert(2, 'SET IDENTITY_INSERT %s ON' % quoted_table)
+                    statements.append('SET IDENTITY_INSERT %s OFF' % quoted_table)
+                if not nocount:
+                    statements.append('SET NOCOUNT OFF')
+                cursor.execute('; '.join(statements), [p for ps in param_rows for p in ps])
+                rows.extend(cursor.fetchall())
+        if returning is True:
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+
     def _fix_insert(self, sql, params):
         """
         Wrap the passed SQL with IDENTITY_INSERT statements and apply
@@ -510,7 +907,8 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
         """
         meta = self.query.get_meta()
 
-        if getattr(meta, 'has_auto_field',False):
+        # Options.has_auto_field is gone since Django 1.10
+        if getattr(meta, 'has_auto_field', False) or getattr(meta, 'auto_field', None) is not None:
             if hasattr(self.query, 'fields'):
                 # django 1.4 replaced columns with fields
                 fields = self.query.fields
@@ -560,6 +958,135 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
 
         return sql, params
 
+class SQLMergeCompiler(SQLInsertCompiler):
+    """
+    Compiler for django_pyodbc.bulk.MergeQuery: inserts the objects, or
+    updates the rows that already exist for their unique fields, with one
+    MERGE statement per batch.
+    """
+    def as_sql(self):
+        """
+        Return a (sql, params) pair for each batch of objects.
+        """
+        qn = self.connection.ops.quote_name
+        meta = self.query.get_meta()
+        fields = self.query.fields
+        source_columns = ['[c%d]' % i for i in range(len(fields))]
+        source = dict((f, c) for f, c in zip(fields, source_columns))
+
+        merge = 'MERGE INTO %s WITH (HOLDLOCK) AS [target] USING (VALUES {values}) ' \
+            'AS [src] (%s) ON %s' % (
+                qn(meta.db_table),
+                ', '.join(source_columns),
+                ' AND '.join('[target].%s = [src].%s' % (qn(f.column), source[f])
+                             for f in self.query.unique_fields))
+        if self.query.update_fields:
+            merge += ' WHEN MATCHED THEN UPDATE SET %s' % ', '.join(
+                '[target].%s = [src].%s' % (qn(f.column), source[f])
+                for f in self.query.update_fields)
+        merge += ' WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s)' \
+            ' OUTPUT $action INTO @sqlserver_ado_merge_actions' % (
+                ', '.join(qn(f.column) for f in fields),
+                ', '.join('[src].%s' % c for c in source_columns))
+        statements = [
+            'SET NOCOUNT ON',
+            'DECLARE @sqlserver_ado_merge_actions table ([action] nvarchar(10))',
+            merge,
+            "SELECT COALESCE(SUM(CASE WHEN [action] = 'INSERT' THEN 1 ELSE 0 END), 0), "
+            "COALESCE(SUM(CASE WHEN [action] = 'UPDATE' THEN 1 ELSE 0 END), 0) "
+            "FROM @sqlserver_ado_merge_actions",
+        ]
+        if meta.auto_field is not None and meta.auto_field in fields:
+            statements.insert(2, 'SET IDENTITY_INSERT %s ON' % qn(meta.db_table))
+            statements.append('SET IDENTITY_INSERT %s OFF' % qn(meta.db_table))
+        if not self.connection.session_init.get('nocount'):
+            statements.append('SET NOCOUNT OFF')
+        template = '; '.join(statements)
+
+        objs = self.query.objs
+        batch_size = self.connection.ops.max_insert_rows(fields)
+        result = []
+        try:
+            for start in range(0, len(objs), batch_size):
+                self.query.objs = objs[start:start + batch_size]
+                prefix, placeholder_rows, param_rows = self._insert_rows()
+                values = ', '.join('(%s)' % ', '.join(p) for p in placeholder_rows)
+                result.append((template.replace('{values}', values, 1),
+                               tuple(p for ps in param_rows for p in ps)))
+        finally:
+            self.query.objs = objs
+        return result
+
+    @tagging.tag_model
+    def execute_sql(self):
+        """
+        Run the MERGE statements and return the numbers of inserted and
+        updated rows.
+        """
+        inserted = updated = 0
+        with self.connection.cursor() as cursor:
+            for sql, params in self.as_sql():
+                cursor.execute(sql, params)
+                while cursor.description is None and cursor.nextset():
+                    pass
+                row = cursor.fetchone()
+                inserted += row[0]
+                updated += row[1]
+        return inserted, updated
+
+
+class SQLBulkUpdateCompiler(SQLInsertCompiler):
+    """
+    Compiler for django_pyodbc.bulk.BulkUpdateQuery: sets the given fields
+    of many objects with one UPDATE per batch, joining the table to the new
+    values on the primary key.
+    """
+    def as_sql(self):
+        """
+        Return a (sql, params) pair for each batch of objects.
+        """
+        qn = self.connection.ops.quote_name
+        meta = self.query.get_meta()
+        # The first field is the primary key
+        fields = self.query.fields
+        source_columns = ['[c%d]' % i for i in range(len(fields))]
+        quoted_table = qn(meta.db_table)
+        update = 'UPDATE [target] SET %s FROM %s AS [target] INNER JOIN (VALUES {values}) ' \
+            'AS [src] (%s) ON [target].%s = [src].%s' % (
+                ', '.join('[target].%s = [src].%s' % (qn(f.column), c)
+                          for f, c in zip(fields[1:], source_columns[1:])),
+                quoted_table,
+                ', '.join(source_columns),
+                qn(fields[0].column),
+                source_columns[0])
+
+        objs = self.query.objs
+        batch_size = self.connection.ops.max_insert_rows(fields)
+        result = []
+        try:
+            for start in range(0, len(objs), batch_size):
+                self.query.objs = objs[start:start + batch_size]
+                prefix, placeholder_rows, param_rows = self._insert_rows()
+                values = ', '.join('(%s)' % ', '.join(p) for p in placeholder_rows)
+                result.append((update.replace('{values}', values, 1),
+                               tuple(p for ps in param_rows for p in ps)))
+        finally:
+            self.query.objs = objs
+        return result
+
+    @tagging.tag_model
+    def execute_sql(self):
+        """
+        Run the UPDATE statements and return the number of rows updated.
+        """
+        rows = 0
+        with self.connection.cursor() as cursor:
+            for sql, params in self.as_sql():
+                cursor.execute(sql, params)
+                rows += cursor.rowcount
+        return rows
+
+
 class SQLInsertCompiler2(compiler.SQLInsertCompiler, SQLCompiler):
 
     def as_sql_legacy(self):
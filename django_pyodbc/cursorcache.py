@@ -0,0 +1,126 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of pyodbc cursors keyed by SQL text, one per connection to the server.
+
+pyodbc only skips SQLPrepare when a cursor executes the same SQL as the
+statement it ran last, and Django opens a new cursor for almost every
+statement. With the cache, CursorWrapper runs each statement on the cursor
+that ran the same SQL before, so it is prepared once per connection.
+
+A cursor is checked out by one CursorWrapper at a time; a statement whose
+cursor is in use runs on the wrapper's own cursor instead. Cursors not in
+use are closed, least recently used first, to keep at most `maxsize`
+statement handles open. Like the connection it belongs to, a cache is only
+used by one thread.
+"""
+from collections import OrderedDict, namedtuple
+
+from django.db import connections
+
+DEFAULT_SIZE = 64
+
+
+class CacheInfo(namedtuple('CacheInfo', 'hits misses busy evictions maxsize currsize')):
+    __slots__ = ()
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses + self.busy
+        return float(self.hits) / lookups if lookups else 0.0
+
+
+def _close(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+class CursorCache(object):
+    """
+    Least recently used cache of the cursors of `connection`, a pyodbc
+    connection, keyed by the SQL they last executed.
+    """
+    def __init__(self, connection, maxsize=DEFAULT_SIZE):
+        self.connection = connection
+        self.maxsize = maxsize
+        self.hits = self.misses = self.busy = self.evictions = 0
+        self._cursors = OrderedDict()
+        # SQL -> the CursorWrapper its cursor is checked out by
+        self._owners = {}
+
+    def checkout(self, sql, owner):
+        """
+        Return the cursor to execute `sql` on, reserved for `owner` until
+        release(sql), or None if another wrapper has it.
+        """
+        cursor = self._cursors.get(sql)
+        if cursor is None:
+            self.misses += 1
+            cursor = self._cursors[sql] = self.connection.cursor()
+            self._owners[sql] = owner
+            self._evict()
+            return cursor
+        if sql in self._owners:
+            self.busy += 1
+            return None
+        self.hits += 1
+        self._cursors.move_to_end(sql)
+        self._owners[sql] = owner
+        return cursor
+
+    def release(self, sql, discard=False):
+        """
+        Make the cursor of `sql` available again, or close it if `discard`
+        is true (its state is unknown after an error, say).
+        """
+        self._owners.pop(sql, None)
+        if discard:
+            cursor = self._cursors.pop(sql, None)
+            if cursor is not None:
+                _close(cursor)
+        self._evict()
+
+    def _evict(self):
+        if len(self._cursors) <= self.maxsize:
+            return
+        for sql in list(self._cursors):
+            if sql not in self._owners:
+                _close(self._cursors.pop(sql))
+                self.evictions += 1
+                if len(self._cursors) <= self.maxsize:
+                    return
+
+    def close(self):
+        for cursor in self._cursors.values():
+            _close(cursor)
+        self._cursors.clear()
+        self._owners.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.busy, self.evictions,
+                         self.maxsize, len(self._cursors))
+
+
+def cache_info(using='default'):
+    """
+    Return the hits, misses, busy lookups (the cursor was in use), evictions,
+    maximum and current size of the cursor cache of database `using` in this
+    thread, since its connection was opened, or None if it has no cache.
+    hit_ratio is hits over all lookups.
+    """
+    cache = connections[using]._cursor_cache
+    return cache.info() if cache is not None else None
@@ -0,0 +1,217 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Single row statements by primary key, written once per model from its
+_meta rather than built as a Query and compiled on every call, and run on
+a cursor kept open on the connection.
+
+    class Book(models.Model):
+        ...
+        objects = models.Manager()
+        fast = FastPathManager()
+
+    book = Book.fast.get(pk)
+    book.title = 'New title'
+    Book.fast.update(book, ['title'])
+    Book.fast.delete(book)
+
+They skip what the ORM does around the statement: no signals are sent,
+update() doesn't save parent models or check that the row exists and
+delete() doesn't collect related objects.
+"""
+import threading
+
+from django.db import connections, models, router
+
+from django_pyodbc.inputsizes import is_varchar_field, mark_varchar_params
+
+
+class FastPaths(object):
+    """
+    The statements for one model on one database, and what is needed to
+    bind their parameters and turn their rows into model instances.
+    """
+    def __init__(self, model, connection):
+        meta = model._meta
+        qn = connection.ops.quote_name
+        self.model = model
+        self.pk = meta.pk
+        self.fields = list(meta.concrete_fields)
+        self.field_names = [f.attname for f in self.fields]
+        self.columns = dict((f.attname, qn(f.column)) for f in self.fields)
+        self.table = qn(meta.db_table)
+        self.where_pk = ' WHERE {0} = %s'.format(self.columns[self.pk.attname])
+        self.select_sql = 'SELECT {0} FROM {1}{2}'.format(
+            ', '.join(self.columns[name] for name in self.field_names), self.table, self.where_pk)
+        self.delete_sql = 'DELETE FROM {0}{1}'.format(self.table, self.where_pk)
+        self.varchar_fields = frozenset(f.attname for f in self.fields
+                                        if connection.string_param_sizes and
+                                        is_varchar_field(f, connection))
+        # field names -> UPDATE statement setting them
+        self._update_sql = {}
+
+        self.converters = []
+        for i, field in enumerate(self.fields):
+            expression = field.get_col(meta.db_table)
+            converters = connection.ops.get_db_converters(expression) + \
+                expression.get_db_converters(connection)
+            if converters:
+                self.converters.append((i, expression, converters))
+
+    def param(self, field, value):
+        if field.attname in self.varchar_fields:
+            return mark_varchar_params([value])[0]
+        return value
+
+    def pk_param(self, pk, connection):
+        return self.param(self.pk, self.pk.get_db_prep_value(pk, connection))
+
+    def update_sql(self, fields):
+        key = tuple(f.attname for f in fields)
+        try:
+            return self._update_sql[key]
+        except KeyError:
+            pass
+        sql = self._update_sql[key] = 'UPDATE {0} SET {1}{2}'.format(
+            self.table, ', '.join('{0} = %s'.format(self.columns[name]) for name in key),
+            self.where_pk)
+        return sql
+
+    def from_row(self, row, using, connection):
+        values = list(row)
+        for i, expression, converters in self.converters:
+            value = values[i]
+            for converter in converters:
+                value = converter(value, expression, connection)
+            values[i] = value
+        return self.model.from_db(using, self.field_names, values)
+
+
+# (model, database alias) -> FastPaths, or None for models they can't handle
+_fast_paths = {}
+_lock = threading.Lock()
+
+
+def get_fast_paths(model, connection):
+    """
+    Return the FastPaths of `model` on `connection`, or None if the model
+    has fields in more than one table (multi-table inheritance).
+    """
+    key = (model, connection.alias)
+    try:
+        return _fast_paths[key]
+    except KeyError:
+        pass
+    if model._meta.concrete_model._meta.parents:
+        paths = None
+    else:
+        paths = FastPaths(model, connection)
+    with _lock:
+        return _fast_paths.setdefault(key, paths)
+
+
+def get_cursor(connection):
+    """
+    Return the cursor the fast paths run on, opened once per connection to
+    the server and reused. DatabaseWrapper._close() drops it; it is also
+    replaced when queries start or stop being logged, since the cursor
+    Django returns logs them or not.
+    """
+    cached = connection._fast_path_cursor
+    logged = connection.queries_logged
+    if cached is not None:
+        if cached[0] is connection.connection and cached[1] == logged:
+            return cached[2]
+        cached[2].close()
+    cursor = connection.cursor()
+    connection._fast_path_cursor = (connection.connection, logged, cursor)
+    return cursor
+
+
+class FastPathManager(models.Manager):
+    """
+    Manager with precompiled get(pk), update(obj, fields) and delete(obj)
+    for single rows. Called with anything else, get() and update() are the
+    usual QuerySet methods. Models with multi-table inheritance go through
+    the ORM.
+    """
+    def _paths(self, using):
+        connection = connections[using]
+        return connection, get_fast_paths(self.model, connection)
+
+    def get(self, *args, **kwargs):
+        if len(args) != 1 or kwargs:
+            return super(FastPathManager, self).get(*args, **kwargs)
+        pk = args[0]
+        using = self.db
+        connection, paths = self._paths(using)
+        if paths is None:
+            return super(FastPathManager, self).get(pk=pk)
+        cursor = get_cursor(connection)
+        cursor.execute(paths.select_sql, (paths.pk_param(pk, connection),))
+        rows = cursor.fetchmany(2)
+        if not rows:
+            raise self.model.DoesNotExist(
+                "%s matching query does not exist." % self.model._meta.object_name)
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                "get() returned more than one %s." % self.model._meta.object_name)
+        return paths.from_row(rows[0], using, connection)
+
+    def update(self, *args, **kwargs):
+        """
+        update(obj, fields=None) writes the given fields of `obj` (all its
+        fields by default) to its row and returns the number of rows
+        updated.
+        """
+        if not args:
+            return super(FastPathManager, self).update(**kwargs)
+        obj = args[0]
+        fields = args[1] if len(args) > 1 else kwargs.get('fields')
+        using = kwargs.get('using') or obj._state.db or self._db or \
+            router.db_for_write(self.model, instance=obj)
+        connection, paths = self._paths(using)
+        meta = self.model._meta
+        if fields is None:
+            fields = [f for f in meta.concrete_fields if not f.primary_key]
+        else:
+            fields = [meta.get_field(name) for name in fields]
+        if paths is None or any(f.model is not meta.concrete_model for f in fields):
+            return self.db_manager(using).filter(pk=obj.pk).update(**dict(
+                (f.attname, f.pre_save(obj, False)) for f in fields))
+        params = [paths.param(f, f.get_db_prep_save(f.pre_save(obj, False), connection))
+                  for f in fields]
+        params.append(paths.pk_param(obj.pk, connection))
+        cursor = get_cursor(connection)
+        cursor.execute(paths.update_sql(fields), params)
+        return cursor.rowcount
+
+    def delete(self, obj, using=None):
+        """
+        Delete the row of `obj`, a model instance or a primary key value, and
+        return the number of rows deleted.
+        """
+        if isinstance(obj, models.Model):
+            pk = obj.pk
+            using = using or obj._state.db
+        else:
+            pk = obj
+        using = using or self._db or router.db_for_write(self.model)
+        connection, paths = self._paths(using)
+        if paths is None:
+            return self.db_manager(using).filter(pk=pk).delete()[0]
+        cursor = get_cursor(connection)
+        cursor.execute(paths.delete_sql, (paths.pk_param(pk, connection),))
+        return cursor.rowcount
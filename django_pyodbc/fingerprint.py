@@ -0,0 +1,80 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fingerprints of T-SQL statements: the statement with what varies between
+runs of the same query taken out, so that they can be counted together.
+
+- string and number literals become ?
+- IN lists of any length become IN (...)
+- comments are dropped and whitespace is collapsed
+- the aliases of the ROW_NUMBER() paging wrapper (AAAA, BBBB, QQQ, QQQQ)
+  are dropped and its _row_num column only shows in the page predicate,
+  as ROW_NUMBER()
+"""
+import hashlib
+import re
+from functools import lru_cache
+
+from django_pyodbc.compat import SQL_CACHE_MAX_LENGTH, SQL_CACHE_SIZE
+
+_tokens = re.compile(r"""
+    (?P<name>\[[^\]]*\]|"[^"]*")
+  | (?P<string>[Nn]?'(?:[^']|'')*')
+  | (?P<comment>/\*.*?\*/|--[^\n]*)
+  | (?P<number>(?<![\w@#$])(?:0x[0-9A-Fa-f]*|(?:\d+\.?\d*|\.\d+)(?:[Ee][-+]?\d+)?))
+  | (?P<space>\s+)
+""", re.VERBOSE | re.DOTALL)
+
+_in_list = re.compile(r'(?i)\bIN \((?: ?\?,)* ?\? ?\)')
+
+_wrapper_alias = re.compile(r'(?i)(?: AS)? \[?(?:AAAA|BBBB|QQQQ?)\]?(?=\s|\)|$)|\[?\b(?:AAAA|BBBB|QQQQ?)\]?\.')
+_row_num_column = re.compile(r'(?i), (?:django_pyodbc)?_row_num(?= FROM )| as (?:django_pyodbc)?_row_num\b')
+_row_num = re.compile(r'(?i)\b(?:django_pyodbc)?_row_num\b')
+
+
+def _replace_token(match):
+    kind = match.lastgroup
+    if kind == 'name':
+        return match.group()
+    if kind == 'string' or kind == 'number':
+        return '?'
+    return ' '
+
+
+def _normalize(sql):
+    sql = _tokens.sub(_replace_token, sql)
+    sql = ' '.join(sql.split())
+    sql = _in_list.sub('IN (...)', sql)
+    if '_row_num' in sql:
+        sql = _row_num_column.sub('', sql)
+        sql = _row_num.sub('ROW_NUMBER()', sql)
+        sql = _wrapper_alias.sub('', sql)
+    return sql
+
+
+_cached_normalize = lru_cache(maxsize=SQL_CACHE_SIZE)(_normalize)
+
+
+def normalize(sql):
+    """Return the fingerprint of `sql`, a statement as sent to the server."""
+    if len(sql) > SQL_CACHE_MAX_LENGTH:
+        return _normalize(sql)
+    return _cached_normalize(sql)
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def fingerprint_id(fingerprint):
+    """A short stable id for a fingerprint, for use as a metric label."""
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,230 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parameter binding sizes for pyodbc's cursor.setinputsizes().
+
+The sizes are worked out from the column types DatabaseCreation.data_types
+gives each model field, so executemany() with fast_executemany can bind its
+parameter arrays once instead of asking the driver to describe every
+parameter.
+"""
+import re
+from functools import lru_cache
+
+from django_pyodbc.compat import text_type
+
+# ODBC SQL type codes (sql.h, sqlext.h)
+SQL_DECIMAL = 3
+SQL_INTEGER = 4
+SQL_SMALLINT = 5
+SQL_REAL = 7
+SQL_DOUBLE = 8
+SQL_VARCHAR = 12
+SQL_TYPE_DATE = 91
+SQL_TYPE_TIMESTAMP = 93
+SQL_VARBINARY = -3
+SQL_BIGINT = -5
+SQL_TINYINT = -6
+SQL_BIT = -7
+SQL_WVARCHAR = -9
+SQL_GUID = -11
+
+# Longest value a bound (non-max) varchar, nvarchar or varbinary parameter
+# can take. Anything longer has to be streamed, which fast_executemany can't.
+MAX_VARCHAR_SIZE = 8000
+MAX_NVARCHAR_SIZE = 4000
+MAX_VARBINARY_SIZE = 8000
+
+_re_db_type = re.compile(r'^\s*([a-z][a-z0-9]*(?: precision)?)\s*(?:\(\s*([^)]*)\))?(?:\s|$)', re.IGNORECASE)
+
+# type name -> (sql type, size, decimal digits)
+_fixed_types = {
+    'bigint': (SQL_BIGINT, 0, 0),
+    'bit': (SQL_BIT, 0, 0),
+    'date': (SQL_TYPE_DATE, 10, 0),
+    'datetime': (SQL_TYPE_TIMESTAMP, 23, 3),
+    'datetime2': (SQL_TYPE_TIMESTAMP, 27, 7),
+    'double precision': (SQL_DOUBLE, 0, 0),
+    'float': (SQL_DOUBLE, 0, 0),
+    'int': (SQL_INTEGER, 0, 0),
+    'integer': (SQL_INTEGER, 0, 0),
+    'real': (SQL_REAL, 0, 0),
+    'smalldatetime': (SQL_TYPE_TIMESTAMP, 16, 0),
+    'smallint': (SQL_SMALLINT, 0, 0),
+    'tinyint': (SQL_TINYINT, 0, 0),
+    'uniqueidentifier': (SQL_GUID, 16, 0),
+}
+
+_variable_types = {
+    'char': SQL_VARCHAR,
+    'varchar': SQL_VARCHAR,
+    'nchar': SQL_WVARCHAR,
+    'nvarchar': SQL_WVARCHAR,
+    'binary': SQL_VARBINARY,
+    'varbinary': SQL_VARBINARY,
+}
+
+# Bytes a bound value of each type takes in a parameter array
+_type_widths = {
+    SQL_BIGINT: 8,
+    SQL_BIT: 1,
+    SQL_DECIMAL: 19,
+    SQL_DOUBLE: 8,
+    SQL_GUID: 16,
+    SQL_INTEGER: 4,
+    SQL_REAL: 4,
+    SQL_SMALLINT: 2,
+    SQL_TINYINT: 1,
+    SQL_TYPE_DATE: 6,
+    SQL_TYPE_TIMESTAMP: 16,
+}
+
+
+# Strings are bound with their length rounded up to one of these (or as
+# (max) beyond the last), so statements that only differ in the length of a
+# string parameter share a cached plan on the server.
+STRING_SIZE_BUCKETS = (64, 256, 4000)
+
+
+class VarcharParam(text_type):
+    """
+    A string parameter compared to or stored in a varchar column. Bound as
+    varchar rather than nvarchar, so the server doesn't have to convert the
+    column (and scan instead of seek) to compare it.
+    """
+
+
+@lru_cache(maxsize=None)
+def db_type_input_size(db_type):
+    """
+    Return the (sql type, size, decimal digits) to bind a parameter for a
+    column of `db_type` (e.g. 'nvarchar(100)'), or None to let the driver
+    work it out. Variable length (max) types get a size of 0.
+    """
+    if not db_type:
+        return None
+    m = _re_db_type.match(db_type)
+    if m is None:
+        return None
+    name, args = m.group(1).lower(), m.group(2)
+    if name in _fixed_types:
+        return _fixed_types[name]
+    if name in _variable_types:
+        if not args or args.strip().lower() == 'max':
+            size = 0
+        else:
+            try:
+                size = int(args)
+            except ValueError:
+                return None
+        return (_variable_types[name], size, 0)
+    if name in ('decimal', 'numeric') and args:
+        try:
+            digits = [int(a) for a in args.split(',')]
+        except ValueError:
+            return None
+        return (SQL_DECIMAL, digits[0], digits[1] if len(digits) > 1 else 0)
+    # time, datetimeoffset and anything unknown are left to the driver
+    return None
+
+
+def field_input_sizes(fields, connection):
+    """
+    Return the list of input sizes for parameters bound to `fields`, in
+    order, as cursor.setinputsizes() takes them.
+    """
+    return [db_type_input_size(f.db_type(connection)) if f is not None else None
+            for f in fields]
+
+
+def row_width(input_sizes, max_size=MAX_NVARCHAR_SIZE):
+    """
+    Estimate the bytes one row of parameters takes when bound with
+    `input_sizes`. Columns without a size count as `max_size` characters.
+    """
+    width = 0
+    for size in input_sizes:
+        if size is None:
+            width += max_size * 2
+            continue
+        sql_type, column_size = size[0], size[1]
+        if sql_type in _type_widths:
+            width += _type_widths[sql_type]
+        else:
+            column_size = column_size or max_size
+            if sql_type == SQL_WVARCHAR:
+                column_size *= 2
+            width += column_size
+        # length/indicator buffer
+        width += 8
+    return width
+
+
+def max_size_for(sql_type):
+    if sql_type == SQL_WVARCHAR:
+        return MAX_NVARCHAR_SIZE
+    if sql_type == SQL_VARCHAR:
+        return MAX_VARCHAR_SIZE
+    return MAX_VARBINARY_SIZE
+
+
+# (alias, model, field name) -> whether the column is varchar
+_varchar_fields = {}
+
+
+def is_varchar_field(field, connection):
+    model = getattr(field, 'model', None)
+    key = (connection.alias, model, field.name) if model is not None else None
+    if key is not None:
+        try:
+            return _varchar_fields[key]
+        except KeyError:
+            pass
+    try:
+        size = db_type_input_size(field.db_type(connection))
+    except Exception:
+        size = None
+    is_varchar = size is not None and size[0] == SQL_VARCHAR
+    if key is not None:
+        _varchar_fields[key] = is_varchar
+    return is_varchar
+
+
+def mark_varchar_params(params):
+    return [VarcharParam(p) if type(p) is text_type else p for p in params]
+
+
+def string_input_size(value, sql_type=SQL_WVARCHAR):
+    length = len(value)
+    for size in STRING_SIZE_BUCKETS:
+        if length <= size:
+            return (sql_type, size, 0)
+    return (sql_type, 0, 0)
+
+
+def string_input_sizes(params):
+    """
+    Return the input sizes binding the string parameters in `params` with
+    bucketed lengths, as varchar for VarcharParam and nvarchar otherwise,
+    or None if there are no string parameters.
+    """
+    sizes = None
+    for i, p in enumerate(params):
+        if isinstance(p, text_type):
+            if sizes is None:
+                sizes = [None] * len(params)
+            sql_type = SQL_VARCHAR if type(p) is VarcharParam else SQL_WVARCHAR
+            sizes[i] = string_input_size(p, sql_type)
+    return sizes
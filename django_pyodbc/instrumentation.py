@@ -0,0 +1,475 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timing of the statements run through CursorWrapper.
+
+Each statement gives a QueryEvent: the time spent getting it ready
+(placeholders, parameters, binding), in the driver's execute and in
+fetching, the rows fetched, an estimate of their size in bytes and the
+number of result sets. An event is complete once the rows of its result
+set have all been fetched, or else when the cursor runs its next statement
+or is closed; it is then passed to the hooks and added to the QueryStats
+of its fingerprint (see django_pyodbc.fingerprint), which include a latency
+histogram. Rows a statement returns in a later result set, read after the
+first is exhausted, aren't counted.
+
+Stats are kept per database alias and shared by its threads without a
+lock, so under contention a count may miss the odd update. At most
+`size` fingerprints are kept; statements beyond that are counted under
+OVERFLOW.
+
+With a `sample_rate` below 1 only that fraction of statements, picked at
+random, is timed and recorded; the others cost a single random() call.
+"""
+import glob
+import json
+import os
+import random
+import time
+import warnings
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from django_pyodbc import budget, metrics, plans
+from django_pyodbc.compat import string_types, text_type
+from django_pyodbc.fingerprint import normalize
+
+DEFAULT_SIZE = 1000
+DEFAULT_DUMP_INTERVAL = 60
+OVERFLOW = '<other>'
+
+clock = time.perf_counter
+
+# Assumed size of (max) and other columns that don't report one
+MAX_COLUMN_BYTES = 8000
+
+
+class QueryEvent(object):
+    """
+    What one statement cost. Times are in seconds; `many` is the number of
+    parameter sets of an executemany(), 0 for execute().
+    """
+    sql = fingerprint = None
+    params = ()
+    many = 0
+    prepare_time = execute_time = fetch_time = 0.0
+    rows = bytes = result_sets = 0
+    round_trips = 1
+    error = False
+    # whether it has been passed to the instrumentation and budget
+    recorded = False
+    # False if it is only timed for the budget or plan capture, not sampled
+    # for the instrumentation
+    sampled = True
+    # the QueryBudget it counts towards and where it was run from
+    budget = call_site = None
+    # the plans SQL Server sent, if it ran under SET STATISTICS XML ON
+    plans = None
+    alias = None
+    started = 0.0
+
+    @property
+    def total_time(self):
+        return self.prepare_time + self.execute_time + self.fetch_time
+
+    def __repr__(self):
+        return '<QueryEvent %.3f ms: %s>' % (self.total_time * 1e3, self.sql)
+
+
+_stat_fields = ('count', 'errors', 'prepare_time', 'execute_time', 'fetch_time',
+                'max_time', 'rows', 'bytes', 'result_sets', 'round_trips')
+
+
+class QueryStats(object):
+    """Totals over the statements of one fingerprint."""
+    __slots__ = _stat_fields + ('histogram',)
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.count = self.errors = self.rows = self.bytes = 0
+        self.result_sets = self.round_trips = 0
+        self.prepare_time = self.execute_time = self.fetch_time = self.max_time = 0.0
+
+    def add(self, event):
+        prepare_time = event.prepare_time
+        execute_time = event.execute_time
+        fetch_time = event.fetch_time
+        total = prepare_time + execute_time + fetch_time
+        self.count += 1
+        if event.error:
+            self.errors += 1
+        self.prepare_time += prepare_time
+        self.execute_time += execute_time
+        self.fetch_time += fetch_time
+        if total > self.max_time:
+            self.max_time = total
+        rows = event.rows
+        if rows:
+            self.rows += rows
+            self.bytes += event.bytes
+        self.result_sets += event.result_sets
+        self.round_trips += event.round_trips
+        if self.histogram is not None:
+            self.histogram.record(total)
+
+    def merge(self, other):
+        for name in _stat_fields:
+            if name == 'max_time':
+                self.max_time = max(self.max_time, other['max_time'])
+            else:
+                setattr(self, name, getattr(self, name) + other[name])
+        if other.get('histogram'):
+            if self.histogram is None:
+                self.histogram = metrics.Histogram(other['histogram']['precision'])
+            self.histogram.merge(other['histogram'])
+
+    @property
+    def total_time(self):
+        return self.prepare_time + self.execute_time + self.fetch_time
+
+    def as_dict(self):
+        stats = dict((name, getattr(self, name)) for name in _stat_fields)
+        stats['total_time'] = self.total_time
+        if self.histogram is not None:
+            stats['histogram'] = self.histogram.as_dict()
+            for quantile in metrics.QUANTILES:
+                stats['p%g' % (quantile * 100)] = self.histogram.percentile(quantile)
+        return stats
+
+
+def row_width(description):
+    """Estimate the size in bytes of a row from a cursor description."""
+    width = 0
+    for column in description or ():
+        size = column[3]
+        if not size or size > MAX_COLUMN_BYTES:
+            size = MAX_COLUMN_BYTES
+        if column[1] is text_type:
+            size *= 2
+        width += size
+    return width
+
+
+class Recorder(object):
+    """
+    Builds the QueryEvents of one CursorWrapper, for `instrumentation`, for
+    the active QueryBudget if `budgets` is true and for `plan_capture`, a
+    django_pyodbc.plans.PlanCapture.
+    """
+    __slots__ = ('instrumentation', 'budgets', 'plan_capture', 'alias', 'event', '_cursor',
+                 '_description', '_row_width', '_sample_rate', '_always')
+
+    def __init__(self, alias, instrumentation, budgets=False, plan_capture=None):
+        self.instrumentation = instrumentation
+        self.budgets = budgets
+        self.plan_capture = plan_capture
+        self.alias = alias
+        self.event = None
+        self._sample_rate = 1
+        if instrumentation is not None:
+            self._sample_rate = instrumentation.sample_rate
+        # whether statements left out of the sample still need an event
+        self._always = budgets or plan_capture is not None
+        self._cursor = None
+        self._description = None
+        self._row_width = 0
+
+    def start(self):
+        """
+        Start the event of a statement. Returns False if it is left out of
+        the sample and nothing needs it.
+        """
+        if self.event is not None:
+            self.finish()
+        sampled = self._sample_rate >= 1 or random.random() < self._sample_rate
+        if not sampled and not self._always:
+            return False
+        # QueryEvent has no __init__: creating it is cheaper that way
+        event = self.event = QueryEvent()
+        if not sampled:
+            event.sampled = False
+        event.alias = self.alias
+        event.started = clock()
+        if self.budgets:
+            event.budget = budget.current()
+            if event.budget is not None:
+                event.budget.started(event)
+        return True
+
+    def _result_set(self, description):
+        if description is not None:
+            self.event.result_sets += 1
+            if description is not self._description:
+                self._description = description
+                self._row_width = row_width(description)
+
+    def execute(self, cursor, sql, params):
+        event = self.event
+        event.sql = sql
+        event.params = params
+        self._cursor = cursor
+        if self.plan_capture is not None and self.plan_capture.sample(sql):
+            event.plans = []
+            sql = plans.SAMPLED % sql
+        began = clock()
+        event.prepare_time = began - event.started
+        try:
+            result = cursor.execute(sql, params)
+            if event.plans is not None:
+                plans.take_plans(cursor, event.plans)
+        except Exception:
+            event.error = True
+            if event.plans is not None:
+                self.plan_capture.statistics_off(cursor)
+            raise
+        finally:
+            event.execute_time = clock() - began
+        # _result_set(), inlined
+        description = cursor.description
+        if description is not None:
+            event.result_sets = 1
+            if description is not self._description:
+                self._description = description
+                self._row_width = row_width(description)
+        return result
+
+    def execute_many(self, run, sql, params_list, batched, *args):
+        """
+        Time run(sql, params_list, *args), an executemany(); `batched` is
+        true if the parameters are sent as arrays rather than row by row.
+        """
+        event = self.event
+        event.sql = sql
+        event.many = len(params_list)
+        event.round_trips = 1 if batched else max(event.many, 1)
+        began = clock()
+        event.prepare_time = began - event.started
+        try:
+            return run(sql, params_list, *args)
+        except Exception:
+            event.error = True
+            raise
+        finally:
+            event.execute_time = clock() - began
+
+    def fetched(self, began, rows, exhausted=False):
+        """
+        Count `rows` fetched since `began`. If the result set is `exhausted`
+        the event is recorded now: the cursor may never be closed.
+        """
+        event = self.event
+        if event is not None:
+            event.fetch_time += clock() - began
+            event.rows += rows
+            event.bytes += rows * self._row_width
+            if exhausted and not event.recorded:
+                self._record(event)
+                if self.plan_capture is None:
+                    # nothing left to do with it when the next one starts
+                    self.event = None
+
+    def next_result_set(self, cursor):
+        """
+        Count the result set `cursor` moved to. Return False if it was the
+        last, leaving out the plans of a sampled statement.
+        """
+        event = self.event
+        if event is None:
+            return True
+        if event.plans is not None and not plans.take_plans(cursor, event.plans):
+            return False
+        self._result_set(cursor.description)
+        return True
+
+    def finish(self):
+        event, self.event = self.event, None
+        if event is not None and event.sql is not None:
+            if self.plan_capture is not None and not event.many:
+                self.plan_capture.finish(event, self._cursor)
+            if not event.recorded:
+                self._record(event)
+
+    def _record(self, event):
+        event.recorded = True
+        if self.instrumentation is not None and event.sampled:
+            self.instrumentation.record(event)
+        if event.budget is not None:
+            event.budget.record(event)
+
+
+class Instrumentation(object):
+    """
+    The hooks and per fingerprint QueryStats of one database alias.
+    """
+    def __init__(self, alias, options):
+        self.alias = alias
+        self.maxsize = options.get('size', DEFAULT_SIZE)
+        self.hooks = [import_string(hook) if isinstance(hook, string_types) else hook
+                      for hook in options.get('hooks', ())]
+        self.histogram_precision = options.get('histogram_precision', None)
+        self.sample_rate = options.get('sample_rate', 1)
+        self.stats_file = options.get('stats_file')
+        self.prometheus = options.get('prometheus')
+        self.dump_interval = options.get('dump_interval', DEFAULT_DUMP_INTERVAL)
+        self._dumps = self.stats_file is not None or self.prometheus is not None
+        self.stats = {}
+        # statement -> (fingerprint, QueryStats), so that a statement seen
+        # before costs one lookup
+        self._statements = {}
+        self._last_dump = clock()
+
+    def _stats_for(self, sql):
+        fingerprint = key = normalize(sql)
+        stats = self.stats.get(fingerprint)
+        if stats is None:
+            if len(self.stats) >= self.maxsize:
+                key = OVERFLOW
+            histogram = None
+            if self.histogram_precision is not None:
+                histogram = metrics.Histogram(self.histogram_precision)
+            stats = self.stats.setdefault(key, QueryStats(histogram))
+        if len(self._statements) >= 4 * self.maxsize:
+            self._statements = {}
+        self._statements[sql] = fingerprint, stats
+        return fingerprint, stats
+
+    def record(self, event):
+        try:
+            event.fingerprint, stats = self._statements[event.sql]
+        except KeyError:
+            event.fingerprint, stats = self._stats_for(event.sql)
+        stats.add(event)
+        if self.hooks:
+            for hook in self.hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    warnings.warn("Instrumentation hook %r failed: %s" % (hook, e))
+        if self._dumps and event.started - self._last_dump >= self.dump_interval:
+            self._last_dump = event.started
+            if self.stats_file is not None:
+                self.dump()
+            if self.prometheus is not None:
+                self.export_prometheus()
+
+    def snapshot(self):
+        return dict((fingerprint, stats.as_dict())
+                    for fingerprint, stats in list(self.stats.items()))
+
+    def prometheus_text(self):
+        return metrics.prometheus_text(
+            dict((fingerprint, stats.histogram)
+                 for fingerprint, stats in list(self.stats.items())
+                 if stats.histogram is not None), self.alias)
+
+    def export_prometheus(self, target=None):
+        """
+        Export the latency histograms in the Prometheus text format to
+        `target`, by default the prometheus option: a path or a callable.
+        """
+        metrics.export(self.prometheus_text(), target or self.prometheus)
+
+    def reset(self):
+        self.stats = {}
+        self._statements = {}
+
+    def dump(self, path=None):
+        """
+        Write the stats as JSON to `path`, by default the stats_file option
+        with {pid} replaced by the process id.
+        """
+        path = (path or self.stats_file).format(pid=os.getpid())
+        data = {'alias': self.alias, 'pid': os.getpid(), 'time': time.time(),
+                'stats': self.snapshot()}
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+
+# database alias -> Instrumentation
+_instruments = {}
+
+
+def get_instrumentation(connection):
+    """
+    Return the Instrumentation of `connection`'s alias, or None if the
+    instrumentation option is off.
+    """
+    options = connection.instrumentation
+    if options is None:
+        return None
+    try:
+        return _instruments[connection.alias]
+    except KeyError:
+        return _instruments.setdefault(connection.alias,
+                                       Instrumentation(connection.alias, options))
+
+
+def add_hook(hook, using='default'):
+    """
+    Call `hook` with the QueryEvent of every statement run on database
+    `using`, which must have the instrumentation option on.
+    """
+    get_instrumentation(connections[using]).hooks.append(hook)
+
+
+def query_stats(using='default', files=None):
+    """
+    Return {fingerprint: stats dict} for database `using`: the stats of this
+    process, merged with those dumped to `files` (a glob pattern, or by
+    default the stats_file option with {pid} as *) by other processes.
+    """
+    instrumentation = get_instrumentation(connections[using])
+    merged = {}
+    own = None
+    if instrumentation is not None:
+        own = instrumentation.snapshot()
+        if files is None and instrumentation.stats_file is not None:
+            files = instrumentation.stats_file.replace('{pid}', '*')
+    for path in sorted(glob.glob(files)) if files else ():
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            continue
+        if data.get('alias') != using or data.get('pid') == os.getpid():
+            continue
+        _merge(merged, data['stats'])
+    if own:
+        _merge(merged, own)
+    return dict((fingerprint, stats.as_dict()) for fingerprint, stats in merged.items())
+
+
+def _merge(merged, stats):
+    for fingerprint, values in stats.items():
+        merged.setdefault(fingerprint, QueryStats()).merge(values)
+
+
+def export_prometheus(target, using='default'):
+    """
+    Export the latency histograms of database `using` in this process to
+    `target`, a path or a callable taking the text.
+    """
+    instrumentation = get_instrumentation(connections[using])
+    if instrumentation is not None:
+        instrumentation.export_prometheus(target)
+
+
+def reset_stats(using='default'):
+    instrumentation = get_instrumentation(connections[using])
+    if instrumentation is not None:
+        instrumentation.reset()
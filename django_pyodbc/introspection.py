@@ -55,6 +55,9 @@ import pyodbc as Database
 SQL_AUTOFIELD = -777555
 
 class DatabaseIntrospection(BaseDatabaseIntrospection):
+    # (database name, table name) -> whether the table has triggers
+    _table_triggers = {}
+
     # Map type codes to Django Field types.
     data_types_reverse = {
         SQL_AUTOFIELD:                  'IntegerField',
@@ -96,6 +99,24 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
 
         return [row_to_table_info(row) for row in cursor.fetchall()]
 
+    def has_triggers(self, cursor, table_name, refresh=False):
+        """
+        Returns whether the table has any DML triggers. Looked up once per
+        table and process, or again with `refresh`.
+        """
+        key = (self.connection.settings_dict['NAME'], table_name)
+        if not refresh:
+            try:
+                return self._table_triggers[key]
+            except KeyError:
+                pass
+        # sys.triggers: http://msdn.microsoft.com/en-us/library/ms188746.aspx
+        cursor.execute("SELECT COUNT(*) FROM sys.triggers WHERE parent_id = OBJECT_ID(%s)",
+                       (self.connection.ops.quote_name(table_name),))
+        has_triggers = bool(cursor.fetchall()[0][0])
+        self._table_triggers[key] = has_triggers
+        return has_triggers
+
     def _is_auto_field(self, cursor, table_name, column_name):
         """
         Checks whether column is Identity
@@ -0,0 +1,65 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ss_querystats management command: the statements that cost the most, from
+the stats the instrumentation option keeps.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from django_pyodbc import instrumentation
+
+SORT_KEYS = ('total_time', 'count', 'p50', 'p95', 'p99', 'max_time', 'execute_time',
+             'fetch_time', 'rows', 'bytes', 'errors')
+
+
+class Command(BaseCommand):
+    help = ('Shows the statements that took the most time, merging the stats '
+            'files written by the processes using the database (MS SQL Server-specific).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to show the stats of. Defaults to "default".')
+        parser.add_argument('--files',
+                            help='Glob pattern of the stats files to read. Defaults to the '
+                                 'stats_file option with {pid} as *.')
+        parser.add_argument('--sort', default='total_time', choices=SORT_KEYS,
+                            help='What to rank statements by. Defaults to total_time.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Number of statements to show. Defaults to 20.')
+        parser.add_argument('--width', type=int, default=120,
+                            help='Characters of SQL to show per statement.')
+
+    def handle(self, **options):
+        using = options['database']
+        if connections[using].vendor != 'microsoft':
+            raise CommandError("Database %r doesn't use django_pyodbc." % using)
+        stats = instrumentation.query_stats(using, options['files'])
+        if not stats:
+            self.stdout.write("No statements recorded. Is the instrumentation option "
+                              "on, with a stats_file the running processes write to?")
+            return
+        sort = options['sort']
+        ranked = sorted(stats.items(), key=lambda item: item[1].get(sort, 0), reverse=True)
+        self.stdout.write('%10s %10s %9s %9s %9s %9s %10s %12s  %s' % (
+            'total ms', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'rows', 'bytes',
+            'statement'))
+        for fingerprint, s in ranked[:options['limit']]:
+            sql = ' '.join(fingerprint.split())
+            if len(sql) > options['width']:
+                sql = sql[:options['width'] - 3] + '...'
+            self.stdout.write('%10.1f %10d %9.2f %9.2f %9.2f %9.2f %10d %12d  %s' % (
+                s['total_time'] * 1e3, s['count'], s.get('p50', 0) * 1e3, s.get('p95', 0) * 1e3,
+                s.get('p99', 0) * 1e3, s['max_time'] * 1e3, s['rows'], s['bytes'], sql))
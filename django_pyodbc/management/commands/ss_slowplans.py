@@ -0,0 +1,127 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ss_slowplans management command: what dominates the execution plans the
+slow_plans option captured.
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from django_pyodbc import plans
+from django_pyodbc.fingerprint import fingerprint_id
+
+
+class Command(BaseCommand):
+    help = ('Summarises the execution plans captured for slow statements: the statements, '
+            'the operators that take most of their cost, scans, key lookups, spills and '
+            'implicit conversions (MS SQL Server-specific).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to show the plans of. Defaults to "default".')
+        parser.add_argument('--directory',
+                            help='Directory of the captures. Defaults to that of the '
+                                 'slow_plans option.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Number of lines to show per section. Defaults to 20.')
+        parser.add_argument('--width', type=int, default=100,
+                            help='Characters of SQL to show per statement.')
+        parser.add_argument('--export',
+                            help='Directory to write the newest plan of each statement to, as '
+                                 '.sqlplan files SQL Server Management Studio opens.')
+
+    def handle(self, **options):
+        using = options['database']
+        if connections[using].vendor != 'microsoft':
+            raise CommandError("Database %r doesn't use django_pyodbc." % using)
+        captures = plans.captures(using, options['directory'])
+        if not captures:
+            self.stdout.write("No plans captured. Is the slow_plans option on?")
+            return
+        limit = options['limit']
+
+        # fingerprint -> [captures, max time, scans, lookups, spills, conversions]
+        statements = {}
+        # (operator, object) -> [plans, total share]
+        operators = {}
+        spills = {}
+        conversions = {}
+        newest = {}
+        for capture in captures:
+            fingerprint = capture['fingerprint']
+            newest.setdefault(fingerprint, capture)
+            statement = statements.setdefault(fingerprint, [0, 0.0, 0, 0, 0, 0])
+            statement[0] += 1
+            statement[1] = max(statement[1], capture['total_time'])
+            for plan in capture['plans']:
+                try:
+                    found = plans.analyze(plan)
+                except Exception:
+                    continue
+                statement[2] += len(found['scans'])
+                statement[3] += len(found['key_lookups'])
+                statement[4] += len(found['spills'])
+                statement[5] += len(found['implicit_conversions'])
+                for details in found['operators']:
+                    operator = operators.setdefault((details['op'], details['object']), [0, 0.0])
+                    operator[0] += 1
+                    operator[1] += details['share']
+                for spill in found['spills']:
+                    spills[spill] = spills.get(spill, 0) + 1
+                for expression in found['implicit_conversions']:
+                    conversions[expression] = conversions.get(expression, 0) + 1
+
+        self.stdout.write('%d captures of %d statements.\n\n' % (len(captures), len(statements)))
+        self.stdout.write('%8s %10s %6s %8s %7s %9s  %s' % (
+            'captures', 'max ms', 'scans', 'lookups', 'spills', 'converts', 'statement'))
+        ranked = sorted(statements.items(), key=lambda item: -item[1][1])
+        for fingerprint, s in ranked[:limit]:
+            self.stdout.write('%8d %10.1f %6d %8d %7d %9d  %s' % (
+                s[0], s[1] * 1e3, s[2], s[3], s[4], s[5], self._shorten(fingerprint, options)))
+
+        self.stdout.write('\nOperators taking the most estimated cost:')
+        self.stdout.write('%8s %6s  %-24s %s' % ('cost %', 'plans', 'operator', 'object'))
+        ranked = sorted(operators.items(), key=lambda item: (-item[1][1], -item[1][0]))
+        for (op, name), (count, share) in ranked[:limit]:
+            self.stdout.write('%8.1f %6d  %-24s %s' % (share / count * 100, count, op, name))
+
+        if spills:
+            self.stdout.write('\nOperators spilling to tempdb:')
+            for spill, count in sorted(spills.items(), key=lambda item: -item[1])[:limit]:
+                self.stdout.write('%6d  %s' % (count, spill))
+
+        if conversions:
+            self.stdout.write('\nImplicit conversions affecting plans:')
+            for expression, count in sorted(conversions.items(), key=lambda item: -item[1])[:limit]:
+                self.stdout.write('%6d  %s' % (count, expression))
+
+        if options['export']:
+            if not os.path.isdir(options['export']):
+                os.makedirs(options['export'])
+            for fingerprint, capture in newest.items():
+                for i, plan in enumerate(capture['plans']):
+                    path = os.path.join(options['export'], '%s-%d.sqlplan' % (
+                        fingerprint_id(fingerprint), i))
+                    with open(path, 'w') as f:
+                        f.write(plan)
+            self.stdout.write('\nPlans written to %s' % options['export'])
+
+    def _shorten(self, fingerprint, options):
+        sql = ' '.join(fingerprint.split())
+        if len(sql) > options['width']:
+            sql = sql[:options['width'] - 3] + '...'
+        return sql
@@ -0,0 +1,152 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency histograms per statement fingerprint, and their export in the
+Prometheus text format.
+
+Histograms have the log-linear layout of HdrHistogram: durations are
+counted in microseconds, exactly below 2 ** precision and in buckets
+no wider than 1 / 2 ** (precision - 1) of their value above that, so
+percentiles keep the same relative precision from microseconds to hours
+in a few hundred counters at most.
+"""
+import os
+
+from django_pyodbc.fingerprint import fingerprint_id
+
+DEFAULT_PRECISION = 5
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    """
+    Log-linear histogram of durations. Like the stats it belongs to, it is
+    updated without a lock.
+    """
+    __slots__ = ('precision', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        # bucket index -> count
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value):
+        bits = value.bit_length()
+        if bits <= self.precision:
+            return value
+        shift = bits - self.precision
+        return (shift << (self.precision - 1)) + (value >> shift)
+
+    def _upper_bound(self, index):
+        """The highest duration, in seconds, counted in bucket `index`."""
+        if index < 1 << self.precision:
+            return index * 1e-6
+        shift = (index >> (self.precision - 1)) - 1
+        sub_bucket = index - (shift << (self.precision - 1))
+        return (((sub_bucket + 1) << shift) - 1) * 1e-6
+
+    def record(self, seconds):
+        # _index(), inlined
+        index = int(seconds * 1e6)
+        shift = index.bit_length() - self.precision
+        if shift > 0:
+            index = (shift << (self.precision - 1)) + (index >> shift)
+        try:
+            self.counts[index] += 1
+        except KeyError:
+            self.counts[index] = 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the counts of `other`, a Histogram or its as_dict()."""
+        if isinstance(other, Histogram):
+            other = other.as_dict()
+        for index, count in other['counts'].items():
+            index = int(index)
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other['count']
+        self.sum += other['sum']
+        self.max = max(self.max, other['max'])
+
+    def percentile(self, quantile):
+        """
+        Return the duration in seconds below which `quantile` (0 to 1) of
+        the recorded durations fall, to the precision of the histogram.
+        """
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'precision': self.precision, 'counts': dict(self.counts),
+                'count': self.count, 'sum': self.sum, 'max': self.max}
+
+
+def _label(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def prometheus_text(histograms, database='default', statement_length=200):
+    """
+    Return the Prometheus text exposition of `histograms`, a dict
+    {fingerprint: Histogram}: a summary of the statement durations per
+    fingerprint with the QUANTILES, and an info metric giving the statement
+    each fingerprint id stands for.
+    """
+    duration = ['# HELP django_pyodbc_query_duration_seconds Duration of the statements '
+                'of a fingerprint.',
+                '# TYPE django_pyodbc_query_duration_seconds summary']
+    info = ['# HELP django_pyodbc_query_info Statement of a fingerprint.',
+            '# TYPE django_pyodbc_query_info gauge']
+    for fingerprint, histogram in sorted(histograms.items()):
+        labels = 'database=%s,fingerprint=%s' % (_label(database),
+                                                _label(fingerprint_id(fingerprint)))
+        for quantile in QUANTILES:
+            duration.append('django_pyodbc_query_duration_seconds{%s,quantile="%s"} %.6f' % (
+                labels, quantile, histogram.percentile(quantile)))
+        duration.append('django_pyodbc_query_duration_seconds_sum{%s} %.6f' % (labels, histogram.sum))
+        duration.append('django_pyodbc_query_duration_seconds_count{%s} %d' % (labels, histogram.count))
+        info.append('django_pyodbc_query_info{%s,statement=%s} 1' % (
+            labels, _label(fingerprint[:statement_length])))
+    return '\n'.join(duration + info) + '\n'
+
+
+def export(text, target):
+    """
+    Send Prometheus `text` to `target`: a callable to call with it, or a
+    path to write it to (atomically, for the node exporter's textfile
+    collector, say) with {pid} replaced by the process id.
+    """
+    if callable(target):
+        target(text)
+        return
+    path = target.format(pid=os.getpid())
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
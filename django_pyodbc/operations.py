@@ -121,20 +121,16 @@ class DatabaseOperations(BaseDatabaseOperations):
                 self._right_sql_quote = ']'
         return self._right_sql_quote
 
-    def _get_sql_server_ver(self):
+    # Both server properties in a single round trip
+    server_info_sql = "SELECT CAST(SERVERPROPERTY('ProductVersion') as varchar), " \
+                      "CAST(SERVERPROPERTY('EngineEdition') as integer)"
+
+    def set_server_info(self, product_version, engine_edition):
         """
-        Returns the version of the SQL Server in use:
+        Record the server version and engine edition, as returned by
+        `server_info_sql`.
         """
-        if self._ss_ver is not None:
-            return self._ss_ver
-        cur = self.connection.cursor()
-        ver_code = None
-        if not self.is_db2 and not self.is_openedge:
-            cur.execute("SELECT CAST(SERVERPROPERTY('ProductVersion') as varchar)")
-            ver_code = cur.fetchone()[0]
-            ver_code = int(ver_code.split('.')[0])
-        else:
-            ver_code = 0
+        ver_code = int(product_version.split('.')[0])
         if ver_code >= 11:
             self._ss_ver = 2012
         elif ver_code == 10:
@@ -143,15 +139,29 @@ class DatabaseOperations(BaseDatabaseOperations):
             self._ss_ver = 2005
         else:
             self._ss_ver = 2000
+        self._ss_edition = engine_edition
+
+    def _probe_server(self):
+        cur = self.connection.cursor()
+        cur.execute(self.server_info_sql)
+        self.set_server_info(*cur.fetchone())
+
+    def _get_sql_server_ver(self):
+        """
+        Returns the version of the SQL Server in use:
+        """
+        if self._ss_ver is not None:
+            return self._ss_ver
+        if not self.is_db2 and not self.is_openedge:
+            self._probe_server()
+        else:
+            self._ss_ver = 2000
         return self._ss_ver
     sql_server_ver = property(_get_sql_server_ver)
 
     def _on_azure_sql_db(self):
-        if self._ss_edition is not None:
-            return self._ss_edition == EDITION_AZURE_SQL_DB
-        cur = self.connection.cursor()
-        cur.execute("SELECT CAST(SERVERPROPERTY('EngineEdition') as integer)")
-        self._ss_edition = cur.fetchone()[0]
+        if self._ss_edition is None:
+            self._probe_server()
         return self._ss_edition == EDITION_AZURE_SQL_DB
     on_azure_sql_db = property(_on_azure_sql_db)
 
@@ -275,6 +285,29 @@ class DatabaseOperations(BaseDatabaseOperations):
         """
         return cursor.fetchone()[0]
 
+    # SQL Server limits on a single INSERT ... VALUES statement
+    max_insert_values_rows = 1000
+    max_query_params = 2100
+
+    def max_insert_rows(self, fields):
+        """
+        Return how many rows of `fields` fit in one multi-row INSERT.
+        """
+        if self.is_openedge:
+            return 1
+        # Keep clear of the parameter limit; sp_prepexec takes one for itself
+        params_per_row = max(len(fields), 1)
+        return max(1, min(self.max_insert_values_rows,
+                          (self.max_query_params - 1) // params_per_row))
+
+    def bulk_batch_size(self, fields, objs):
+        # Also sizes the pk__in lists of deletes and bulk_update(), so this
+        # has to respect the parameter limit even with fast_executemany.
+        return self.max_insert_rows(fields)
+
+    def bulk_insert_sql(self, fields, placeholder_rows):
+        return "VALUES " + ", ".join("(%s)" % ", ".join(row) for row in placeholder_rows)
+
     def lookup_cast(self, lookup_type, internal_type=None):
         if lookup_type in ('iexact', 'icontains', 'istartswith', 'iendswith'):
             return "UPPER(%s)"
@@ -0,0 +1,221 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keyset ("seek") pagination: pages are found by comparing the ordering
+columns with the values of the last row of the previous page rather than
+by skipping rows, so the server can start reading at the right place in an
+index however deep the page is.
+
+T-SQL has no row value comparison, so ``(a, b) > (x, y)`` is expanded to
+``a >= x AND (a > x OR (a = x AND b > y))``. NULLs sort first in ascending
+and last in descending order on SQL Server, and the comparisons follow that.
+"""
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db.models import Q, QuerySet
+from django.db.models.constants import LOOKUP_SEP
+
+from django_pyodbc.compat import string_types
+
+
+def _resolve_field(model, path):
+    field = None
+    for name in path.split(LOOKUP_SEP):
+        meta = model._meta
+        field = meta.pk if name == 'pk' else meta.get_field(name)
+        if field.is_relation and field.related_model is not None:
+            model = field.related_model
+    return field
+
+
+def _ordering(queryset, order_by):
+    """
+    Return the ordering of `queryset` as a list of (path, descending,
+    nullable) with the primary key appended if it isn't already there.
+    """
+    model = queryset.model
+    meta = model._meta
+    if order_by is None:
+        order_by = queryset.query.order_by or meta.ordering
+    ordering = []
+    for name in order_by:
+        if not isinstance(name, string_types):
+            raise ValueError("Keyset pagination needs field names to order by, not %r." % (name,))
+        descending = name.startswith('-')
+        path = name.lstrip('-+')
+        if path == '?':
+            raise ValueError("Keyset pagination can't use random ordering.")
+        field = _resolve_field(model, path)
+        if field.is_relation:
+            # Compare the foreign key column, not the related model's ordering
+            if field.many_to_many or field.one_to_many:
+                raise ValueError("Can't keyset paginate on the multi-valued relation %r." % path)
+            path = path[:-len(field.name)] + field.attname
+        elif path == 'pk':
+            path = field.attname
+        ordering.append((path, descending, field.null))
+    if not any(path == meta.pk.attname for path, _, _ in ordering):
+        ordering.append((meta.pk.attname, False, False))
+    return ordering
+
+
+def _key_values(ordering, after):
+    if isinstance(after, dict):
+        return [after[path] for path, _, _ in ordering]
+    if hasattr(after, '_meta'):
+        values = []
+        for path, _, _ in ordering:
+            value = after
+            for name in path.split(LOOKUP_SEP):
+                value = None if value is None else getattr(value, name)
+            values.append(value)
+        return values
+    values = list(after)
+    if len(values) != len(ordering):
+        raise ValueError("Expected %d key values for %s, got %d." % (
+            len(ordering), ', '.join(path for path, _, _ in ordering), len(values)))
+    return values
+
+
+def _after(path, descending, nullable, value):
+    """Return a Q matching rows that sort after `value` in this column."""
+    if value is None:
+        # NULLs come first ascending and last descending
+        return None if descending else ~Q(**{path + '__isnull': True})
+    q = Q(**{path + ('__lt' if descending else '__gt'): value})
+    if descending and nullable:
+        q |= Q(**{path + '__isnull': True})
+    return q
+
+
+def _equal(path, value):
+    if value is None:
+        return Q(**{path + '__isnull': True})
+    return Q(**{path: value})
+
+
+def seek_filter(ordering, values):
+    """
+    Return the Q object matching the rows that come after `values` in
+    `ordering`, as returned by _ordering().
+    """
+    condition = None
+    equal = Q()
+    for (path, descending, nullable), value in zip(ordering, values):
+        after = _after(path, descending, nullable, value)
+        if after is not None:
+            term = equal & after
+            condition = term if condition is None else condition | term
+        equal &= _equal(path, value)
+    if condition is None:
+        return None
+    # Redundant, but gives the server a range to seek on the first column
+    path, descending, nullable = ordering[0]
+    if values[0] is not None and not (descending and nullable):
+        condition &= Q(**{path + ('__lte' if descending else '__gte'): values[0]})
+    return condition
+
+
+def _filter_after(queryset, ordering, after):
+    if after is None:
+        return queryset
+    condition = seek_filter(ordering, _key_values(ordering, after))
+    return queryset.none() if condition is None else queryset.filter(condition)
+
+
+def seek(queryset, after=None, order_by=None):
+    """
+    Order `queryset` by `order_by` (field names as for order_by(),
+    defaulting to the queryset's own ordering) and the primary key, and
+    keep only the rows that come after `after`.
+
+    `after` is the last object of the previous page, a dict of its values
+    keyed by field name or a sequence of them in ordering order, the primary
+    key last; None returns the first page.
+    """
+    ordering = _ordering(queryset, order_by)
+    queryset = queryset.order_by(*[('-' if descending else '') + path
+                                   for path, descending, _ in ordering])
+    return _filter_after(queryset, ordering, after)
+
+
+class SeekQuerySet(QuerySet):
+    """
+    QuerySet with seek(); use SeekQuerySet.as_manager() as a model's
+    manager.
+    """
+    def seek(self, after=None, order_by=None):
+        return seek(self, after, order_by)
+
+
+class KeysetPage(Page):
+    """
+    A page read by seek_page(). It has no number, so the methods of Page
+    that need one raise InvalidPage; use has_next() and next_key().
+    """
+    def __init__(self, object_list, paginator, after, has_next):
+        super(KeysetPage, self).__init__(object_list, None, paginator)
+        self.after = after
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page after %r>' % (self.after,)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.after is not None
+
+    def next_key(self):
+        """
+        The values to pass to seek_page() for the next page, or None on the
+        last page.
+        """
+        if not self._has_next:
+            return None
+        return tuple(_key_values(self.paginator.ordering, self.object_list[-1]))
+
+    def _no_number(self, name):
+        raise InvalidPage("Pages read by seek_page() have no number, so %s() can't be "
+                          "used; pass next_key() to seek_page() for the next page." % name)
+
+    def next_page_number(self):
+        self._no_number('next_page_number')
+
+    def previous_page_number(self):
+        self._no_number('previous_page_number')
+
+    def start_index(self):
+        self._no_number('start_index')
+
+    def end_index(self):
+        self._no_number('end_index')
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator whose seek_page() reads a page of objects after a key, at the
+    same cost for any page. page() still works by number, using OFFSET.
+    """
+    def __init__(self, object_list, per_page, order_by=None, **kwargs):
+        self.ordering = _ordering(object_list, order_by)
+        super(KeysetPaginator, self).__init__(seek(object_list, None, order_by), per_page, **kwargs)
+
+    def seek_page(self, after=None):
+        queryset = _filter_after(self.object_list, self.ordering, after)
+        # One extra row tells whether there is a next page
+        objects = list(queryset[:self.per_page + 1])
+        has_next = len(objects) > self.per_page
+        return KeysetPage(objects[:self.per_page], self, after, has_next)
@@ -0,0 +1,338 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Actual execution plans of slow statements.
+
+With the slow_plans option on, the plan of a statement run through
+CursorWrapper.execute() that takes `threshold` seconds or more is captured
+in one of two ways:
+
+- sampled: a `sample_rate` fraction of the statements run under SET
+  STATISTICS XML ON. SQL Server sends their plan as an extra result set,
+  which is taken out of the cursor's results and read when the cursor runs
+  its next statement or is closed.
+- rerun: a slow SELECT that wasn't sampled is run again under SET
+  STATISTICS XML ON and its rows are discarded. Other statements are never
+  run twice.
+
+Either way the statement is sent in a batch that turns STATISTICS XML on
+before it and off again after it (see SAMPLED), so the setting never
+outlives the statement in the session, even if its results aren't read.
+
+At most one plan per fingerprint is captured every `interval` seconds.
+Captures are written as JSON, with the statement, its fingerprint,
+parameters and timing, to files in `directory`: a ring buffer of the `size`
+most recent captures, shared by the processes that use it. analyze() picks
+out what dominates a plan; see the ss_slowplans management command.
+"""
+import glob
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import warnings
+from xml.etree import ElementTree
+
+from django.db import connections
+
+from django_pyodbc.compat import binary_type, string_types
+from django_pyodbc.fingerprint import fingerprint_id, normalize
+
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_SIZE = 200
+DEFAULT_INTERVAL = 300
+
+# Name of the column of the result sets SET STATISTICS XML adds
+SHOWPLAN_COLUMN = 'Microsoft SQL Server 2005 XML Showplan'
+
+# Batch running a statement with its plan
+SAMPLED = 'SET STATISTICS XML ON;\n%s\n;SET STATISTICS XML OFF'
+
+_ns = '{http://schemas.microsoft.com/sqlserver/2004/07/showplan}'
+
+_select = re.compile(r'^\s*(?:/\*.*?\*/\s*)*(?:SELECT|WITH)\b', re.IGNORECASE | re.DOTALL)
+_into = re.compile(r'\bINTO\b', re.IGNORECASE)
+# Statements that must come first in their batch
+_batch_first = re.compile(r'^\s*(?:/\*.*?\*/\s*)*(?:CREATE|ALTER)\b', re.IGNORECASE | re.DOTALL)
+
+SCANS = ('Table Scan', 'Clustered Index Scan', 'Index Scan')
+LOOKUPS = ('Key Lookup', 'RID Lookup')
+
+# Operators under this share of the cost of their plan aren't reported
+MIN_SHARE = 0.05
+
+
+def is_plan(description):
+    return description is not None and len(description) == 1 and \
+        description[0][0] == SHOWPLAN_COLUMN
+
+
+def is_select(sql):
+    """Whether `sql` only reads, so that it can safely be run again."""
+    return bool(_select.match(sql)) and not _into.search(sql)
+
+
+def take_plans(cursor, plans):
+    """
+    Append to `plans` the plans in the result sets from the current one on,
+    up to the first one that isn't a plan. Return whether there is one.
+    """
+    while is_plan(cursor.description):
+        plans.extend(row[0] for row in cursor.fetchall())
+        if not cursor.nextset():
+            return False
+    return True
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float) + string_types):
+        return value
+    if isinstance(value, (binary_type, bytearray)):
+        return '0x' + bytes(value).hex()
+    return str(value)
+
+
+class PlanCapture(object):
+    """The options and captures of the slow_plans option of one database alias."""
+    def __init__(self, alias, options):
+        self.alias = alias
+        self.threshold = options.get('threshold', DEFAULT_THRESHOLD)
+        self.sample_rate = options.get('sample_rate', 0.0)
+        self.rerun = options.get('rerun', True)
+        self.directory = options.get('directory') or os.path.join(
+            tempfile.gettempdir(), 'django_pyodbc_plans', alias)
+        self.size = options.get('size', DEFAULT_SIZE)
+        self.interval = options.get('interval', DEFAULT_INTERVAL)
+        # fingerprint -> time of its last capture
+        self._captured = {}
+
+    def sample(self, sql):
+        """Whether to run `sql` with its plan."""
+        return self.sample_rate > 0 and random.random() < self.sample_rate and \
+            not _batch_first.match(sql)
+
+    def statistics_off(self, cursor):
+        """
+        Turn STATISTICS XML off after a SAMPLED batch failed, possibly
+        before its end.
+        """
+        self._run(cursor, 'SET STATISTICS XML OFF')
+
+    def finish(self, event, cursor):
+        """
+        Called with a finished QueryEvent and the cursor it ran on, before
+        the cursor runs anything else: read the rest of the plans of a
+        sampled statement, and capture the plan if the statement was slow.
+        """
+        plans = event.plans
+        if plans is not None:
+            try:
+                self._read_plans(cursor, plans)
+            except Exception as e:
+                warnings.warn("Couldn't read the plan of a sampled statement: %s" % e)
+        if event.error or event.many or event.total_time < self.threshold:
+            return
+        if event.fingerprint is None:
+            event.fingerprint = normalize(event.sql)
+        now = time.time()
+        if now - self._captured.get(event.fingerprint, 0) < self.interval:
+            return
+        mode = 'sampled'
+        if not plans:
+            if plans is not None or not self.rerun or not is_select(event.sql):
+                return
+            mode = 'rerun'
+            plans = self.run_again(cursor, event.sql, event.params)
+            if not plans:
+                return
+        if len(self._captured) >= 10000:
+            self._captured.clear()
+        self._captured[event.fingerprint] = now
+        self.save(event, plans, mode)
+
+    def _run(self, cursor, sql):
+        try:
+            cursor.execute(sql)
+        except Exception as e:
+            warnings.warn("Couldn't run %s: %s" % (sql, e))
+            return False
+        return True
+
+    def _read_plans(self, cursor, plans):
+        """Append the plans in the remaining result sets of `cursor` to `plans`."""
+        while True:
+            if is_plan(cursor.description):
+                plans.extend(row[0] for row in cursor.fetchall())
+            if not cursor.nextset():
+                break
+
+    def run_again(self, cursor, sql, params):
+        """Run `sql` under SET STATISTICS XML ON and return its plans."""
+        plans = []
+        try:
+            cursor.execute(SAMPLED % sql, params)
+            self._read_plans(cursor, plans)
+        except Exception as e:
+            warnings.warn("Couldn't capture the plan of a slow statement: %s" % e)
+            self.statistics_off(cursor)
+        return plans
+
+    def save(self, event, plans, mode):
+        """Write a capture to the ring buffer, dropping the oldest beyond size."""
+        capture = {
+            'alias': self.alias,
+            'time': time.time(),
+            'pid': os.getpid(),
+            'mode': mode,
+            'fingerprint': event.fingerprint,
+            'sql': event.sql,
+            'params': [_jsonable(param) for param in event.params],
+            'total_time': event.total_time,
+            'prepare_time': event.prepare_time,
+            'execute_time': event.execute_time,
+            'fetch_time': event.fetch_time,
+            'rows': event.rows,
+            'plans': plans,
+        }
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, '%016d-%d-%s.json' % (
+                capture['time'] * 1e6, os.getpid(), fingerprint_id(event.fingerprint)))
+            tmp = '%s.tmp' % path
+            with open(tmp, 'w') as f:
+                json.dump(capture, f)
+            os.replace(tmp, path)
+            for old in sorted(glob.glob(os.path.join(self.directory, '*.json')))[:-self.size]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        except (IOError, OSError) as e:
+            warnings.warn("Couldn't save the plan of a slow statement: %s" % e)
+
+
+# database alias -> PlanCapture
+_captures = {}
+
+
+def get_plan_capture(connection):
+    """
+    Return the PlanCapture of `connection`'s alias, or None if the
+    slow_plans option is off.
+    """
+    options = connection.slow_plans
+    if options is None:
+        return None
+    try:
+        return _captures[connection.alias]
+    except KeyError:
+        return _captures.setdefault(connection.alias, PlanCapture(connection.alias, options))
+
+
+def captures(using='default', directory=None):
+    """
+    Return the captures of database `using` in `directory` (by default that
+    of its slow_plans option), newest first.
+    """
+    if directory is None:
+        capture = get_plan_capture(connections[using])
+        if capture is None:
+            return []
+        directory = capture.directory
+    found = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json')), reverse=True):
+        try:
+            with open(path) as f:
+                found.append(json.load(f))
+        except (IOError, ValueError):
+            continue
+    return found
+
+
+def _float(element, name):
+    try:
+        return float(element.get(name))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _child_operators(element):
+    for child in element:
+        if child.tag == _ns + 'RelOp':
+            yield child
+        else:
+            for operator in _child_operators(child):
+                yield operator
+
+
+def _object_name(operator):
+    obj = operator.find('./*/%sObject' % _ns)
+    if obj is None:
+        return ''
+    return '.'.join(obj.get(name) for name in ('Schema', 'Table', 'Index') if obj.get(name))
+
+
+def analyze(plan):
+    """
+    Return what dominates `plan`, the XML of an actual or estimated plan, as
+    a dict:
+
+    - operators: a dict per operator taking MIN_SHARE or more of the
+      estimated cost (op, object, cost, share, estimated_rows and, for an
+      actual plan, actual_rows), most expensive first
+    - scans, key_lookups: the objects scanned or looked up
+    - spills: the operators that spilled to tempdb
+    - implicit_conversions: the conversions SQL Server reports as
+      affecting the plan, such as a varchar column compared to nvarchar
+    """
+    root = ElementTree.fromstring(plan.encode('utf-8') if isinstance(plan, string_types) else plan)
+    total = sum(_float(statement, 'StatementSubTreeCost')
+                for statement in root.iter(_ns + 'StmtSimple'))
+    result = {'cost': total, 'operators': [], 'scans': [], 'key_lookups': [], 'spills': [],
+              'implicit_conversions': []}
+    for operator in root.iter(_ns + 'RelOp'):
+        op = operator.get('PhysicalOp')
+        name = _object_name(operator)
+        cost = _float(operator, 'EstimatedTotalSubtreeCost') - sum(
+            _float(child, 'EstimatedTotalSubtreeCost') for child in _child_operators(operator))
+        cost = max(cost, 0.0)
+        lookup = op in LOOKUPS or operator.find('./%sIndexScan[@Lookup]' % _ns) is not None
+        if lookup:
+            op = 'Key Lookup' if op not in LOOKUPS else op
+            result['key_lookups'].append(name)
+        elif op in SCANS:
+            result['scans'].append(name)
+        warnings_element = operator.find(_ns + 'Warnings')
+        if warnings_element is not None and any(
+                'Spill' in child.tag for child in warnings_element):
+            result['spills'].append('%s %s' % (op, name) if name else op)
+        share = cost / total if total else 0.0
+        if share >= MIN_SHARE:
+            details = {'op': op, 'object': name, 'cost': cost, 'share': share,
+                       'estimated_rows': _float(operator, 'EstimateRows')}
+            counters = operator.findall('./%sRunTimeInformation/%sRunTimeCountersPerThread' %
+                                        (_ns, _ns))
+            if counters:
+                details['actual_rows'] = sum(int(_float(c, 'ActualRows')) for c in counters)
+            result['operators'].append(details)
+    for convert in root.iter(_ns + 'PlanAffectingConvert'):
+        expression = convert.get('Expression')
+        if expression not in result['implicit_conversions']:
+            result['implicit_conversions'].append(expression)
+    result['operators'].sort(key=lambda details: -details['cost'])
+    return result
@@ -0,0 +1,303 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process-wide pool of pyodbc connections.
+
+Every DatabaseWrapper that builds the same connection string shares one
+ConnectionPool, so opening a connection in a request is usually an in-memory
+checkout instead of a login round trip to the server.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import utils
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _PoolEntry(object):
+    __slots__ = ('connection', 'created', 'last_used', 'generation', 'fresh')
+
+    def __init__(self, connection, generation=0):
+        self.connection = connection
+        self.created = self.last_used = time.monotonic()
+        self.generation = generation
+        # Opened by fill() and never checked out
+        self.fresh = False
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of open connections.
+
+    `connect` is called without arguments to open a new connection. `ping`
+    receives a connection that has been idle for more than `ping_interval`
+    seconds and returns False if it is no longer usable. `reset` is called
+    with every connection handed back to the pool and should leave it in a
+    clean session state; if it raises, the connection is discarded.
+    fill() opens `min_size` connections up front, and idle connections
+    aren't closed for being idle while no more than `min_size` are open.
+    """
+    def __init__(self, connect, min_size=0, max_size=10, timeout=30,
+                 max_idle=600, max_lifetime=3600, ping_interval=30,
+                 ping=None, reset=None):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self.ping = ping
+        self.reset = reset
+
+        self.pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        # Most recently returned connections are at the right, so checkouts
+        # reuse warm connections and the left end is the first to idle out.
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._generation = 0
+
+        self.hits = 0
+        self.creates = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.evictions = 0
+
+    def _expired(self, entry, now):
+        if self.max_lifetime and now - entry.created > self.max_lifetime:
+            return True
+        return bool(self.max_idle) and now - entry.last_used > self.max_idle
+
+    def _evict_idle(self, now, discarded):
+        # Called with the lock held; idle entries are ordered by last use.
+        while self._idle and self._size > self.min_size and \
+                self._expired(self._idle[0], now):
+            discarded.append(self._idle.popleft())
+            self._size -= 1
+            self.evictions += 1
+
+    def _close(self, entries):
+        for entry in entries:
+            try:
+                entry.connection.close()
+            except Exception:
+                pass
+
+    def checkout(self):
+        """
+        Return a tuple of (connection, created), where `created` is True if
+        the connection was opened for this checkout rather than reused.
+        """
+        deadline = None
+        waited = False
+        while True:
+            discarded = []
+            entry = None
+            create = False
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._evict_idle(now, discarded)
+                    while self._idle:
+                        candidate = self._idle.pop()
+                        if self._expired(candidate, now):
+                            discarded.append(candidate)
+                            self._size -= 1
+                            self.evictions += 1
+                            continue
+                        entry = candidate
+                        break
+                    if entry is not None:
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    if deadline is None:
+                        deadline = now + self.timeout
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        self._close(discarded)
+                        raise utils.OperationalError(
+                            "Timed out after %s seconds waiting for a pooled "
+                            "connection (max_size=%d)." % (self.timeout, self.max_size))
+                    self._cond.wait(remaining)
+            self._close(discarded)
+
+            if create:
+                try:
+                    entry = _PoolEntry(self.connect(), self._generation)
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self.creates += 1
+                    self._in_use[id(entry.connection)] = entry
+                return entry.connection, True
+
+            if self.ping is not None and \
+                    time.monotonic() - entry.last_used > self.ping_interval and \
+                    not self.ping(entry.connection):
+                self._close([entry])
+                with self._cond:
+                    self.evictions += 1
+                self._release_slot()
+                continue
+
+            with self._cond:
+                created, entry.fresh = entry.fresh, False
+                if not created:
+                    self.hits += 1
+                self._in_use[id(entry.connection)] = entry
+            return entry.connection, created
+
+    def fill(self):
+        """
+        Open connections until `min_size` are open. They are handed out as
+        created by checkout(), the first time.
+        """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = _PoolEntry(self.connect(), self._generation)
+            except Exception:
+                self._release_slot()
+                raise
+            entry.fresh = True
+            with self._cond:
+                self.creates += 1
+                # Warm connections are reused first
+                self._idle.appendleft(entry)
+                self._cond.notify()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def checkin(self, connection):
+        """
+        Hand a connection obtained from checkout() back to the pool.
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(connection), None)
+        if entry is None:
+            # Not ours (or the pool was recreated after a fork).
+            self._close([_PoolEntry(connection)])
+            return
+
+        now = time.monotonic()
+        keep = entry.generation == self._generation and \
+            not (self.max_lifetime and now - entry.created > self.max_lifetime)
+        if keep and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                keep = False
+        if not keep:
+            self._close([entry])
+            with self._cond:
+                self.evictions += 1
+            self._release_slot()
+            return
+
+        discarded = []
+        with self._cond:
+            entry.last_used = now
+            self._idle.append(entry)
+            self._evict_idle(now, discarded)
+            self._cond.notify()
+        self._close(discarded)
+
+    def discard(self, connection):
+        """
+        Close a checked out connection instead of returning it to the pool.
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(connection), None)
+        self._close([entry or _PoolEntry(connection)])
+        if entry is not None:
+            self._release_slot()
+
+    def clear(self):
+        """
+        Close every idle connection. Checked out connections are closed when
+        they are returned.
+        """
+        with self._cond:
+            discarded = list(self._idle)
+            self._idle.clear()
+            self._size -= len(discarded)
+            self.evictions += len(discarded)
+            self._generation += 1
+            self._cond.notify_all()
+        self._close(discarded)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'hits': self.hits,
+                'creates': self.creates,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'evictions': self.evictions,
+            }
+
+
+def get_pool(key, connect, **options):
+    """
+    Return the process-wide pool for `key`, creating it on first use.
+
+    Pools inherited from a parent process are never reused: the child gets a
+    fresh pool so two processes don't end up talking over the same socket.
+    A new pool opens its `min_size` connections before it is returned.
+    """
+    pid = os.getpid()
+    pool = _pools.get(key)
+    if pool is not None and pool.pid == pid:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid == pid:
+            return pool
+        pool = ConnectionPool(connect, **options)
+        _pools[key] = pool
+    # Outside the lock, which other pools need
+    pool.fill()
+    return pool
+
+
+def all_pools():
+    """
+    Return a dict of the pools created by this process.
+    """
+    pid = os.getpid()
+    return dict((k, p) for k, p in _pools.items() if p.pid == pid)
@@ -0,0 +1,211 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of the SQL compiled for SELECT queries, keyed on the structure of the
+Query: everything but the values compared in its WHERE clause.
+
+On a hit only the leaves of the WHERE tree are compiled, for their
+parameters. Their SQL is checked against the SQL they had when the entry
+was stored, so a value that changes the SQL of its lookup (a longer IN
+list, say) makes a miss rather than a wrong statement. Queries whose
+parameters don't all come from WHERE leaves, in the order of the leaves,
+aren't cached.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.db.models.expressions import Col
+from django.db.models.fields import Field
+from django.db.models.lookups import Lookup
+from django.db.models.sql.datastructures import BaseTable, Join
+from django.db.models.sql.query import Query
+from django.db.models.sql.where import WhereNode
+
+from django_pyodbc.compat import string_types
+
+DEFAULT_SIZE = 512
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses uncacheable maxsize currsize')
+
+# Stored for each query structure
+CompiledSQL = namedtuple('CompiledSQL', 'sql leaf_sql using_row_number has_extra_select')
+
+# Stored for query structures that can't be cached, so they are compiled
+# straight away next time
+UNCACHEABLE = object()
+
+# Query attributes that don't affect the SQL, are derived from others or are
+# handled separately
+_skip_query_attrs = frozenset([
+    'where', 'low_mark', 'high_mark', 'base_table', 'table_map', 'used_aliases',
+    'filter_is_sticky', 'where_class', '_annotation_select_cache',
+    '_extra_select_cache', '_lookup_joins',
+])
+
+
+# Query attribute names, in the order a Query has them -> the names that
+# make up the key, sorted
+_key_names = {}
+
+
+class Uncacheable(Exception):
+    pass
+
+
+def expression_key(expr):
+    if isinstance(expr, Col):
+        return (Col, expr.alias, expr.target.column)
+    try:
+        key = expr.identity
+    except AttributeError:
+        raise Uncacheable(expr)
+    try:
+        hash(key)
+    except TypeError:
+        raise Uncacheable(expr)
+    return key
+
+
+_atomic_types = frozenset([type(None), bool, int, float, str])
+
+
+def value_key(value):
+    if type(value) in _atomic_types or isinstance(value, string_types):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(value_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, value_key(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value_key(v) for v in value)
+    if isinstance(value, (type, Field)):
+        return value
+    if isinstance(value, Join):
+        if value.filtered_relation is not None:
+            raise Uncacheable(value)
+        return (Join, value.table_name, value.parent_alias, value.table_alias,
+                value.join_type, value.join_field, value.nullable)
+    if isinstance(value, BaseTable):
+        return (BaseTable, value.table_name, value.table_alias)
+    if hasattr(value, 'resolve_expression') and not isinstance(value, Query):
+        return expression_key(value)
+    raise Uncacheable(value)
+
+
+def where_key(node, leaves):
+    """
+    Return the key of the WHERE tree under `node`, appending its leaves to
+    `leaves` in the order they are compiled.
+    """
+    if isinstance(node, WhereNode):
+        return (node.connector, node.negated,
+                tuple(where_key(child, leaves) for child in node.children))
+    leaves.append(node)
+    if isinstance(node, Lookup):
+        rhs = node.rhs
+        if isinstance(rhs, Query):
+            rhs_key = Query
+        elif hasattr(rhs, 'resolve_expression'):
+            rhs_key = expression_key(rhs)
+        else:
+            rhs_key = type(rhs)
+        return (type(node), expression_key(node.lhs), rhs_key)
+    return (type(node),)
+
+
+def query_key(query, leaves):
+    if query.combinator or getattr(query, '_filtered_relations', None) or \
+            query.where.contains_aggregate:
+        raise Uncacheable(query)
+    attributes = vars(query)
+    names = tuple(attributes)
+    try:
+        key_names = _key_names[names]
+    except KeyError:
+        key_names = _key_names[names] = tuple(sorted(n for n in names if n not in _skip_query_attrs))
+    attrs = []
+    for name in key_names:
+        value = attributes[name]
+        if type(value) not in _atomic_types:
+            value = value_key(value)
+        attrs.append(value)
+    return (type(query), key_names, tuple(attrs), where_key(query.where, leaves))
+
+
+class CompiledSQLCache(object):
+    """
+    Least recently used cache of CompiledSQL entries, with hit and miss
+    counts. Shared by the threads using a database alias.
+    """
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.uncacheable = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.uncacheable = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.uncacheable, self.maxsize,
+                         len(self._entries))
+
+
+# database alias -> CompiledSQLCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(connection):
+    """
+    Return the CompiledSQLCache of `connection`'s alias, or None if the
+    compiled_sql_cache option is off.
+    """
+    options = connection.compiled_sql_cache
+    if options is None:
+        return None
+    try:
+        return _caches[connection.alias]
+    except KeyError:
+        with _caches_lock:
+            if connection.alias not in _caches:
+                _caches[connection.alias] = CompiledSQLCache(options.get('size', DEFAULT_SIZE))
+            return _caches[connection.alias]
+
+
+def cache_info(using='default'):
+    """
+    Return the hits, misses, uncacheable compilations, maximum and current
+    size of the compiled SQL cache of database `using`, or None if it has no
+    cache.
+    """
+    cache = _caches.get(using)
+    return cache.info() if cache is not None else None
@@ -0,0 +1,134 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Comments naming the code that ran a statement, so that a plan found in
+sys.dm_exec_query_stats can be traced back to its view:
+
+    /* books:book_detail:books.Book */ SELECT ...
+
+The app and view come from a context variable set by SQLTagMiddleware or
+tag(), the model from the compiler running the query. SQL Server caches
+plans by statement text, comment included, so tags only hold names that
+are the same every time a call site runs: never ids or parameters. The
+comment of each combination of names is built once.
+"""
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+
+_unsafe = re.compile(r'[^\w.\-]+')
+
+
+class Tags(object):
+    """The names a statement is tagged with and the comment made of them."""
+    __slots__ = ('app', 'view', 'model', 'comment')
+
+    def __init__(self, app, view, model):
+        self.app = app
+        self.view = view
+        self.model = model
+        if app or view or model:
+            self.comment = '/* %s */ ' % ':'.join(
+                _unsafe.sub('_', name or '') for name in (app, view, model))
+        else:
+            self.comment = ''
+
+
+@lru_cache(maxsize=4096)
+def get_tags(app=None, view=None, model=None):
+    return Tags(app, view, model)
+
+
+EMPTY = get_tags()
+
+_current = ContextVar('django_pyodbc_sql_tags', default=EMPTY)
+
+
+def current():
+    return _current.get()
+
+
+def tag_sql(sql):
+    """
+    Return `sql` with the comment of the current tags in front of it, unless
+    it has it already (as compiled SQL cached with its tags does).
+    """
+    comment = _current.get().comment
+    if not comment or sql.startswith(comment):
+        return sql
+    return comment + sql
+
+
+@contextmanager
+def tag(app=None, view=None):
+    """Tag the statements run in the block with `app` and `view`."""
+    tags = _current.get()
+    token = _current.set(get_tags(app, view, tags.model))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def model(model):
+    """Tag the statements run in the block with `model`, a model class."""
+    tags = _current.get()
+    token = _current.set(get_tags(tags.app, tags.view, model._meta.label if model else None))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def tag_model(execute_sql):
+    """
+    Decorator for SQLCompiler.execute_sql() tagging its statements with the
+    model of the query, if the connection has the sql_tags option on.
+    """
+    @wraps(execute_sql)
+    def inner(self, *args, **kwargs):
+        if self.connection.sql_tags is None:
+            return execute_sql(self, *args, **kwargs)
+        with model(self.query.model):
+            return execute_sql(self, *args, **kwargs)
+    return inner
+
+
+class SQLTagMiddleware(object):
+    """
+    Tag the statements run while handling a request with the app and URL
+    name of its view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current.set(_current.get())
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        app = match.app_name if match is not None and match.app_name else \
+            view_func.__module__.split('.')[0]
+        view = match.url_name if match is not None and match.url_name else \
+            getattr(view_func, '__name__', type(view_func).__name__)
+        # No token to reset: __call__() resets the variable to what it was
+        # before the request, undoing this too
+        _current.set(get_tags(app, view, _current.get().model))
@@ -0,0 +1,129 @@
+"""
+Cost of SQLCompiler._alias_columns, which splits the select list of a
+sliced query when it is rewritten with ROW_NUMBER().
+
+Compares the character by character rewrite it used to do with the
+tokenizer, uncached and cached, on wide and deeply nested queries. Needs
+pyodbc importable; no database connection is made.
+
+    python tests/benchmarks/alias_columns.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from django.conf import settings
+
+settings.configure()
+
+from django_pyodbc import compiler
+
+NUMBER = 50
+
+
+def wide(columns):
+    cols = ', '.join('[app_t].[c%d]' % i for i in range(columns))
+    return '%s FROM [app_t] WHERE ([app_t].[a] = %%s AND [app_t].[b] > %%s)' % cols
+
+
+def nested(depth, columns):
+    cols = []
+    for i in range(columns):
+        expr = '[app_t].[c%d]' % i
+        for d in range(depth):
+            expr = 'COALESCE((%s), (SELECT MAX(U%d.[c%d]) FROM [app_u] U%d WHERE U%d.[x] IN (%%s, %%s)))' % (
+                expr, d, i, d, d)
+        cols.append('%s AS [c%d]' % (expr, i))
+    # every column repeated once, so half of them get aliased
+    cols += ['[app_u].[c%d]' % i for i in range(columns)]
+    return '%s FROM [app_t] INNER JOIN [app_u] ON ([app_t].[id] = [app_u].[t_id])' % ', '.join(cols)
+
+
+QUERIES = [
+    ('wide, 30 columns', wide(30)),
+    ('wide, 300 columns', wide(300)),
+    ('nested, depth 5 x 20', nested(5, 20)),
+    ('nested, depth 10 x 100', nested(10, 100)),
+]
+
+
+def old_alias_columns(sql, left='[', right=']'):
+    """The character by character rewrite, as it was before the tokenizer."""
+    qn = lambda name: '%s%s%s' % (left, name, right)
+    re_pat_col = re.compile(r"\{0}([^\{0}]+)\{1}$".format(left, right))
+    re_col_placeholder = re.compile(r'\{_placeholder_(\d+)\}')
+    outer = list()
+    inner = list()
+    names_seen = list()
+    paren_depth, paren_buf = 0, ['']
+    parens, i = {}, 0
+    for ch in sql:
+        if ch == '(':
+            i += 1
+            paren_depth += 1
+            paren_buf.append('')
+        elif ch == ')':
+            paren_depth -= 1
+            key = '_placeholder_{0}'.format(i)
+            buf = paren_buf.pop()
+            buf = re.sub(r'%([^\(])', r'$$$\1', buf)
+            parens[key] = buf % parens
+            parens[key] = re.sub(r'\$\$\$([^\(])', r'%\1', parens[key])
+            paren_buf[paren_depth] += '(%(' + key + ')s)'
+        else:
+            paren_buf[paren_depth] += ch
+
+    def _replace_sub(col):
+        while re_col_placeholder.search(col):
+            col = col.format(**parens)
+        return col
+
+    temp_sql = ''.join(paren_buf)
+    placeholder_data = {"i": i}
+
+    def _alias_placeholders(val):
+        i = placeholder_data["i"] + 1
+        placeholder_data["i"] = i
+        key = "_placeholder_{0}".format(i)
+        parens[key] = "%s"
+        return "%(" + key + ")s"
+
+    temp_sql = re.sub("%s", _alias_placeholders, temp_sql)
+    find = ' FROM ' + left
+    select_list, from_clause = temp_sql[:temp_sql.find(find)], temp_sql[temp_sql.find(find):]
+    for col in [x.strip() for x in select_list.split(',')]:
+        match = re_pat_col.search(col)
+        if match:
+            col_name = match.group(1)
+            col_key = col_name.lower()
+            if col_key in names_seen:
+                alias = qn('{0}___{1}'.format(col_name, names_seen.count(col_key)))
+                outer.append(alias)
+                inner.append('{0} as {1}'.format(_replace_sub(col), alias))
+            else:
+                outer.append(qn(col_name))
+                inner.append(_replace_sub(col))
+            names_seen.append(col_key)
+        else:
+            raise Exception('Unable to find a column name when parsing SQL: {0}'.format(col))
+    return ', '.join(outer), ', '.join(inner) + (from_clause % parens)
+
+
+def main():
+    for label, sql in QUERIES:
+        assert compiler._rewrite_alias_columns(sql, '[', ']')[0] == old_alias_columns(sql)[0]
+        before = min(timeit.repeat(lambda: old_alias_columns(sql), number=NUMBER, repeat=5))
+        uncached = min(timeit.repeat(lambda: compiler._rewrite_alias_columns(sql, '[', ']'),
+                                     number=NUMBER, repeat=5))
+        cached = min(timeit.repeat(lambda: compiler._alias_columns(sql, '[', ']'),
+                                   number=NUMBER, repeat=5))
+        before, uncached, cached = [t / NUMBER * 1e3 for t in (before, uncached, cached)]
+        print('%-24s %6d chars  before %8.3f ms  tokenizer %7.3f ms  cached %.4f ms'
+              % (label, len(sql), before, uncached, cached))
+
+
+if __name__ == '__main__':
+    main()
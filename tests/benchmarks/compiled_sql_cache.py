@@ -0,0 +1,64 @@
+"""
+Cost of compiling ORM queries with and without the compiled_sql_cache
+option, for query shapes a hot endpoint repeats with different values.
+Needs pyodbc importable; no database connection is made.
+
+    python tests/benchmarks/compiled_sql_cache.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from django.conf import settings
+
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django_pyodbc', 'NAME': 'bench'}},
+    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth'],
+)
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+from django_pyodbc import querycache
+
+NUMBER = 1000
+
+QUERIES = [
+    ('get by pk', lambda i: User.objects.filter(pk=i)),
+    ('filter, join, order, page',
+     lambda i: User.objects.filter(Q(username__startswith='u%d' % i) | Q(email=str(i)),
+                                   groups__name='staff', is_active=True)
+                           .order_by('-date_joined')[i:i + 25]),
+]
+
+
+def compile_queries(queries):
+    for query in queries:
+        query.get_compiler(using='default').as_sql()
+
+
+def main():
+    # Pretend the server was probed
+    connection.ops._ss_ver = 2012
+    for label, make in QUERIES:
+        times = []
+        for option in (None, {}):
+            connection.compiled_sql_cache = option
+            # Building the querysets isn't part of compiling them
+            queries = [make(i % 10 + 1).query for i in range(NUMBER * 3)]
+            compile_queries(queries[:1])
+            times.append(min(timeit.repeat(
+                lambda: compile_queries(queries[:NUMBER]), number=1, repeat=3)) / NUMBER * 1e6)
+        print('%-28s uncached %.1f us  cached %.1f us per query' % (label, times[0], times[1]))
+    print(querycache.cache_info())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Cost of adapting executemany() parameters in CursorWrapper.
+
+Compares the per-value isinstance chain used before with the per-column
+converter plan for 100k-row payloads, both with a driver that takes UTF-8
+bytes as is and with one that needs them decoded. Needs pyodbc importable;
+no database connection is made.
+
+    python tests/benchmarks/format_params.py
+"""
+import datetime
+import decimal
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from django.conf import settings
+
+settings.configure()
+
+from django_pyodbc.base import CursorWrapper
+
+ROWS = 100000
+NOW = datetime.datetime(2017, 1, 1, 12, 30)
+
+PAYLOADS = [
+    ('int/text/decimal/datetime',
+     [(i, u'name %d' % i, decimal.Decimal('1.50'), NOW) for i in range(ROWS)]),
+    ('with bool and bytes',
+     [(i, u'name %d' % i, b'code', i % 2 == 0, None, NOW) for i in range(ROWS)]),
+]
+
+
+def isinstance_chain(params, driver_supports_utf8, encoding='utf-8'):
+    fp = []
+    for p in params:
+        if isinstance(p, str):
+            fp.append(p)
+        elif isinstance(p, bytes):
+            if not driver_supports_utf8:
+                fp.append(p.decode(encoding))
+            else:
+                fp.append(p)
+        elif isinstance(p, bool):
+            fp.append(1 if p else 0)
+        else:
+            fp.append(p)
+    return tuple(fp)
+
+
+def main():
+    for driver_supports_utf8 in (True, False):
+        wrapper = CursorWrapper(None, driver_supports_utf8, 'utf-8', None)
+        for label, rows in PAYLOADS:
+            before = min(timeit.repeat(
+                lambda: [isinstance_chain(p, driver_supports_utf8) for p in rows],
+                number=1, repeat=3))
+            after = min(timeit.repeat(
+                lambda: wrapper.format_params_list(rows), number=1, repeat=3))
+            print('utf8=%-5s %-26s isinstance chain %7.1f ms  column plan %7.1f ms'
+                  % (driver_supports_utf8, label, before * 1e3, after * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Per-execute cost of CursorWrapper.format_sql.
+
+Compares the placeholder translation done on every execute before it was
+memoised with the cached version, for statements shaped like the ones the
+ORM sends. Needs pyodbc importable; no database connection is made.
+
+    python tests/benchmarks/format_sql.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from django.conf import settings
+
+settings.configure()
+
+from django_pyodbc.base import CursorWrapper
+
+STATEMENTS = [
+    ('SELECT, 3 params',
+     'SELECT [app_book].[id], [app_book].[title], [app_book].[author_id] '
+     'FROM [app_book] WHERE ([app_book].[author_id] = %s AND '
+     '[app_book].[published] >= %s AND [app_book].[title] LIKE %s)', 3),
+    ('INSERT, 10 params',
+     'INSERT INTO [app_book] ([title], [subtitle], [author_id], [isbn], '
+     '[pages], [price], [published], [created], [updated], [active]) '
+     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', 10),
+]
+NUMBER = 200000
+
+
+def uncached_format_sql(sql, n_params=None):
+    if n_params is not None:
+        try:
+            sql = sql % tuple('?' * n_params)
+        except Exception:
+            pass
+    else:
+        if '%s' in sql:
+            sql = sql.replace('%s', '?')
+    return sql
+
+
+def main():
+    wrapper = CursorWrapper(None, True, 'utf-8', None)
+    for label, sql, n_params in STATEMENTS:
+        assert wrapper.format_sql(sql, n_params) == uncached_format_sql(sql, n_params)
+        before = min(timeit.repeat(lambda: uncached_format_sql(sql, n_params),
+                                   number=NUMBER, repeat=3))
+        after = min(timeit.repeat(lambda: wrapper.format_sql(sql, n_params),
+                                  number=NUMBER, repeat=3))
+        before, after = before / NUMBER * 1e6, after / NUMBER * 1e6
+        print('%-18s uncached %.3f us  cached %.3f us  saved %.3f us per execute'
+              % (label, before, after, before - after))
+
+
+if __name__ == '__main__':
+    main()
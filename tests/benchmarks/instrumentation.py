@@ -0,0 +1,90 @@
+"""
+Overhead of the instrumentation option on CursorWrapper.
+
+Runs execute() and fetchall() against a cursor that returns straight away,
+so what is measured is the wrapper itself, with and without a Recorder
+(recording every statement, with latency histograms, and a quarter of the
+statements), and compares the difference with the time of a fast statement
+on a real server. Runs of the plain and instrumented wrappers alternate and
+the median difference is reported, which keeps a busy machine from skewing
+it. Needs pyodbc importable; no database connection is made.
+
+    python tests/benchmarks/instrumentation.py
+"""
+import os
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from django.conf import settings
+
+VARIANTS = (
+    ('every statement', {}),
+    ('with histograms', {'histogram_precision': 5}),
+    ('sample_rate 0.25', {'sample_rate': 0.25}),
+)
+
+settings.configure(DATABASES=dict(
+    (alias, {'ENGINE': 'django_pyodbc', 'NAME': 'bench'})
+    for alias in ['default'] + [name for name, options in VARIANTS]))
+
+from django.db import connections
+
+from django_pyodbc.base import CursorWrapper
+
+NUMBER = 2000
+REPEAT = 200
+
+# A single row lookup by primary key on a local server
+STATEMENT_TIME = 200e-6
+
+DESCRIPTION = (('id', int, None, 10, 10, 0, False), ('name', str, None, 50, 50, 0, True))
+ROWS = [(1, u'name')]
+
+
+class NullCursor(object):
+    """Stands in for a pyodbc cursor: no driver, no network."""
+    description = DESCRIPTION
+
+    def execute(self, sql, params):
+        return self
+
+    def fetchall(self):
+        return ROWS
+
+    def close(self):
+        pass
+
+
+def run(wrapper):
+    wrapper.execute('SELECT [t].[id], [t].[name] FROM [t] WHERE [t].[id] = %s', [1])
+    wrapper.fetchall()
+
+
+def main():
+    def wrapper(alias, options):
+        connection = connections[alias]
+        connection.string_param_sizes = False
+        connection.instrumentation = options
+        return CursorWrapper(NullCursor(), True, 'utf-8', connection)
+
+    plain = wrapper('default', None)
+    wrappers = [(name, wrapper(name, options)) for name, options in VARIANTS]
+    base = []
+    overheads = dict((name, []) for name, options in VARIANTS)
+    for i in range(REPEAT):
+        before = timeit.timeit(lambda: run(plain), number=NUMBER) / NUMBER
+        base.append(before)
+        for name, instrumented in wrappers:
+            after = timeit.timeit(lambda: run(instrumented), number=NUMBER) / NUMBER
+            overheads[name].append(after - before)
+    print('wrapper alone      %6.2f us per statement' % (statistics.median(base) * 1e6))
+    for name, options in VARIANTS:
+        overhead = statistics.median(overheads[name])
+        print('%-18s overhead %.2f us, %.2f%% of a %d us statement'
+              % (name, overhead * 1e6, overhead / STATEMENT_TIME * 100, STATEMENT_TIME * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ from __future__ import absolute_import, unicode_literals
 
 import datetime
 from decimal import Decimal
+import os
 import threading
 
 from django.conf import settings
@@ -17,10 +18,10 @@ from django.db.backends.util import format_number
 from django.db.models import Sum, Avg, Variance, StdDev
 from django.db.models.fields import (AutoField, DateField, DateTimeField,
     DecimalField, IntegerField, TimeField)
-from django.db.utils import ConnectionHandler
+from django.db.utils import ConnectionHandler, OperationalError
 from django.test import (TestCase, skipUnlessDBFeature, skipIfDBFeature,
     TransactionTestCase)
-from django.test.utils import override_settings, str_prefix
+from django.test.utils import CaptureQueriesContext, override_settings, str_prefix
 from django.utils import six, unittest
 from django.utils.six.moves import xrange
 
@@ -381,6 +382,885 @@ class ConnectionCreatedSignalTest(TransactionTestCase):
         self.assertTrue(data == {})
 
 
+class SqlServerSessionInitTest(TransactionTestCase):
+
+    available_apps = []
+
+    def _count_round_trips(self, options):
+        """
+        Open a new connection with the given extra OPTIONS and return the
+        statements and commits sent to the server while opening it.
+        """
+        from django_pyodbc import base
+
+        sent = []
+
+        class CountingCursor(object):
+            def __init__(self, cursor):
+                self._cursor = cursor
+
+            def execute(self, sql, *args):
+                sent.append(sql)
+                return self._cursor.execute(sql, *args)
+
+            def __getattr__(self, attr):
+                return getattr(self._cursor, attr)
+
+        class CountingConnection(object):
+            def __init__(self, conn):
+                self._conn = conn
+
+            def cursor(self):
+                return CountingCursor(self._conn.cursor())
+
+            def commit(self):
+                sent.append('COMMIT')
+                return self._conn.commit()
+
+            def __getattr__(self, attr):
+                return getattr(self._conn, attr)
+
+        settings_dict = connection.settings_dict.copy()
+        settings_dict['OPTIONS'] = dict(settings_dict['OPTIONS'], **options)
+        wrapper = connection.__class__(settings_dict, alias='session_init_test')
+        real_connect = base.Database.connect
+        base.Database.connect = lambda *args, **kwargs: CountingConnection(real_connect(*args, **kwargs))
+        try:
+            wrapper.cursor()
+        finally:
+            base.Database.connect = real_connect
+            wrapper.close()
+        return sent
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific session initialisation")
+    def test_new_connection_single_round_trip(self):
+        sent = self._count_round_trips({
+            'autocommit': True,
+            'capability_cache': False,
+            'session_init': {
+                'arithabort': True,
+                'isolation_level': 'READ COMMITTED',
+                'lock_timeout': 5000,
+            },
+        })
+        self.assertEqual(len(sent), 1)
+        self.assertIn('SET LOCK_TIMEOUT 5000', sent[0])
+        self.assertIn('SERVERPROPERTY', sent[0])
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific session initialisation")
+    def test_cached_capabilities_skip_probe(self):
+        options = {'autocommit': True, 'session_init': {'arithabort': True}}
+        self._count_round_trips(options)
+        sent = self._count_round_trips(options)
+        self.assertEqual(len(sent), 1)
+        self.assertNotIn('SERVERPROPERTY', sent[0])
+
+    def test_capability_cache_key(self):
+        from django_pyodbc.capabilities import cache_key
+        key = cache_key('DRIVER={ODBC Driver 17};SERVER=s;UID=u;PWD=secret;DATABASE=d')
+        self.assertEqual(key, cache_key('DRIVER={ODBC Driver 17};SERVER=s;UID=u;PWD=other;DATABASE=d'))
+        self.assertEqual(key, cache_key('DRIVER={ODBC Driver 17};SERVER=s;UID=u;'
+                                        'password={se;cr}}et};DATABASE=d'))
+        self.assertNotEqual(key, cache_key('DRIVER={ODBC Driver 17};SERVER=s;UID=u;PWD=secret;DATABASE=e'))
+        # Not Latin-1
+        self.assertEqual(len(cache_key('SERVER=s;DATABASE=数据;PWD=密')), 32)
+
+
+class SqlServerFastExecutemanyTest(TransactionTestCase):
+
+    available_apps = ['backends']
+
+    def setUp(self):
+        self._fast_executemany = connection.fast_executemany
+        self._can_return_rows = connection.features.can_return_rows_from_bulk_insert
+        self._can_return_ids = connection.features.can_return_ids_from_bulk_insert
+        # small budget so the rows are sent in several chunks
+        connection.fast_executemany = {'memory': 1024}
+        # as set up by DatabaseWrapper for the option
+        connection.features.can_return_rows_from_bulk_insert = False
+        connection.features.can_return_ids_from_bulk_insert = False
+
+    def tearDown(self):
+        connection.fast_executemany = self._fast_executemany
+        connection.features.can_return_rows_from_bulk_insert = self._can_return_rows
+        connection.features.can_return_ids_from_bulk_insert = self._can_return_ids
+
+    def test_input_sizes(self):
+        from django_pyodbc import inputsizes
+        self.assertEqual(inputsizes.db_type_input_size('nvarchar(20)'),
+                         (inputsizes.SQL_WVARCHAR, 20, 0))
+        self.assertEqual(inputsizes.db_type_input_size('nvarchar(max)'),
+                         (inputsizes.SQL_WVARCHAR, 0, 0))
+        self.assertEqual(inputsizes.db_type_input_size('decimal(10, 2)'),
+                         (inputsizes.SQL_DECIMAL, 10, 2))
+        self.assertEqual(inputsizes.db_type_input_size('int IDENTITY (1, 1)'),
+                         (inputsizes.SQL_INTEGER, 0, 0))
+        self.assertIsNone(inputsizes.db_type_input_size('datetimeoffset'))
+
+    def test_string_input_sizes(self):
+        from django_pyodbc import inputsizes
+        sizes = inputsizes.string_input_sizes(
+            [1, 'abc', inputsizes.VarcharParam('x' * 100), 'y' * 5000])
+        self.assertEqual(sizes, [
+            None,
+            (inputsizes.SQL_WVARCHAR, 64, 0),
+            (inputsizes.SQL_VARCHAR, 256, 0),
+            (inputsizes.SQL_WVARCHAR, 0, 0),
+        ])
+        self.assertIsNone(inputsizes.string_input_sizes([1, None]))
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast_executemany")
+    def test_bulk_batch_size(self):
+        # Also sizes the pk__in lists of the delete collector
+        objs = list(range(5000))
+        pk = models.Square._meta.pk
+        self.assertLess(connection.ops.bulk_batch_size([pk], objs), 2100)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast_executemany")
+    def test_delete_many(self):
+        models.Square.objects.bulk_create(
+            [models.Square(root=i, square=i ** 2) for i in range(2500)])
+        models.Square.objects.all().delete()
+        self.assertEqual(models.Square.objects.count(), 0)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast_executemany")
+    def test_bulk_create(self):
+        models.Square.objects.bulk_create(
+            [models.Square(root=i, square=i ** 2) for i in range(-100, 101)])
+        self.assertEqual(models.Square.objects.count(), 201)
+        self.assertEqual(models.Square.objects.get(root=-7).square, 49)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast_executemany")
+    def test_bulk_create_explicit_pk(self):
+        models.Square.objects.bulk_create(
+            [models.Square(pk=i, root=i, square=i ** 2) for i in range(1, 51)])
+        self.assertEqual(models.Square.objects.get(pk=50).square, 2500)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast_executemany")
+    def test_bulk_create_skips_merge(self):
+        with CaptureQueriesContext(connection) as captured:
+            squares = models.Square.objects.bulk_create(
+                [models.Square(root=i, square=i ** 2) for i in range(3)])
+        self.assertFalse([q for q in captured.captured_queries if 'MERGE' in q['sql']])
+        self.assertEqual(models.Square.objects.count(), 3)
+        self.assertIsNone(squares[0].pk)
+
+
+class SqlServerInsertReturningTest(TransactionTestCase):
+
+    available_apps = ['backends']
+
+    def _clear_caches(self):
+        from django_pyodbc import compiler
+        compiler._insert_returning_templates.clear()
+        connection.introspection._table_triggers.clear()
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific INSERT ... OUTPUT")
+    def test_save_without_triggers(self):
+        self._clear_caches()
+        square = models.Square.objects.create(root=2, square=4)
+        self.assertEqual(models.Square.objects.get(pk=square.pk).root, 2)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific INSERT ... OUTPUT")
+    def test_save_with_triggers(self):
+        # OUTPUT without INTO fails on tables with triggers
+        self._clear_caches()
+        cursor = connection.cursor()
+        cursor.execute("CREATE TRIGGER backends_square_noop ON backends_square "
+                       "AFTER INSERT AS SET NOCOUNT ON")
+        try:
+            square = models.Square.objects.create(root=3, square=9)
+            self.assertEqual(models.Square.objects.get(pk=square.pk).root, 3)
+        finally:
+            cursor.execute("DROP TRIGGER backends_square_noop")
+            self._clear_caches()
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific INSERT ... OUTPUT")
+    def test_save_after_trigger_created(self):
+        # The table was looked up, and its INSERT cached, without the trigger
+        self._clear_caches()
+        models.Square.objects.create(root=2, square=4)
+        cursor = connection.cursor()
+        cursor.execute("CREATE TRIGGER backends_square_noop ON backends_square "
+                       "AFTER INSERT AS SET NOCOUNT ON")
+        try:
+            square = models.Square.objects.create(root=3, square=9)
+            self.assertEqual(models.Square.objects.get(pk=square.pk).root, 3)
+            self.assertEqual(models.Square.objects.count(), 2)
+        finally:
+            cursor.execute("DROP TRIGGER backends_square_noop")
+            self._clear_caches()
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific MERGE ... OUTPUT")
+    def test_bulk_create_sql(self):
+        # Only objects without a primary key need one read back
+        with CaptureQueriesContext(connection) as captured:
+            squares = models.Square.objects.bulk_create(
+                [models.Square(root=i, square=i ** 2) for i in range(3)])
+        sql = [q['sql'] for q in captured.captured_queries]
+        self.assertEqual(len([s for s in sql if 'MERGE' in s]), 1)
+        self.assertTrue(all(square.pk is not None for square in squares))
+
+        with CaptureQueriesContext(connection) as captured:
+            models.Square.objects.bulk_create(
+                [models.Square(pk=squares[-1].pk + i, root=i, square=i ** 2) for i in range(1, 4)])
+        sql = [q['sql'] for q in captured.captured_queries]
+        self.assertFalse([s for s in sql if 'MERGE' in s or 'OUTPUT' in s])
+        self.assertEqual(len([s for s in sql if s.count('INSERT INTO') == 1]), 1)
+        self.assertEqual(models.Square.objects.count(), 6)
+
+
+class SqlServerOffsetFetchTest(TestCase):
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific OFFSET ... FETCH")
+    def test_slicing(self):
+        if connection.ops.sql_server_ver < 2012:
+            self.skipTest("OFFSET ... FETCH needs SQL Server 2012")
+        for i in range(10):
+            models.Square.objects.create(root=i, square=i ** 2)
+        qs = models.Square.objects.order_by('-root')
+        self.assertIn('OFFSET', str(qs[2:5].query))
+        self.assertEqual([s.root for s in qs[2:5]], [7, 6, 5])
+        self.assertEqual([s.root for s in qs[8:]], [1, 0])
+        self.assertEqual(
+            sorted(models.Square.objects.values_list('root', flat=True).distinct()[7:]),
+            [7, 8, 9])
+
+
+class SqlServerCompiledSQLCacheTest(TestCase):
+
+    def setUp(self):
+        self._cache_option = connection.compiled_sql_cache
+        connection.compiled_sql_cache = {}
+
+    def tearDown(self):
+        from django_pyodbc import querycache
+        connection.compiled_sql_cache = self._cache_option
+        querycache._caches.pop(connection.alias, None)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific compiled SQL cache")
+    def test_same_structure_hits(self):
+        from django_pyodbc import querycache
+        for i in range(5):
+            models.Square.objects.create(root=i, square=i ** 2)
+        cache = querycache.get_cache(connection)
+        cache.clear()
+        for i in range(5):
+            self.assertEqual([s.square for s in models.Square.objects.filter(root__gte=i).order_by('root')[:1]],
+                             [i ** 2])
+        self.assertEqual(cache.info().misses, 1)
+        self.assertEqual(cache.info().hits, 4)
+        # A longer IN list has different SQL
+        self.assertEqual(models.Square.objects.filter(root__in=[1]).count(), 1)
+        self.assertEqual(len(models.Square.objects.filter(root__in=[1, 2])), 2)
+        self.assertEqual(len(models.Square.objects.filter(root__in=[1, 2, 3])), 3)
+
+
+class SqlServerFastPathTest(TestCase):
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast paths")
+    def test_get_update_delete(self):
+        from django_pyodbc.fastpath import FastPathManager
+        manager = FastPathManager()
+        manager.model = models.Square
+        square = models.Square.objects.create(root=3, square=9)
+        fetched = manager.get(square.pk)
+        self.assertEqual((fetched.pk, fetched.root, fetched.square), (square.pk, 3, 9))
+        self.assertRaises(models.Square.DoesNotExist, manager.get, square.pk + 1000)
+        fetched.square = 10
+        self.assertEqual(manager.update(fetched, ['square']), 1)
+        self.assertEqual(models.Square.objects.get(pk=square.pk).square, 10)
+        self.assertEqual(manager.delete(fetched), 1)
+        self.assertFalse(models.Square.objects.filter(pk=square.pk).exists())
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific fast paths")
+    def test_cursor_after_reconnect(self):
+        from django_pyodbc import fastpath
+        settings_dict = connection.settings_dict.copy()
+        settings_dict['OPTIONS'] = dict(settings_dict['OPTIONS'], pool={}, cursor_cache={})
+        wrapper = type(connections[DEFAULT_DB_ALIAS])(settings_dict, alias='fast_path_test')
+        try:
+            # The pool hands the same connection back after close()
+            for i in range(2):
+                cursor = fastpath.get_cursor(wrapper)
+                cursor.execute('SELECT %s', [i])
+                self.assertEqual(cursor.fetchall()[0][0], i)
+                wrapper.close()
+            # Logged once queries are captured
+            with CaptureQueriesContext(wrapper) as captured:
+                fastpath.get_cursor(wrapper).execute('SELECT 1')
+            self.assertEqual(len(captured), 1)
+        finally:
+            wrapper.close()
+            if wrapper._pool is not None:
+                wrapper._pool.clear()
+
+
+class SqlServerCursorCacheTest(TestCase):
+
+    def setUp(self):
+        self._cache_option = connection.cursor_cache
+        connection.cursor_cache = {'size': 2}
+
+    def tearDown(self):
+        connection.cursor_cache = self._cache_option
+        if connection._cursor_cache is not None:
+            connection._cursor_cache.close()
+            connection._cursor_cache = None
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific cursor cache")
+    def test_same_sql_reuses_cursor(self):
+        from django_pyodbc.cursorcache import cache_info
+        sql = 'SELECT square FROM backends_square WHERE root = %s'
+        models.Square.objects.create(root=2, square=4)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [2])
+            self.assertEqual(cursor.fetchall(), [(4,)])
+            first = cursor.cursor.cursor
+        for i in range(3):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [2])
+                self.assertIs(cursor.cursor.cursor, first)
+                self.assertEqual(cursor.fetchone(), (4,))
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses), (3, 1))
+        self.assertEqual(info.hit_ratio, 0.75)
+        # A cursor in use isn't handed out twice
+        with connection.cursor() as cursor, connection.cursor() as other:
+            cursor.execute(sql, [2])
+            cursor.fetchall()
+            other.execute(sql, [2])
+            self.assertIsNot(other.cursor.cursor, cursor.cursor.cursor)
+            self.assertEqual(other.fetchall(), [(4,)])
+        # At most `size` cursors stay open
+        with connection.cursor() as cursor:
+            for i in range(4):
+                cursor.execute('SELECT %s + ' + str(i), [i])
+        self.assertEqual(cache_info().currsize, 2)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific cursor cache")
+    def test_with_block_releases_cursor(self):
+        from django_pyodbc.cursorcache import cache_info
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT %s', [1])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT %s', [1])
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses, info.busy), (1, 1, 0))
+        for i in range(5):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT %s + ' + str(i), [i])
+        self.assertEqual(cache_info().currsize, 2)
+
+
+class SqlServerInstrumentationTest(TestCase):
+
+    def setUp(self):
+        self._option = connection.instrumentation
+        connection.instrumentation = {}
+
+    def tearDown(self):
+        from django_pyodbc import instrumentation
+        connection.instrumentation = self._option
+        instrumentation._instruments.pop(connection.alias, None)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific instrumentation")
+    def test_events_and_stats(self):
+        from django_pyodbc import instrumentation
+        events = []
+        instrumentation.add_hook(events.append)
+        for i in range(3):
+            models.Square.objects.create(root=i, square=i ** 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT root, square FROM backends_square WHERE root >= %s', [1])
+            self.assertEqual(len(cursor.fetchall()), 2)
+        event = events[-1]
+        self.assertEqual((event.rows, event.result_sets, event.round_trips), (2, 1, 1))
+        self.assertGreater(event.bytes, 0)
+        self.assertGreater(event.execute_time, 0)
+        stats = instrumentation.query_stats()
+        self.assertEqual(stats[event.fingerprint]['count'], 1)
+        self.assertEqual(stats[event.fingerprint]['rows'], 2)
+        instrumentation.reset_stats()
+        self.assertEqual(instrumentation.query_stats(), {})
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific instrumentation")
+    def test_statements_are_recorded_without_a_next_statement(self):
+        from django_pyodbc import instrumentation
+        models.Square.objects.create(root=1, square=1)
+        # INSERTs run in a with block on Django 3.1
+        self.assertTrue(any('INSERT INTO [backends_square]' in fingerprint
+                            for fingerprint in instrumentation.query_stats()))
+        instrumentation.reset_stats()
+        cursor = connection.cursor()
+        cursor.execute('SELECT root FROM backends_square WHERE root = %s', [1])
+        self.assertEqual(cursor.fetchall(), [(1,)])
+        # recorded once the rows are all fetched, before the cursor is closed
+        stats = instrumentation.query_stats()
+        self.assertEqual([(s['count'], s['rows']) for s in stats.values()], [(1, 1)])
+        cursor.close()
+        self.assertEqual(list(instrumentation.query_stats().values())[0]['count'], 1)
+
+
+class SqlServerQueryBudgetTest(TestCase):
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific query budgets")
+    def test_round_trips_and_repeats(self):
+        from django_pyodbc.budget import BudgetExceeded, assert_query_budget
+        squares = [models.Square.objects.create(root=i, square=i ** 2) for i in range(5)]
+        with assert_query_budget(max_round_trips=5, max_repeats=5) as budget:
+            for square in squares:
+                models.Square.objects.get(pk=square.pk)
+        self.assertEqual(budget.round_trips, 5)
+        with self.assertRaises(BudgetExceeded):
+            with assert_query_budget(max_round_trips=4):
+                for square in squares:
+                    models.Square.objects.get(pk=square.pk)
+        with self.assertRaisesRegex(BudgetExceeded, 'single row query run 5 times'):
+            with assert_query_budget(max_repeats=3):
+                for square in squares:
+                    models.Square.objects.get(pk=square.pk)
+        with assert_query_budget(max_round_trips=1, max_repeats=2):
+            self.assertEqual(len(models.Square.objects.filter(pk__in=[s.pk for s in squares])), 5)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    class FakeConnection(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def _pool(self, **options):
+        from django_pyodbc.pool import ConnectionPool
+        return ConnectionPool(self.FakeConnection, **options)
+
+    def test_checkin_reuses(self):
+        pool = self._pool()
+        first, created = pool.checkout()
+        self.assertTrue(created)
+        pool.checkin(first)
+        second, created = pool.checkout()
+        self.assertIs(second, first)
+        self.assertFalse(created)
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['creates'], stats['in_use']), (1, 1, 1))
+
+    def test_timeout(self):
+        pool = self._pool(max_size=1, timeout=0.01)
+        connection, created = pool.checkout()
+        self.assertRaises(OperationalError, pool.checkout)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.checkin(connection)
+        self.assertIs(pool.checkout()[0], connection)
+
+    def test_failed_ping_replaces(self):
+        pool = self._pool(ping_interval=-1, ping=lambda connection: False)
+        first, created = pool.checkout()
+        pool.checkin(first)
+        second, created = pool.checkout()
+        self.assertIsNot(second, first)
+        self.assertTrue(created)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_failed_reset_discards(self):
+        def reset(connection):
+            raise DatabaseError()
+        pool = self._pool(reset=reset)
+        first, created = pool.checkout()
+        pool.checkin(first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertIsNot(pool.checkout()[0], first)
+
+    def test_clear(self):
+        pool = self._pool()
+        idle, created = pool.checkout()
+        in_use, created = pool.checkout()
+        pool.checkin(idle)
+        pool.clear()
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+        # Closed when returned, as it predates clear()
+        pool.checkin(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_min_size(self):
+        pool = self._pool(min_size=2)
+        pool.fill()
+        self.assertEqual(pool.stats()['idle'], 2)
+        connection, created = pool.checkout()
+        # Opened by fill(), so its session still needs setting up
+        self.assertTrue(created)
+        pool.checkin(connection)
+        self.assertEqual(pool.checkout(), (connection, False))
+        self.assertEqual(pool.stats()['size'], 2)
+
+    def test_get_pool_after_fork(self):
+        from django_pyodbc import pool
+        key = ('pool-test', os.getpid())
+        try:
+            first = pool.get_pool(key, self.FakeConnection)
+            self.assertIs(pool.get_pool(key, self.FakeConnection), first)
+            # As inherited from a parent process
+            first.pid = -1
+            second = pool.get_pool(key, self.FakeConnection)
+            self.assertIsNot(second, first)
+            self.assertIs(pool.all_pools()[key], second)
+        finally:
+            pool._pools.pop(key, None)
+
+
+class ChunkedCursorTest(unittest.TestCase):
+
+    class FakeCursor(object):
+        description = None
+
+        def __init__(self, rows):
+            self.rows = rows
+            self.fetches = []
+            self.closed = False
+
+        def execute(self, sql, *params):
+            self.description = (('n', int, None, 10, 10, 0, False),)
+            self.position = 0
+            return self
+
+        def fetchmany(self, size):
+            self.fetches.append(size)
+            rows = self.rows[self.position:self.position + size]
+            self.position += len(rows)
+            return rows
+
+        def fetchall(self):
+            rows = self.rows[self.position:]
+            self.position = len(self.rows)
+            return rows
+
+        def close(self):
+            self.closed = True
+
+    def test_streaming_cursor(self):
+        from django_pyodbc.base import StreamingCursorWrapper
+        released = []
+        cursor = StreamingCursorWrapper(self.FakeCursor([(i,) for i in range(250)]), True,
+                                        arraysize=100, release=lambda: released.append(True))
+        cursor.execute('SELECT n FROM t')
+        self.assertEqual(len(list(cursor)), 250)
+        self.assertEqual(cursor.cursor.fetches, [100, 100, 100, 100])
+        cursor.close()
+        cursor.close()
+        self.assertEqual(released, [True])
+        self.assertTrue(cursor.cursor.closed)
+
+    def test_streaming_cursor_auto_arraysize(self):
+        from django_pyodbc.base import StreamingCursorWrapper
+        # 26 bytes per row of one 10 byte column
+        cursor = StreamingCursorWrapper(self.FakeCursor([]), True, arraysize='auto',
+                                        memory=26 * 1000)
+        cursor.execute('SELECT n FROM t')
+        self.assertEqual(cursor.fetchmany(), [])
+        self.assertEqual(cursor.cursor.fetches, [1000])
+
+    def test_buffered_cursor(self):
+        from django_pyodbc.base import BufferedCursorWrapper
+        cursor = BufferedCursorWrapper(self.FakeCursor([(i,) for i in range(5)]), True)
+        # Nothing to read before a statement is executed
+        self.assertEqual(cursor.fetchone(), [])
+        self.assertEqual(cursor.fetchall(), [])
+        cursor.execute('SELECT n FROM t')
+        # Everything is read on execute()
+        self.assertEqual(cursor.cursor.position, 5)
+        self.assertEqual(cursor.fetchone(), (0,))
+        self.assertEqual(cursor.fetchmany(2), [(1,), (2,)])
+        self.assertEqual(cursor.fetchall(), [(3,), (4,)])
+        self.assertEqual(cursor.fetchone(), [])
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific chunked reads")
+    def test_buffered_in_transaction(self):
+        from django_pyodbc.base import BufferedCursorWrapper
+        chunked_reads = connection.chunked_reads
+        connection.chunked_reads = {}
+        try:
+            with transaction.atomic():
+                with self.assertWarns(RuntimeWarning):
+                    cursor = connection.chunked_cursor()
+                # Wrapped like the cursors of cursor()
+                self.assertIsInstance(cursor, type(connection.cursor()))
+                self.assertIsInstance(cursor.cursor, BufferedCursorWrapper)
+                cursor.close()
+        finally:
+            connection.chunked_reads = chunked_reads
+
+
+class PyformatTranslationTest(unittest.TestCase):
+
+    def test_long_sql_not_cached(self):
+        from django_pyodbc.base import _cached_translate_pyformat, CursorWrapper
+        from django_pyodbc.compat import SQL_CACHE_MAX_LENGTH
+        cursor = CursorWrapper(None, True)
+        sql = 'SELECT %(a)s, %(b)s, %(a)s'
+        self.assertEqual(cursor.format_pyformat(sql, {'a': 1, 'b': 2}),
+                         ('SELECT ?, ?, ?', [1, 2, 1]))
+        currsize = _cached_translate_pyformat.cache_info().currsize
+        long_sql = sql + ' ' * SQL_CACHE_MAX_LENGTH
+        self.assertEqual(cursor.format_pyformat(long_sql, {'a': 1, 'b': 2})[1], [1, 2, 1])
+        self.assertEqual(_cached_translate_pyformat.cache_info().currsize, currsize)
+
+
+class SqlServerFingerprintTest(unittest.TestCase):
+
+    def test_normalize(self):
+        from django_pyodbc.fingerprint import normalize
+        self.assertEqual(
+            normalize("SELECT TOP 21 [t].[c1] FROM [t] WHERE [t].[a] IN (?, ?, ?) "
+                      "AND [t].[b] = N'it''s' /* tag */ AND U0.[n] > 1.5"),
+            "SELECT TOP ? [t].[c1] FROM [t] WHERE [t].[a] IN (...) "
+            "AND [t].[b] = ? AND U0.[n] > ?")
+        self.assertEqual(normalize("SELECT [t].[a] FROM [t] WHERE [t].[a] IN (?)"),
+                         normalize("SELECT [t].[a]\n  FROM [t] WHERE [t].[a] IN (?, ?)"))
+        paged = ("SELECT [AAAA].[id], _row_num FROM ( SELECT ROW_NUMBER() OVER "
+                 "( ORDER BY [AAAA].[id] ASC) as _row_num, [AAAA].[id] FROM "
+                 "( SELECT [t].[id] FROM [t] ) AS [AAAA]) as QQQ where %d < _row_num "
+                 "and _row_num <= %d")
+        self.assertEqual(normalize(paged % (0, 20)), normalize(paged % (40, 60)))
+        self.assertEqual(
+            normalize(paged % (0, 20)),
+            "SELECT [id] FROM ( SELECT ROW_NUMBER() OVER ( ORDER BY [id] ASC), [id] FROM "
+            "( SELECT [t].[id] FROM [t] )) where ? < ROW_NUMBER() and ROW_NUMBER() <= ?")
+
+    def test_histogram(self):
+        from django_pyodbc.metrics import Histogram, prometheus_text
+        histogram = Histogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000.0)
+        for quantile in (0.5, 0.95, 0.99):
+            self.assertAlmostEqual(histogram.percentile(quantile), quantile,
+                                   delta=quantile / 2 ** (histogram.precision - 1))
+        self.assertEqual(histogram.count, 1000)
+        text = prometheus_text({'SELECT ?': histogram})
+        self.assertIn('django_pyodbc_query_duration_seconds_count{database="default",', text)
+        self.assertIn('statement="SELECT ?"', text)
+
+    def test_sample_rate(self):
+        from django_pyodbc.instrumentation import Instrumentation, Recorder
+
+        class Cursor(object):
+            description = None
+
+            def execute(self, sql, params):
+                pass
+
+        for sample_rate, count in ((0, 0), (1, 3)):
+            instruments = Instrumentation('default', {'sample_rate': sample_rate})
+            recorder = Recorder('default', instruments)
+            for i in range(3):
+                if recorder.start():
+                    recorder.execute(Cursor(), 'UPDATE t SET a = ?', [i])
+            recorder.finish()
+            self.assertEqual(sum(stats.count for stats in instruments.stats.values()), count)
+        # Still timed for query budgets, but left out of the stats
+        instruments = Instrumentation('default', {'sample_rate': 0})
+        recorder = Recorder('default', instruments, budgets=True)
+        self.assertTrue(recorder.start())
+        recorder.execute(Cursor(), 'UPDATE t SET a = ?', [1])
+        recorder.finish()
+        self.assertEqual(instruments.stats, {})
+
+
+class SqlServerSlowPlansTest(TestCase):
+
+    def test_analyze(self):
+        from django_pyodbc.plans import analyze, is_select
+        plan = (
+            '<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan">'
+            '<BatchSequence><Batch><Statements><StmtSimple StatementSubTreeCost="1.0"><QueryPlan>'
+            '<Warnings><PlanAffectingConvert ConvertIssue="Seek Plan" '
+            'Expression="CONVERT_IMPLICIT(nvarchar(10),[t].[code],0)=[@P1]"/></Warnings>'
+            '<RelOp PhysicalOp="Nested Loops" EstimatedTotalSubtreeCost="1.0" EstimateRows="10">'
+            '<NestedLoops>'
+            '<RelOp PhysicalOp="Index Scan" EstimatedTotalSubtreeCost="0.6" EstimateRows="10">'
+            '<RunTimeInformation><RunTimeCountersPerThread Thread="0" ActualRows="900"/>'
+            '</RunTimeInformation><IndexScan><Object Schema="[dbo]" Table="[t]" Index="[ix]"/>'
+            '</IndexScan><Warnings><SpillToTempDb SpillLevel="1"/></Warnings></RelOp>'
+            '<RelOp PhysicalOp="Clustered Index Seek" EstimatedTotalSubtreeCost="0.38" '
+            'EstimateRows="1"><IndexScan Lookup="1"><Object Schema="[dbo]" Table="[t]" '
+            'Index="[pk]"/></IndexScan></RelOp>'
+            '</NestedLoops></RelOp></QueryPlan></StmtSimple></Statements></Batch>'
+            '</BatchSequence></ShowPlanXML>')
+        found = analyze(plan)
+        self.assertEqual([(o['op'], o['object']) for o in found['operators']],
+                         [('Index Scan', '[dbo].[t].[ix]'), ('Key Lookup', '[dbo].[t].[pk]')])
+        self.assertAlmostEqual(found['operators'][0]['share'], 0.6)
+        self.assertEqual(found['operators'][0]['actual_rows'], 900)
+        self.assertEqual(found['scans'], ['[dbo].[t].[ix]'])
+        self.assertEqual(found['key_lookups'], ['[dbo].[t].[pk]'])
+        self.assertEqual(found['spills'], ['Index Scan [dbo].[t].[ix]'])
+        self.assertEqual(found['implicit_conversions'],
+                         ['CONVERT_IMPLICIT(nvarchar(10),[t].[code],0)=[@P1]'])
+        self.assertTrue(is_select('/* a:b: */ SELECT [t].[a] FROM [t]'))
+        self.assertFalse(is_select('SELECT [t].[a] INTO [u] FROM [t]'))
+        self.assertFalse(is_select('UPDATE [t] SET [a] = 1'))
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific plan capture")
+    def test_rerun(self):
+        import shutil
+        import tempfile
+        from django_pyodbc import plans
+        directory = tempfile.mkdtemp()
+        connection.slow_plans = {'threshold': 0, 'directory': directory}
+        plans._captures.pop(connection.alias, None)
+        try:
+            models.Square.objects.create(root=2, square=4)
+            self.assertEqual(list(models.Square.objects.filter(root=2).values_list(
+                'square', flat=True)), [4])
+            captured = plans.captures(directory=directory)
+            self.assertEqual(captured[0]['mode'], 'rerun')
+            self.assertEqual(captured[0]['params'], [2])
+            self.assertIn('[backends_square]',
+                          plans.analyze(captured[0]['plans'][0])['scans'][0])
+        finally:
+            connection.slow_plans = None
+            plans._captures.pop(connection.alias, None)
+            shutil.rmtree(directory)
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific plan capture")
+    def test_sampled_statement_leaves_session_clean(self):
+        import shutil
+        import tempfile
+        from django_pyodbc import plans
+        directory = tempfile.mkdtemp()
+        connection.slow_plans = {'threshold': 0, 'sample_rate': 1.0, 'directory': directory}
+        plans._captures.pop(connection.alias, None)
+        try:
+            models.Square.objects.create(root=3, square=9)
+            sampled = connection.cursor()
+            sampled.execute('SELECT root FROM backends_square WHERE root = %s', [3])
+            self.assertEqual(sampled.fetchone(), (3,))
+            # drop the results, plan included, without the wrapper reading them
+            sampled.cursor.close()
+            connection.slow_plans = None
+            other = connection.cursor()
+            other.execute('SELECT square FROM backends_square WHERE root = %s', [3])
+            self.assertEqual(other.fetchall(), [(9,)])
+            self.assertFalse(other.nextset())
+        finally:
+            connection.slow_plans = None
+            plans._captures.pop(connection.alias, None)
+            shutil.rmtree(directory)
+
+
+class SqlServerSQLTagsTest(TestCase):
+
+    def test_comment(self):
+        from django_pyodbc.tagging import get_tags, tag, tag_sql
+        self.assertEqual(get_tags('books', 'detail', 'books.Book').comment,
+                         '/* books:detail:books.Book */ ')
+        self.assertEqual(get_tags('books', 'x */ DROP').comment, '/* books:x_DROP: */ ')
+        self.assertEqual(tag_sql('SELECT 1'), 'SELECT 1')
+        with tag('books', 'detail'):
+            self.assertEqual(tag_sql('SELECT 1'), '/* books:detail: */ SELECT 1')
+            # Not tagged twice
+            self.assertEqual(tag_sql('/* books:detail: */ SELECT 1'), '/* books:detail: */ SELECT 1')
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific SQL comment tags")
+    def test_tagged_statements(self):
+        from django_pyodbc import tagging
+        connection.sql_tags = {}
+        try:
+            with tagging.tag('backends', 'test'), tagging.model(models.Square):
+                cursor = connection.cursor()
+                cursor.execute('SELECT 1')
+                self.assertEqual(cursor.last_sql, '/* backends:test:backends.Square */ SELECT 1')
+        finally:
+            connection.sql_tags = None
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        self.assertEqual(cursor.last_sql, 'SELECT 1')
+
+    @unittest.skipUnless(connection.vendor == 'microsoft',
+                         "SQL Server specific SQL comment tags")
+    def test_tagged_compiled_sql(self):
+        from django_pyodbc import querycache, tagging
+        connection.sql_tags = {}
+        compiled_sql_cache = connection.compiled_sql_cache
+        connection.compiled_sql_cache = {}
+        try:
+            statements = []
+            for view in ('first', 'first', 'second'):
+                with tagging.tag('backends', view):
+                    with CaptureQueriesContext(connection) as captured:
+                        list(models.Square.objects.filter(root=1))
+                    statements.append(captured.captured_queries[0]['sql'])
+            self.assertTrue(statements[0].startswith('/* backends:first:backends.Square */ SELECT'))
+            self.assertEqual(statements[1], statements[0])
+            self.assertTrue(statements[2].startswith('/* backends:second:backends.Square */ SELECT'))
+            self.assertEqual(querycache.get_cache(connection).info().hits, 1)
+        finally:
+            connection.sql_tags = None
+            connection.compiled_sql_cache = compiled_sql_cache
+            querycache._caches.pop(connection.alias, None)
+
+
+class SqlServerAliasColumnsTest(unittest.TestCase):
+
+    def test_alias_columns(self):
+        from django_pyodbc.compiler import _alias_columns
+        outer, inner = _alias_columns(
+            "[t].[a], 'x, FROM [y]' AS [b], (SELECT MAX([u].[a]) FROM [u]) AS [a], "
+            "COUNT([t].[a]) AS [n] FROM [t] WHERE ([t].[a] = %s)", '[', ']')
+        self.assertEqual(outer, '[a], [b], [a___1], [n]')
+        self.assertEqual(inner,
+            "[t].[a], 'x, FROM [y]' AS [b], (SELECT MAX([u].[a]) FROM [u]) as [a___1], "
+            "COUNT([t].[a]) AS [n] FROM [t] WHERE ([t].[a] = %s)")
+
+    def test_db2_quotes(self):
+        from django_pyodbc.compiler import _alias_columns
+        self.assertEqual(_alias_columns('{t}.{a}, {u}.{a} FROM {t}', '{', '}'),
+                         ('{a}, {a___1}', '{t}.{a}, {u}.{a} as {a___1} FROM {t}'))
+
+    def test_split_without_from(self):
+        import time
+        from django_pyodbc.compiler import _split_select
+        # No top level ' FROM [' to end the scan; this used to backtrack
+        # exponentially in the length of the last word
+        sql = "[t].[a], COALESCE([t].[b], 'it''s') AS [c], " + 'x' * 5000
+        started = time.time()
+        columns, rest = _split_select(sql, '[', ']')
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(columns, ['[t].[a]', "COALESCE([t].[b], 'it''s') AS [c]", 'x' * 5000])
+        self.assertEqual(rest, '')
+        # Unterminated literals and names end at the end of the text
+        self.assertEqual(_split_select("'a, b FROM [t]", '[', ']'), (["'a, b FROM [t]"], ''))
+
+
 class EscapingChecks(TestCase):
     """
     All tests in this test case are also run with settings.DEBUG=True in
@@ -23,3 +23,8 @@ class State(models.Model):
 class TwoFields(models.Model):
     f1 = models.IntegerField(unique=True)
     f2 = models.IntegerField(unique=True)
+
+class Registration(models.Model):
+    code = models.CharField(max_length=2)
+    name = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True)
@@ -1,12 +1,15 @@
 from __future__ import absolute_import
 
+from itertools import product
 from operator import attrgetter
+from string import ascii_uppercase, digits
 
 from django.db import connection
 from django.test import TestCase, skipIfDBFeature, skipUnlessDBFeature
 from django.test.utils import override_settings
+from django.utils.unittest import skipUnless
 
-from .models import Country, Restaurant, Pizzeria, State, TwoFields
+from .models import Country, Registration, Restaurant, Pizzeria, State, TwoFields
 
 
 class BulkCreateTests(TestCase):
@@ -165,3 +168,106 @@ class BulkCreateTests(TestCase):
         TwoFields.objects.all().delete()
         with self.assertNumQueries(1):
             TwoFields.objects.bulk_create(objs, len(objs))
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific INSERT limits")
+    def test_sql_server_insert_limits(self):
+        # At most 1000 rows per VALUES list, even with a larger batch_size
+        objs = [TwoFields(f1=i, f2=i) for i in range(0, 2500)]
+        with self.assertNumQueries(3):
+            TwoFields.objects.bulk_create(objs, len(objs))
+        self.assertEqual(TwoFields.objects.count(), len(objs))
+        # ... and fewer than 2100 parameters per statement
+        self.assertEqual(connection.ops.max_insert_rows([None] * 3), 699)
+
+    @skipUnlessDBFeature('can_return_ids_from_bulk_insert')
+    def test_set_pk_and_insert_order(self):
+        objs = [TwoFields(f1=i, f2=-i) for i in range(0, 1500)]
+        TwoFields.objects.bulk_create(objs)
+        self.assertEqual(dict(TwoFields.objects.values_list('pk', 'f1')),
+                         dict((obj.pk, obj.f1) for obj in objs))
+
+
+class BulkUpsertTests(TestCase):
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific MERGE")
+    def test_bulk_upsert(self):
+        from django_pyodbc.bulk import bulk_upsert
+        Country.objects.create(name="Netherlands", iso_two_letter="NL")
+        inserted, updated = bulk_upsert(Country, [
+            Country(name="The Netherlands", iso_two_letter="NL"),
+            Country(name="Germany", iso_two_letter="DE"),
+        ], unique_fields=['iso_two_letter'])
+        self.assertEqual((inserted, updated), (1, 1))
+        self.assertQuerysetEqual(Country.objects.order_by("name"), [
+            "Germany", "The Netherlands"
+        ], attrgetter("name"))
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific MERGE")
+    def test_bulk_upsert_insert_only(self):
+        from django_pyodbc.bulk import bulk_upsert
+        Country.objects.create(name="Netherlands", iso_two_letter="NL")
+        # more rows than fit in one MERGE
+        codes = [''.join(c) for c in product(ascii_uppercase + digits, repeat=2)]
+        objs = [Country(name="Country %s" % code, iso_two_letter=code) for code in codes]
+        inserted, updated = bulk_upsert(Country, objs, ['iso_two_letter'], update_fields=[])
+        self.assertEqual((inserted, updated), (len(codes) - 1, 0))
+        self.assertEqual(Country.objects.get(iso_two_letter="NL").name, "Netherlands")
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific MERGE")
+    def test_bulk_upsert_keeps_auto_now_add(self):
+        from django_pyodbc.bulk import bulk_upsert
+        bulk_upsert(Registration, [Registration(code="NL", name="Netherlands")], ['code'])
+        created = Registration.objects.get(code="NL").created
+        inserted, updated = bulk_upsert(
+            Registration, [Registration(code="NL", name="The Netherlands")], ['code'])
+        self.assertEqual((inserted, updated), (0, 1))
+        registration = Registration.objects.get(code="NL")
+        self.assertEqual(registration.name, "The Netherlands")
+        self.assertEqual(registration.created, created)
+
+
+class BulkUpdateTests(TestCase):
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific UPDATE ... FROM")
+    def test_bulk_update(self):
+        from django_pyodbc.bulk import bulk_update
+        TwoFields.objects.bulk_create([TwoFields(f1=i, f2=i) for i in range(0, 1500)])
+        objs = list(TwoFields.objects.all())
+        for obj in objs:
+            obj.f2 = -obj.f1
+        self.assertEqual(bulk_update(objs, ['f2']), len(objs))
+        self.assertEqual(TwoFields.objects.filter(f2__lt=0).count(), len(objs) - 1)
+        self.assertEqual(TwoFields.objects.get(f1=700).f2, -700)
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific UPDATE ... FROM")
+    def test_bulk_update_expressions(self):
+        from django.db.models import F
+        from django_pyodbc.bulk import bulk_update
+        TwoFields.objects.bulk_create([TwoFields(f1=i, f2=i) for i in range(0, 10)])
+        objs = list(TwoFields.objects.all())
+        for obj in objs:
+            obj.f2 = F('f1') + 100
+        # Updated with CASE expressions, still counting the rows
+        self.assertEqual(bulk_update(objs[:5] + [TwoFields(pk=-1, f1=-1, f2=F('f1'))], ['f2']), 5)
+        self.assertEqual(TwoFields.objects.filter(f2__gte=100).count(), 5)
+
+    @skipUnless(connection.vendor == 'microsoft',
+                "SQL Server specific parameter limit")
+    def test_bulk_update_expressions_batch_size(self):
+        from django.db.models import F
+        from django_pyodbc.bulk import bulk_update
+        TwoFields.objects.bulk_create([TwoFields(f1=i, f2=i) for i in range(0, 1000)])
+        objs = list(TwoFields.objects.all())
+        for obj in objs:
+            obj.f2 = -obj.f1 - 10000
+            obj.f1 = F('f1') + 10000
+        # Five parameters an object; batches sized for two would go over 2100
+        self.assertEqual(bulk_update(objs, ['f1', 'f2']), 1000)
+        self.assertEqual(TwoFields.objects.filter(f1__gte=10000, f2__lte=-10000).count(), 1000)
+        self.assertEqual(TwoFields.objects.get(f1=10700).f2, -10700)
@@ -308,3 +308,46 @@ class ModelPaginationTests(TestCase):
         )
         # After __getitem__ is called, object_list is a list
         self.assertIsInstance(p.object_list, list)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Tests for django_pyodbc's keyset pagination.
+    """
+
+    def setUp(self):
+        # Two articles per date, so the primary key breaks the ties
+        for x in range(1, 10):
+            a = Article(headline='Article %s' % x, pub_date=datetime(2005, 7, 1 + x // 2))
+            a.save()
+
+    def test_seek_pages(self):
+        from django_pyodbc.pagination import KeysetPaginator
+        paginator = KeysetPaginator(Article.objects.all(), 4, order_by=['-pub_date'])
+        expected = list(Article.objects.order_by('-pub_date', 'pk'))
+        seen = []
+        page = paginator.seek_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            seen.extend(page)
+            if not page.has_next():
+                break
+            page = paginator.seek_page(page.next_key())
+            self.assertTrue(page.has_previous())
+        self.assertEqual(seen, expected)
+
+    def test_seek_page_has_no_number(self):
+        from django_pyodbc.pagination import KeysetPaginator
+        page = KeysetPaginator(Article.objects.all(), 4).seek_page()
+        for method in (page.next_page_number, page.previous_page_number,
+                       page.start_index, page.end_index):
+            with self.assertRaises(InvalidPage) as raised:
+                method()
+            self.assertIn('next_key()', str(raised.exception))
+
+    def test_seek_after_object(self):
+        from django_pyodbc.pagination import seek
+        articles = list(Article.objects.order_by('pub_date', 'pk'))
+        self.assertEqual(list(seek(Article.objects.all(), articles[2], ['pub_date'])),
+                         articles[3:])
+        self.assertEqual(list(seek(Article.objects.all(), articles[-1], ['pub_date'])), [])